@@ -0,0 +1,181 @@
+import shutil
+import struct
+import time
+import zlib
+from io import RawIOBase
+from tempfile import SpooledTemporaryFile
+from typing import IO, NamedTuple
+
+# Compressed members are kept in memory up to this size before spilling to disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# Data is buffered up to this size before compressing, so that zlib is called with
+# blocks large enough to be worth releasing the GIL for
+COMPRESS_BUFFER_SIZE = 256 * 1024
+ZIP_VERSION = 20
+# The high byte of "version made by", marking the external attributes as unix
+# permissions as zipfile does
+ZIP_CREATE_SYSTEM_UNIX = 3
+ZIP_MAX_SIZE = 0xFFFFFFFF
+LOCAL_FILE_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_DIRECTORY_HEADER = struct.Struct("<4s6H3L5H2L")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4s4H2LH")
+
+
+class CompressedMember(NamedTuple):
+    name: str
+    file: IO[bytes]
+    crc: int
+    compressed_size: int
+    file_size: int
+
+
+class DeflateSpool:
+    """Deflate-compress the data of a zip file member into a spooled temporary file.
+
+    Members are compressed independently of the zip file they are written to, so
+    several members can be compressed at once on separate threads and then assembled
+    with write_compressed_members_to_zip_file.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compression_level: int = zlib.Z_DEFAULT_COMPRESSION,
+        max_size: int = SPOOL_MAX_SIZE,
+    ) -> None:
+        self.name = name
+        self.file: IO[bytes] = SpooledTemporaryFile(max_size=max_size)  # noqa: SIM115
+        self.compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+        self.crc = 0
+        self.file_size = 0
+        self.buffer: list[bytes] = []
+        self.buffer_size = 0
+
+    def write(self, data: bytes) -> int:
+        """Buffer data to be compressed and return the number of bytes written.
+
+        Args:
+            data: Uncompressed member data.
+        """
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= COMPRESS_BUFFER_SIZE:
+            self._compress_buffer()
+        return len(data)
+
+    def finish(self) -> CompressedMember:
+        """Flush the compressor and return the compressed member, ready to be copied."""
+        self._compress_buffer()
+        self.file.write(self.compressor.flush())
+        compressed_size = self.file.tell()
+        self.file.seek(0)
+        return CompressedMember(
+            self.name, self.file, self.crc, compressed_size, self.file_size
+        )
+
+    def _compress_buffer(self) -> None:
+        data = b"".join(self.buffer)
+        self.buffer.clear()
+        self.buffer_size = 0
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += len(data)
+        self.file.write(self.compressor.compress(data))
+
+
+def write_compressed_members_to_zip_file(
+    zip_file_object: IO[bytes] | RawIOBase,
+    members: list[CompressedMember],
+    date_time: time.struct_time | None = None,
+) -> int:
+    """Write deflate-compressed members to a zip file without recompressing them.
+
+    The zip file is written sequentially, so zip_file_object does not need to be
+    seekable. Zip64 is not supported, so a ValueError is raised before anything is
+    written if a member or the zip file would reach 4 GiB. The files of the members are
+    left open for the caller to close, also when writing fails. Returns the size of the
+    zip file.
+
+    Args:
+        zip_file_object: A writable binary file object for the zip file.
+        members: Compressed members, e.g. from DeflateSpool.finish.
+        date_time: The modification time of the members, defaults to the current
+        local time.
+    """
+    date_time = date_time or time.localtime()
+    dos_time = date_time.tm_hour << 11 | date_time.tm_min << 5 | date_time.tm_sec // 2
+    dos_date = (date_time.tm_year - 1980) << 9 | date_time.tm_mon << 5 | date_time.tm_mday
+    names = [member.name.encode("ascii") for member in members]
+    zip_size = END_OF_CENTRAL_DIRECTORY.size
+    for member, name in zip(members, names, strict=True):
+        if max(member.compressed_size, member.file_size) >= ZIP_MAX_SIZE:
+            message = f"Zip file member '{member.name}' exceeds the 4 GiB zip size limit"
+            raise ValueError(message)
+        zip_size += (
+            LOCAL_FILE_HEADER.size
+            + CENTRAL_DIRECTORY_HEADER.size
+            + 2 * len(name)
+            + member.compressed_size
+        )
+    if zip_size >= ZIP_MAX_SIZE:
+        message = "Zip file exceeds the 4 GiB zip size limit"
+        raise ValueError(message)
+    offset = 0
+    central_directory = []
+    for member, name in zip(members, names, strict=True):
+        central_directory.append(
+            CENTRAL_DIRECTORY_HEADER.pack(
+                b"PK\x01\x02",
+                ZIP_CREATE_SYSTEM_UNIX << 8 | ZIP_VERSION,
+                ZIP_VERSION,
+                0,
+                zlib.DEFLATED,
+                dos_time,
+                dos_date,
+                member.crc,
+                member.compressed_size,
+                member.file_size,
+                len(name),
+                0,
+                0,
+                0,
+                0,
+                0o600 << 16,
+                offset,
+            )
+            + name
+        )
+        local_file_header = (
+            LOCAL_FILE_HEADER.pack(
+                b"PK\x03\x04",
+                ZIP_VERSION,
+                0,
+                zlib.DEFLATED,
+                dos_time,
+                dos_date,
+                member.crc,
+                member.compressed_size,
+                member.file_size,
+                len(name),
+                0,
+            )
+            + name
+        )
+        zip_file_object.write(local_file_header)
+        shutil.copyfileobj(member.file, zip_file_object)
+        offset += len(local_file_header) + member.compressed_size
+    central_directory_size = sum(len(header) for header in central_directory)
+    for header in central_directory:
+        zip_file_object.write(header)
+    zip_file_object.write(
+        END_OF_CENTRAL_DIRECTORY.pack(
+            b"PK\x05\x06",
+            0,
+            0,
+            len(members),
+            len(members),
+            central_directory_size,
+            offset,
+            0,
+        )
+    )
+    return zip_size
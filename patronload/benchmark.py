@@ -0,0 +1,310 @@
+import datetime
+import json
+import platform
+import tracemalloc
+from collections.abc import Callable
+from copy import deepcopy
+from time import perf_counter
+from typing import IO, Any
+
+import click
+from bs4 import BeautifulSoup
+
+from patronload.config import STAFF_FIELDS, STUDENT_FIELDS, template_path
+from patronload.patron import (
+    KrbNameRegistry,
+    create_and_write_to_zip_file_in_memory,
+    expiry_and_purge_dates,
+    format_phone_number,
+    patrons_xml_string_from_records,
+    populate_common_fields,
+    populate_staff_fields,
+    populate_student_fields,
+)
+from patronload.synthetic import SyntheticPatrons
+
+BENCHMARK_SIZES = [1000, 10000, 100000, 500000]
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+# The BeautifulSoup benchmarks render a few hundred records per second, so by default
+# they are not run at sizes that would take hours
+SOUP_BENCHMARKS = [
+    "patrons_xml_string_from_records[staff,soup]",
+    "populate_staff_fields",
+    "populate_student_fields",
+]
+DEFAULT_SOUP_MAX_RECORDS = 10000
+
+# A benchmark prepares its input from synthetic rows and returns the timed function
+Benchmark = Callable[[SyntheticPatrons, int], Callable[[], Any]]
+
+
+def patrons_xml_string_benchmark(patron_type: str, render_mode: str) -> Benchmark:
+    def prepare(synthetic_patrons: SyntheticPatrons, records: int) -> Callable[[], Any]:
+        patron_records = synthetic_rows(synthetic_patrons, patron_type, records)
+        return lambda: patrons_xml_string_from_records(
+            patron_type, patron_records, KrbNameRegistry(), render_mode
+        )
+
+    return prepare
+
+
+def populate_fields_benchmark(patron_type: str) -> Benchmark:
+    populate_type_fields = (
+        populate_staff_fields if patron_type == "staff" else populate_student_fields
+    )
+    fields = STAFF_FIELDS if patron_type == "staff" else STUDENT_FIELDS
+
+    def prepare(synthetic_patrons: SyntheticPatrons, records: int) -> Callable[[], Any]:
+        patron_dicts = [
+            dict(zip(fields, patron_record, strict=True))
+            for patron_record in synthetic_rows(synthetic_patrons, patron_type, records)
+            if patron_record[2]
+        ]
+        with open(template_path(patron_type), encoding="utf8") as xml_template:
+            patron_template = BeautifulSoup(xml_template, "html.parser")
+        six_months, two_years = expiry_and_purge_dates()
+
+        def populate() -> None:
+            for patron_dict in patron_dicts:
+                populate_common_fields(
+                    populate_type_fields(deepcopy(patron_template), patron_dict),
+                    patron_dict,
+                    six_months,
+                    two_years,
+                )
+
+        return populate
+
+    return prepare
+
+
+def format_phone_number_benchmark(
+    synthetic_patrons: SyntheticPatrons, records: int
+) -> Callable[[], Any]:
+    phone_numbers = [
+        patron_record[STUDENT_FIELDS.index("TERM_PHONE1")] or ""
+        for patron_record in synthetic_rows(synthetic_patrons, "student", records)
+    ]
+    return lambda: [format_phone_number(phone_number) for phone_number in phone_numbers]
+
+
+def zip_file_in_memory_benchmark(
+    synthetic_patrons: SyntheticPatrons, records: int
+) -> Callable[[], Any]:
+    patrons_xml = patrons_xml_string_from_records(
+        "staff", synthetic_rows(synthetic_patrons, "staff", records), KrbNameRegistry()
+    )
+    return lambda: create_and_write_to_zip_file_in_memory("staff.xml", patrons_xml)
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "patrons_xml_string_from_records[staff]": patrons_xml_string_benchmark(
+        "staff", "compiled"
+    ),
+    "patrons_xml_string_from_records[student]": patrons_xml_string_benchmark(
+        "student", "compiled"
+    ),
+    "patrons_xml_string_from_records[staff,soup]": patrons_xml_string_benchmark(
+        "staff", "soup"
+    ),
+    "populate_staff_fields": populate_fields_benchmark("staff"),
+    "populate_student_fields": populate_fields_benchmark("student"),
+    "format_phone_number": format_phone_number_benchmark,
+    "create_and_write_to_zip_file_in_memory": zip_file_in_memory_benchmark,
+}
+
+
+def synthetic_rows(
+    synthetic_patrons: SyntheticPatrons, patron_type: str, records: int
+) -> list[tuple]:
+    """Return a number of synthetic rows of a patron type.
+
+    Args:
+        synthetic_patrons: The seeded generator of the rows.
+        patron_type: The type of patron record, staff or student.
+        records: The number of rows.
+    """
+    if patron_type == "staff":
+        return list(synthetic_patrons.staff_records(records))
+    return list(synthetic_patrons.student_records(records, staff_count=records))
+
+
+def run_benchmark(
+    name: str, synthetic_patrons: SyntheticPatrons, records: int, repeat: int
+) -> dict[str, Any]:
+    """Time a benchmark and measure its peak memory, returning the result.
+
+    The time is the best of the repeats. The peak memory is traced in a separate run,
+    as tracing slows the benchmark down, and only counts memory allocated by the
+    benchmark, not its prepared input.
+
+    Args:
+        name: The name of the benchmark, a key of BENCHMARKS.
+        synthetic_patrons: The seeded generator of the input rows.
+        records: The number of input rows.
+        repeat: The number of timed runs.
+    """
+    timed_function = BENCHMARKS[name](synthetic_patrons, records)
+    seconds = []
+    for _ in range(repeat):
+        start_time = perf_counter()
+        timed_function()
+        seconds.append(perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        timed_function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "benchmark": name,
+        "records": records,
+        "seconds": round(min(seconds), 6),
+        "records_per_second": round(records / min(seconds), 1) if min(seconds) else 0,
+        "peak_memory": peak_memory,
+    }
+
+
+def compare_results(
+    baseline: dict[str, Any], results: dict[str, Any], threshold: float
+) -> tuple[list[str], list[str]]:
+    """Compare benchmark results against a baseline.
+
+    Returns a line per benchmark and size in both, and the lines of the regressions,
+    where the time or peak memory grew by more than the threshold.
+
+    Args:
+        baseline: The benchmark results to compare against.
+        results: The benchmark results to compare.
+        threshold: The relative growth that is a regression, e.g. 0.1 for 10%.
+    """
+    baseline_results = {
+        (result["benchmark"], result["records"]): result for result in baseline["results"]
+    }
+    lines = []
+    regressions = []
+    for result in results["results"]:
+        baseline_result = baseline_results.get((result["benchmark"], result["records"]))
+        if not baseline_result:
+            continue
+        changes = {
+            measure: (result[measure] - baseline_result[measure])
+            / baseline_result[measure]
+            for measure in ["seconds", "peak_memory"]
+            if baseline_result[measure]
+        }
+        line = (
+            f"{result['benchmark']} x {result['records']}: "
+            f"{baseline_result['seconds']:.4f}s -> {result['seconds']:.4f}s "
+            f"({changes.get('seconds', 0):+.1%}), peak memory "
+            f"{baseline_result['peak_memory']} -> {result['peak_memory']} bytes "
+            f"({changes.get('peak_memory', 0):+.1%})"
+        )
+        if any(change > threshold for change in changes.values()):
+            line = f"REGRESSION {line}"
+            regressions.append(line)
+        lines.append(line)
+    return lines, regressions
+
+
+@click.group()
+def benchmark() -> None:
+    """Benchmark the hot paths of patronload with synthetic patron records."""
+
+
+@benchmark.command()
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default="benchmark_results.json",
+    help="JSON file the results are written to.",
+)
+@click.option(
+    "--size",
+    "sizes",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=BENCHMARK_SIZES,
+    help="Number of synthetic records, can be repeated.",
+)
+@click.option(
+    "--benchmark",
+    "benchmark_names",
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    default=list(BENCHMARKS),
+    help="Benchmark to run, can be repeated. Defaults to all of them.",
+)
+@click.option("--seed", type=int, default=0, help="Seed of the synthetic records.")
+@click.option(
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=3,
+    help="Number of timed runs, the fastest is recorded.",
+)
+@click.option(
+    "--soup_max_records",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SOUP_MAX_RECORDS,
+    help="Largest size the BeautifulSoup benchmarks are run at.",
+)
+def run(
+    *,
+    output: str,
+    sizes: tuple[int, ...],
+    benchmark_names: tuple[str, ...],
+    seed: int,
+    repeat: int,
+    soup_max_records: int,
+) -> None:
+    """Run the benchmarks at each size and write the results as JSON."""
+    synthetic_patrons = SyntheticPatrons(seed)
+    results = []
+    for name in benchmark_names:
+        for records in sizes:
+            if name in SOUP_BENCHMARKS and records > soup_max_records:
+                continue
+            result = run_benchmark(name, synthetic_patrons, records, repeat)
+            click.echo(
+                f"{name} x {records}: {result['seconds']:.4f}s, "
+                f"{result['records_per_second']} records/s, "
+                f"peak memory {result['peak_memory']} bytes"
+            )
+            results.append(result)
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(
+            {
+                "created": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+                "python": platform.python_version(),
+                "seed": seed,
+                "results": results,
+            },
+            results_file,
+            indent=2,
+        )
+    click.echo(f"Results written to '{output}'")
+
+
+@benchmark.command()
+@click.argument("baseline", type=click.File(encoding="utf-8"))
+@click.argument("results", type=click.File(encoding="utf-8"))
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_REGRESSION_THRESHOLD,
+    help="Relative growth in time or peak memory flagged as a regression.",
+)
+def compare(baseline: IO[str], results: IO[str], threshold: float) -> None:
+    """Compare results against a baseline, failing if any benchmark regressed."""
+    lines, regressions = compare_results(
+        json.load(baseline), json.load(results), threshold
+    )
+    for line in lines:
+        click.echo(line)
+    if regressions:
+        message = f"{len(regressions)} benchmarks regressed by more than {threshold:.0%}"
+        raise click.ClickException(message)
+
+
+if __name__ == "__main__":
+    benchmark()
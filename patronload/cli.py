@@ -1,10 +1,19 @@
 import datetime
 import logging
 import os
+import threading
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import nullcontext
 from time import perf_counter
+from typing import TYPE_CHECKING, Any
 
 import click
-from boto3 import client
 
 from patronload.config import (
     STAFF_FIELDS,
@@ -14,25 +23,290 @@ from patronload.config import (
     create_log_stream_for_email,
     load_config_values,
 )
+from patronload.data_source import DataSource, create_data_source
 from patronload.database import (
-    build_sql_query,
+    DEFAULT_ARRAYSIZE,
+    DEFAULT_PREFETCHROWS,
+    ORACLE_DRIVER_MODES,
     create_database_connection,
-    query_database,
 )
 from patronload.email import Email
+from patronload.fingerprint import FingerprintStore
+from patronload.fragment_cache import FragmentCache
+from patronload.metrics import ALL_PATRON_TYPES, RunMetrics, TimedWriter
 from patronload.patron import (
-    create_and_write_to_zip_file_in_memory,
-    patrons_xml_string_from_records,
+    RENDER_MODES,
+    KrbNameRegistry,
+    PatronRecordSpool,
+    PatronSetHash,
+    create_render_pool,
+    deduplicate_patron_records,
+    patrons_xml_from_records,
+    write_sharded_patrons_xml_to_zip_file,
+    write_xml_fragments_to_zip_file,
+)
+from patronload.profiling import (
+    DEFAULT_TOP_ALLOCATIONS,
+    StageProfiler,
+    profile_stage,
+)
+from patronload.s3 import (
+    MANIFEST_FILE_NAME,
+    S3MultipartUploadWriter,
+    delete_zip_files_from_bucket_with_prefix,
+    read_manifest,
+    write_manifest,
 )
-from patronload.s3 import delete_zip_files_from_bucket_with_prefix
+from patronload.snapshot import SnapshotDataSource, SnapshotStore
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
 
 logger = logging.getLogger(__name__)
 
+KRB_NAME_PREDICATE = "KRB_NAME_UPPERCASE IS NOT NULL"
+PATRON_QUERIES: dict[str, dict[str, Any]] = {
+    # If both a staff and student record exist for a given patron, only a staff
+    # record should be created in Alma. When patron types are processed one after
+    # another, staff records must be processed first to ensure this will happen, so
+    # we list staff first in this `dict`.
+    # The predicates exclude the rows that would be skipped anyway in the database,
+    # keyed by a description of the rows they exclude. Patron records are still
+    # deduplicated, as file data sources do not apply predicates.
+    "staff": {
+        "fields": STAFF_FIELDS,
+        "table": "LIBRARY_EMPLOYEE",
+        "predicates": {"without a KRB name": KRB_NAME_PREDICATE},
+    },
+    "student": {
+        "fields": STUDENT_FIELDS,
+        "table": "LIBRARY_STUDENT",
+        "predicates": {
+            "without a KRB name": KRB_NAME_PREDICATE,
+            "with the KRB name of a staff patron": (
+                "NOT EXISTS (SELECT 1 FROM LIBRARY_EMPLOYEE WHERE "
+                "LIBRARY_EMPLOYEE.KRB_NAME_UPPERCASE = "
+                "LIBRARY_STUDENT.KRB_NAME_UPPERCASE)"
+            ),
+        },
+    },
+}
+# Unchanged patron records are uploaded again after this long, so that the expiry
+# and purge dates in Alma do not fall too far behind
+MANIFEST_MAX_AGE = datetime.timedelta(days=7)
+
 
 @click.command()
 @click.option("-t", "--database_connection_test", is_flag=True)
-def main(database_connection_test: bool) -> None:  # noqa: FBT001
+@click.option(
+    "--data_source",
+    default="oracle",
+    envvar="DATA_SOURCE",
+    help="Source of the patron records: 'oracle' for the Data Warehouse, or "
+    "'sqlite://<path>', 'csv://<directory>' or 'parquet://<directory>'.",
+)
+@click.option(
+    "--snapshot_location",
+    default=None,
+    envvar="SNAPSHOT_LOCATION",
+    help="Local directory or s3:// URI where a compressed snapshot of each table is "
+    "written after it is queried.",
+)
+@click.option(
+    "--from_snapshot",
+    is_flag=True,
+    envvar="FROM_SNAPSHOT",
+    help="Replay the patron records from the snapshots instead of the data source.",
+)
+@click.option(
+    "--snapshot_ttl",
+    type=click.IntRange(min=1),
+    default=24,
+    envvar="SNAPSHOT_TTL_HOURS",
+    help="Age in hours after which snapshots are no longer replayed.",
+)
+@click.option(
+    "--render_mode",
+    type=click.Choice(RENDER_MODES),
+    default="compiled",
+    envvar="RENDER_MODE",
+    help="Render patron XML from the compiled templates or with BeautifulSoup.",
+)
+@click.option(
+    "--render_workers",
+    type=click.IntRange(min=1),
+    default=1,
+    envvar="RENDER_WORKERS",
+    help="Number of processes rendering patron XML, shared by the patron types, so a "
+    "run starts at most this many. 1 renders in the main process.",
+)
+@click.option(
+    "--xml_shards",
+    type=click.IntRange(min=1, max=50),
+    default=1,
+    envvar="XML_SHARDS",
+    help="Number of XML files per zip file, each rendered and compressed in parallel.",
+)
+@click.option(
+    "--upload_part_size",
+    type=click.IntRange(min=5),
+    default=8,
+    envvar="S3_UPLOAD_PART_SIZE_MB",
+    help="Size in MiB of each part of the multipart zip file uploads.",
+)
+@click.option(
+    "--upload_concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    envvar="S3_UPLOAD_CONCURRENCY",
+    help="Maximum number of zip file parts uploaded to S3 at once.",
+)
+@click.option(
+    "--fetch_arraysize",
+    type=click.IntRange(min=1),
+    default=DEFAULT_ARRAYSIZE,
+    envvar="FETCH_ARRAYSIZE",
+    help="Number of rows fetched from the Data Warehouse per round trip.",
+)
+@click.option(
+    "--fetch_prefetchrows",
+    type=click.IntRange(min=0),
+    default=DEFAULT_PREFETCHROWS,
+    envvar="FETCH_PREFETCHROWS",
+    help="Number of rows prefetched from the Data Warehouse when a query is executed.",
+)
+@click.option(
+    "--oracle_driver_mode",
+    type=click.Choice(ORACLE_DRIVER_MODES),
+    default="thick",
+    envvar="ORACLE_DRIVER_MODE",
+    help="python-oracledb driver mode: 'thick' loads the Oracle Instant Client, 'thin' "
+    "connects without it and 'auto' tries thin mode first and falls back to thick mode.",
+)
+@click.option(
+    "--concurrent_extraction/--sequential_extraction",
+    default=True,
+    envvar="CONCURRENT_EXTRACTION",
+    help="Extract and load staff and student patrons concurrently or one at a time.",
+)
+@click.option(
+    "--concurrent_s3_cleanup/--sequential_s3_cleanup",
+    default=True,
+    envvar="CONCURRENT_S3_CLEANUP",
+    help="Delete old zip files from S3 while the first Data Warehouse query runs.",
+)
+@click.option(
+    "--skip_unchanged/--upload_unchanged",
+    default=False,
+    envvar="SKIP_UNCHANGED_UPLOADS",
+    help="Skip the render and upload of a patron type whose records are unchanged "
+    "since the last upload recorded in the manifest.",
+)
+@click.option(
+    "--fingerprint_store",
+    default=None,
+    envvar="FINGERPRINT_STORE",
+    help="Local SQLite file or s3:// URI of the patron fingerprints of the last run. "
+    "When set, only new and changed patrons are loaded.",
+)
+@click.option(
+    "--force_full_load",
+    is_flag=True,
+    envvar="FORCE_FULL_LOAD",
+    help="Load every patron and refresh the fingerprint store.",
+)
+@click.option(
+    "--fragment_cache",
+    default=None,
+    envvar="FRAGMENT_CACHE",
+    help="Local SQLite file caching rendered patron XML fragments between runs.",
+)
+@click.option(
+    "--fragment_cache_size",
+    type=click.IntRange(min=1),
+    default=512,
+    envvar="FRAGMENT_CACHE_SIZE_MB",
+    help="Size in MiB the fragment cache is shrunk to after each run.",
+)
+@click.option(
+    "--partitions",
+    type=click.IntRange(min=1),
+    default=1,
+    envvar="EXTRACTION_PARTITIONS",
+    help="Number of hash partitions each table is fetched in, on parallel connections.",
+)
+@click.option(
+    "--emf_namespace",
+    default=None,
+    envvar="METRICS_EMF_NAMESPACE",
+    help="CloudWatch metrics namespace. When set, the run metrics are also written as "
+    "Embedded Metric Format lines.",
+)
+@click.option(
+    "--profile_directory",
+    default=None,
+    envvar="PROFILE_DIRECTORY",
+    help="Local directory where a cProfile and tracemalloc profile of each stage is "
+    "written. Profiled stages are run one at a time.",
+)
+@click.option(
+    "--profile_top_allocations",
+    type=click.IntRange(min=1),
+    default=DEFAULT_TOP_ALLOCATIONS,
+    envvar="PROFILE_TOP_ALLOCATIONS",
+    help="Number of allocating lines listed in the allocation profile of each stage.",
+)
+@click.option(
+    "--profile_s3_prefix",
+    default=None,
+    envvar="PROFILE_S3_PREFIX",
+    help="Prefix in the S3 bucket the profiles are uploaded under at the end of a run.",
+)
+def main(
+    *,
+    database_connection_test: bool,
+    data_source: str,
+    snapshot_location: str | None,
+    from_snapshot: bool,
+    snapshot_ttl: int,
+    concurrent_extraction: bool,
+    concurrent_s3_cleanup: bool,
+    skip_unchanged: bool,
+    fingerprint_store: str | None,
+    force_full_load: bool,
+    fragment_cache: str | None,
+    fragment_cache_size: int,
+    render_mode: str,
+    render_workers: int,
+    xml_shards: int,
+    upload_part_size: int,
+    upload_concurrency: int,
+    fetch_arraysize: int,
+    fetch_prefetchrows: int,
+    oracle_driver_mode: str,
+    partitions: int,
+    emf_namespace: str | None,
+    profile_directory: str | None,
+    profile_top_allocations: int,
+    profile_s3_prefix: str | None,
+) -> None:
+    if render_workers > 1 and xml_shards > 1:
+        message = "--render_workers and --xml_shards can not both be greater than 1"
+        raise click.UsageError(message)
+    if fragment_cache and render_workers > 1:
+        message = "--fragment_cache can not be combined with --render_workers above 1"
+        raise click.UsageError(message)
+    if skip_unchanged and fingerprint_store:
+        message = "--skip_unchanged can not be combined with --fingerprint_store"
+        raise click.UsageError(message)
+    if from_snapshot and not snapshot_location:
+        message = "--from_snapshot requires --snapshot_location"
+        raise click.UsageError(message)
+    if profile_s3_prefix and not profile_directory:
+        message = "--profile_s3_prefix requires --profile_directory"
+        raise click.UsageError(message)
     start_time = perf_counter()
+    run_metrics = RunMetrics()
     config_values = load_config_values()
     root_logger = logging.getLogger()
     logger.info(configure_logger(root_logger, os.getenv("LOG_LEVEL", "INFO")))
@@ -44,65 +318,611 @@ def main(database_connection_test: bool) -> None:  # noqa: FBT001
     )
     logger.info("Running patronload process")
 
-    connection = create_database_connection(config_values)
-    logger.info(
-        "Successfully connected to Oracle Database version: %s", connection.version
-    )
-    if not database_connection_test:
+    if database_connection_test and data_source == "oracle":
+        with run_metrics.stage("connect"):
+            connection = create_database_connection(
+                config_values, driver_mode=oracle_driver_mode
+            )
+        logger.info(
+            "Successfully connected to Oracle Database version: %s", connection.version
+        )
+    elif database_connection_test:
+        with run_metrics.stage("connect"):
+            description = create_data_source(data_source, config_values).describe()
+        logger.info("Successfully connected to %s", description)
+    else:
+        from boto3 import client  # noqa: PLC0415
+
         s3_client = client("s3")
-        delete_zip_files_from_bucket_with_prefix(
-            s3_client, config_values["S3_BUCKET_NAME"], config_values["S3_PREFIX"]
+        stage_profiler = (
+            StageProfiler(profile_directory, top_allocations=profile_top_allocations)
+            if profile_directory
+            else None
         )
-        existing_krb_names: list[str] = []
-        for patron_type, query_params in {
-            # If both a staff and student record exist for a given patron, only a staff
-            # record should be created in Alma. Staff records must be processed first to
-            # ensure this will happen, so we list staff first in this `dict`.
-            "staff": {"fields": STAFF_FIELDS, "table": "LIBRARY_EMPLOYEE"},
-            "student": {"fields": STUDENT_FIELDS, "table": "LIBRARY_STUDENT"},
-        }.items():
-            query = build_sql_query(
-                list(query_params["fields"]), str(query_params["table"])
-            )
-            patron_records = query_database(connection, query)
-            logger.info(
-                "%s %s patron records retrieved from Data Warehouse",
-                len(patron_records),
-                patron_type,
+        patron_fingerprints = None
+        if fingerprint_store:
+            patron_fingerprints = FingerprintStore(
+                fingerprint_store, s3_client, full_load=force_full_load
             )
-            date = datetime.datetime.now(tz=datetime.UTC)
-            file_name = f"{patron_type}_{date.strftime('%Y-%m-%d_%H.%M.%S')}"
-            zip_file_object = create_and_write_to_zip_file_in_memory(
-                f"{file_name}.xml",
-                patrons_xml_string_from_records(
-                    patron_type, patron_records, existing_krb_names
-                ),
+            patron_fingerprints.load()
+        manifest_key = f"{config_values['S3_PREFIX']}/{MANIFEST_FILE_NAME}"
+        manifest = (
+            read_manifest(s3_client, config_values["S3_BUCKET_NAME"], manifest_key)
+            if skip_unchanged
+            else {}
+        )
+        with ThreadPoolExecutor(max_workers=1) as cleanup_executor:
+            # When skipping unchanged uploads, the zip file of the last upload of each
+            # patron type is only deleted once the patron type is known to have changed
+            zip_file_cleanup = cleanup_executor.submit(
+                delete_zip_files_with_metrics,
+                run_metrics,
+                s3_client,
+                config_values["S3_BUCKET_NAME"],
+                config_values["S3_PREFIX"],
+                keep_keys={
+                    f"{config_values['S3_PREFIX']}/{manifest_entry['zip_file']}"
+                    for manifest_entry in manifest.values()
+                },
+                stage_profiler=stage_profiler,
             )
-            logger.info("XML data created and zipped for %s patrons ", patron_type)
-            s3_client.put_object(
-                Body=zip_file_object.getvalue(),
-                Bucket=config_values["S3_BUCKET_NAME"],
-                Key=f"{config_values['S3_PREFIX']}/{file_name}.zip",
+            if not concurrent_s3_cleanup:
+                zip_file_cleanup.result()
+            snapshot_store = (
+                SnapshotStore(
+                    snapshot_location,
+                    s3_client,
+                    ttl=datetime.timedelta(hours=snapshot_ttl),
+                )
+                if snapshot_location
+                else None
             )
-            logger.info(
-                "'%s' uploaded to S3 bucket '%s'",
-                file_name + ".zip",
-                config_values["S3_BUCKET_NAME"],
+            # The staff KRB names are reserved from the unrecorded data source, so
+            # that only the full patron queries are written to the snapshots
+            patron_data_source: DataSource
+            reservation_data_source: DataSource
+            with (
+                profile_stage(stage_profiler, "connect"),
+                run_metrics.stage("connect"),
+            ):
+                if from_snapshot and snapshot_store:
+                    patron_data_source = reservation_data_source = SnapshotDataSource(
+                        snapshot_store
+                    )
+                else:
+                    reservation_data_source = create_data_source(
+                        data_source,
+                        config_values,
+                        pool_size=len(PATRON_QUERIES) * partitions,
+                        arraysize=fetch_arraysize,
+                        prefetchrows=fetch_prefetchrows,
+                        driver_mode=oracle_driver_mode,
+                    )
+                    patron_data_source = (
+                        SnapshotDataSource(snapshot_store, reservation_data_source)
+                        if snapshot_store
+                        else reservation_data_source
+                    )
+                description = patron_data_source.describe()
+            logger.info("Successfully connected to %s", description)
+            krb_name_registry = KrbNameRegistry()
+            if concurrent_extraction:
+                # Reserve the staff KRB names before the student records are processed
+                # so that student employees are still only created as staff
+                with (
+                    profile_stage(stage_profiler, "reserve"),
+                    run_metrics.stage("reserve", "staff") as reserve_metrics,
+                ):
+                    krb_name_registry.reserve(
+                        (
+                            krb_name
+                            for (krb_name,) in reservation_data_source.query(
+                                ["KRB_NAME_UPPERCASE"],
+                                "LIBRARY_EMPLOYEE",
+                                predicates=[KRB_NAME_PREDICATE],
+                            )
+                            if krb_name
+                        ),
+                        "staff",
+                    )
+                    reserve_metrics.records = len(krb_name_registry.reserved)
+                logger.info(
+                    "%s staff KRB names reserved", len(krb_name_registry.reserved)
+                )
+            # The old zip files must be deleted before the new ones are uploaded
+            zip_file_cleanup.result()
+        date = datetime.datetime.now(tz=datetime.UTC)
+        patron_fragments = (
+            FragmentCache(fragment_cache, max_size=fragment_cache_size * 1024 * 1024)
+            if fragment_cache
+            else None
+        )
+        # Set when a patron type fails, so that the other patron types stop and abort
+        # their uploads rather than leave Alma with a load of only some patron types
+        load_failed = threading.Event()
+        with (
+            # The patron types share one render pool, so a concurrent run starts at
+            # most render_workers render processes
+            (
+                create_render_pool(render_workers)
+                if render_workers > 1
+                else nullcontext()
+            ) as render_pool,
+            ThreadPoolExecutor(
+                max_workers=len(PATRON_QUERIES) if concurrent_extraction else 1
+            ) as executor,
+        ):
+            patron_zip_files = {
+                patron_type: executor.submit(
+                    create_and_upload_patron_zip_file,
+                    patron_type,
+                    data_source=patron_data_source,
+                    s3_client=s3_client,
+                    config_values=config_values,
+                    krb_name_registry=krb_name_registry,
+                    date=date,
+                    render_mode=render_mode,
+                    render_workers=render_workers,
+                    render_pool=render_pool,
+                    xml_shards=xml_shards,
+                    partitions=partitions,
+                    upload_part_size=upload_part_size,
+                    upload_concurrency=upload_concurrency,
+                    skip_unchanged=skip_unchanged,
+                    previous_manifest_entry=manifest.get(patron_type),
+                    fingerprint_store=patron_fingerprints,
+                    fragment_cache=patron_fragments,
+                    run_metrics=run_metrics,
+                    stage_profiler=stage_profiler,
+                    load_failed=load_failed,
+                )
+                for patron_type in PATRON_QUERIES
+            }
+            for patron_zip_file in patron_zip_files.values():
+                # Done callbacks run on the worker thread before it takes the next
+                # patron type, so a queued patron type sees the failure and does not
+                # start
+                patron_zip_file.add_done_callback(
+                    lambda future: (
+                        load_failed.set()
+                        if not future.cancelled() and future.exception()
+                        else None
+                    )
+                )
+            wait(patron_zip_files.values(), return_when=FIRST_EXCEPTION)
+            try:
+                for patron_type, patron_zip_file in patron_zip_files.items():
+                    manifest[patron_type] = patron_zip_file.result()
+            except Exception:
+                executor.shutdown(cancel_futures=True)
+                raise
+        if skip_unchanged:
+            write_manifest(
+                s3_client, config_values["S3_BUCKET_NAME"], manifest_key, manifest
             )
+        if patron_fingerprints:
+            patron_fingerprints.save()
+        if patron_fragments:
+            patron_fragments.close()
 
-        email = Email()
-        email.populate(
-            from_address=config_values["SES_SEND_FROM_EMAIL"],
-            to_addresses=",".join([config_values["SES_RECIPIENT_EMAIL"]]),
-            subject=(
-                f"{config_values['WORKSPACE'].upper()} "
-                f"Patronload file creation {date.strftime('%Y-%m-%d')}"
-            ),
-            body=stream.getvalue(),
-        )
-        logger.info(email.send())
+        with (
+            profile_stage(stage_profiler, "email"),
+            run_metrics.stage("email") as email_metrics,
+        ):
+            email = Email()
+            email_body = stream.getvalue()
+            email.populate(
+                from_address=config_values["SES_SEND_FROM_EMAIL"],
+                to_addresses=",".join([config_values["SES_RECIPIENT_EMAIL"]]),
+                subject=(
+                    f"{config_values['WORKSPACE'].upper()} "
+                    f"Patronload file creation {date.strftime('%Y-%m-%d')}"
+                ),
+                body=email_body,
+            )
+            email_response = email.send()
+            email_metrics.records = 1
+            email_metrics.bytes_out = len(email_body.encode("utf-8"))
+        logger.info(email_response)
+        if stage_profiler:
+            stage_profiler.close()
+            if profile_s3_prefix:
+                stage_profiler.upload(
+                    s3_client, config_values["S3_BUCKET_NAME"], profile_s3_prefix
+                )
 
     logger.info(
         "Total time to complete process: %s",
         str(datetime.timedelta(seconds=perf_counter() - start_time)),
     )
+    # The run metrics are written to stdout rather than logged, so that each JSON
+    # record is a log event of its own and is not included in the email
+    click.echo(run_metrics.to_json_lines(config_values["WORKSPACE"], emf_namespace))
+
+
+def create_and_upload_patron_zip_file(
+    patron_type: str,
+    *,
+    data_source: DataSource,
+    s3_client: "S3Client",
+    config_values: dict,
+    krb_name_registry: KrbNameRegistry,
+    date: datetime.datetime,
+    render_mode: str,
+    render_workers: int,
+    render_pool: ProcessPoolExecutor | None,
+    xml_shards: int,
+    partitions: int,
+    upload_part_size: int,
+    upload_concurrency: int,
+    skip_unchanged: bool,
+    previous_manifest_entry: dict | None,
+    fingerprint_store: FingerprintStore | None,
+    fragment_cache: FragmentCache | None,
+    run_metrics: RunMetrics,
+    stage_profiler: StageProfiler | None = None,
+    load_failed: threading.Event | None = None,
+) -> dict:
+    """Query, render, zip and upload the patron records of one patron type.
+
+    Returns the manifest entry for the patron type, which is the previous entry if
+    the upload was skipped because the patron records are unchanged. The query,
+    render, zip and upload are streamed through each other and timed as separate
+    stages. With XML shards, the patron records are rendered and compressed on the
+    shard threads, the render stage adds up the render time of each shard and the rest
+    is timed as the zip stage. They are profiled together as one stage named after the
+    patron type. When skipping unchanged uploads, the
+    deduplicated records are hashed and spooled to a temporary file first, and are only
+    rendered and uploaded if they have changed.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        data_source: The source of the patron records.
+        s3_client: A configured s3 client.
+        config_values: The config values for the run.
+        krb_name_registry: The KRB names that have already been processed.
+        date: The date and time of the run, used for the zip file name.
+        render_mode: The patron XML render mode.
+        render_workers: Number of processes rendering patron XML.
+        render_pool: The render process pool shared by the patron types, if
+        render_workers is above 1.
+        xml_shards: Number of XML files the patron records are split into.
+        partitions: Number of hash partitions the table is fetched in.
+        upload_part_size: Size in MiB of each part of the zip file upload.
+        upload_concurrency: Maximum number of zip file parts uploaded at once.
+        skip_unchanged: Skip the upload if the patron records are unchanged since the
+        upload recorded in previous_manifest_entry.
+        previous_manifest_entry: The manifest entry for the patron type from the
+        previous run.
+        fingerprint_store: If provided, only new and changed patrons are loaded.
+        fragment_cache: If provided, rendered patron XML fragments are reused.
+        run_metrics: The metrics of the run, updated with the stages of the patron type.
+        stage_profiler: If provided, the patron type is profiled as a stage.
+        load_failed: If provided, the patron type stops and its upload is aborted once
+        it is set, because another patron type failed.
+    """
+    raise_if_load_failed(patron_type, load_failed)
+    query_params = PATRON_QUERIES[patron_type]
+    file_name = f"{patron_type}_{date.strftime('%Y-%m-%d_%H.%M.%S')}"
+    patron_set_hash = PatronSetHash(patron_type)
+    patron_records = data_source.query(
+        query_params["fields"],
+        query_params["table"],
+        partitions=partitions,
+        predicates=list(query_params["predicates"].values()),
+    )
+    timed_patron_records = run_metrics.timed(
+        stop_on_failed_load(patron_records, patron_type, load_failed),
+        "query",
+        patron_type,
+    )
+    unchanged = False
+    xml_size = zip_size = 0
+    patron_record_spool = None
+    try:
+        if skip_unchanged:
+            # The records are deduplicated and hashed before anything is rendered, so
+            # an unchanged patron type is neither rendered nor uploaded. Changed records
+            # are rendered from the spool rather than queried again.
+            patron_record_spool = PatronRecordSpool()
+            patron_record_spool.write(
+                patron_set_hash.hash_records(
+                    deduplicate_patron_records(
+                        patron_type, timed_patron_records, krb_name_registry
+                    )
+                )
+            )
+            unchanged = patron_set_unchanged(
+                patron_set_hash, previous_manifest_entry, date
+            )
+            if not unchanged:
+                delete_zip_files_with_metrics(
+                    run_metrics,
+                    s3_client,
+                    config_values["S3_BUCKET_NAME"],
+                    f"{config_values['S3_PREFIX']}/{patron_type}_",
+                    patron_type=patron_type,
+                    stage_profiler=stage_profiler,
+                )
+        if not unchanged:
+            xml_size, zip_size = zip_and_upload_patron_records(
+                patron_type,
+                file_name,
+                # The spooled records are already deduplicated and hashed, so they
+                # are claimed in a registry of their own and not hashed again
+                patron_records=patron_record_spool or timed_patron_records,
+                krb_name_registry=(
+                    KrbNameRegistry() if patron_record_spool else krb_name_registry
+                ),
+                patron_set_hash=None if patron_record_spool else patron_set_hash,
+                s3_client=s3_client,
+                config_values=config_values,
+                render_mode=render_mode,
+                render_workers=render_workers,
+                render_pool=render_pool,
+                xml_shards=xml_shards,
+                upload_part_size=upload_part_size,
+                upload_concurrency=upload_concurrency,
+                fingerprint_store=fingerprint_store,
+                fragment_cache=fragment_cache,
+                run_metrics=run_metrics,
+                stage_profiler=stage_profiler,
+                load_failed=load_failed,
+            )
+    finally:
+        if patron_record_spool:
+            patron_record_spool.close()
+    rendered_record_count = (
+        fingerprint_store.changed[patron_type]
+        if fingerprint_store
+        else krb_name_registry.claims[patron_type]
+    )
+    run_metrics.stage_metrics("query", patron_type).records = patron_records.row_count
+    if not unchanged:
+        render_metrics = run_metrics.stage_metrics("render", patron_type)
+        render_metrics.records = rendered_record_count
+        render_metrics.bytes_out = xml_size
+        zip_metrics = run_metrics.stage_metrics("zip", patron_type)
+        zip_metrics.records = rendered_record_count
+        zip_metrics.bytes_in = xml_size
+        zip_metrics.bytes_out = zip_size
+        upload_metrics = run_metrics.stage_metrics("upload", patron_type)
+        upload_metrics.records = rendered_record_count
+        upload_metrics.bytes_out = zip_size
+    logger.info(
+        "%s %s patron records retrieved from Data Warehouse",
+        patron_records.row_count,
+        patron_type,
+    )
+    for description, excluded_row_count in data_source.excluded_row_counts(
+        query_params["table"], query_params["predicates"]
+    ).items():
+        logger.info(
+            "%s %s patron records %s excluded by the Data Warehouse query",
+            excluded_row_count,
+            patron_type,
+            description,
+        )
+    if not unchanged:
+        logger.info(
+            "XML data created and zipped for %s patrons, %s bytes zipped to %s bytes",
+            patron_type,
+            xml_size,
+            zip_size,
+        )
+    logger.info(
+        "%s %s patron records created, %s duplicate records skipped",
+        krb_name_registry.claims[patron_type],
+        patron_type,
+        krb_name_registry.duplicates[patron_type],
+    )
+    if fingerprint_store:
+        logger.info(
+            "%s %s patron records new or changed, %s unchanged records skipped",
+            fingerprint_store.changed[patron_type],
+            patron_type,
+            fingerprint_store.unchanged[patron_type],
+        )
+    if unchanged and previous_manifest_entry:
+        logger.info(
+            "%s patron records unchanged since '%s' was uploaded, upload skipped",
+            patron_type,
+            previous_manifest_entry["zip_file"],
+        )
+        return previous_manifest_entry
+    logger.info(
+        "'%s' uploaded to S3 bucket '%s'",
+        file_name + ".zip",
+        config_values["S3_BUCKET_NAME"],
+    )
+    return {
+        "hash": patron_set_hash.hexdigest(),
+        "record_count": patron_set_hash.record_count,
+        "uploaded": date.isoformat(),
+        "zip_file": file_name + ".zip",
+    }
+
+
+def zip_and_upload_patron_records(
+    patron_type: str,
+    file_name: str,
+    *,
+    patron_records: Iterable[tuple],
+    krb_name_registry: KrbNameRegistry,
+    patron_set_hash: PatronSetHash | None,
+    s3_client: "S3Client",
+    config_values: dict,
+    render_mode: str,
+    render_workers: int,
+    render_pool: ProcessPoolExecutor | None,
+    xml_shards: int,
+    upload_part_size: int,
+    upload_concurrency: int,
+    fingerprint_store: FingerprintStore | None,
+    fragment_cache: FragmentCache | None,
+    run_metrics: RunMetrics,
+    stage_profiler: StageProfiler | None = None,
+    load_failed: threading.Event | None = None,
+) -> tuple[int, int]:
+    """Render, zip and upload the patron records of one patron type.
+
+    Returns the uncompressed size of the XML and the size of the uploaded zip file.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        file_name: The name of the zip file and XML files, without an extension.
+        patron_records: An iterable of patron record tuples.
+        krb_name_registry: The KRB names that have already been processed.
+        patron_set_hash: Updated with each deduplicated patron record, if provided.
+        s3_client: A configured s3 client.
+        config_values: The config values for the run.
+        render_mode: The patron XML render mode.
+        render_workers: Number of processes rendering patron XML.
+        render_pool: The render process pool shared by the patron types, if
+        render_workers is above 1.
+        xml_shards: Number of XML files the patron records are split into.
+        upload_part_size: Size in MiB of each part of the zip file upload.
+        upload_concurrency: Maximum number of zip file parts uploaded at once.
+        fingerprint_store: If provided, only new and changed patrons are loaded.
+        fragment_cache: If provided, rendered patron XML fragments are reused.
+        run_metrics: The metrics of the run, updated with the stages of the patron type.
+        stage_profiler: If provided, the patron type is profiled as a stage.
+        load_failed: If provided, the upload is aborted once it is set.
+    """
+    with run_metrics.stage("upload", patron_type):
+        zip_upload = S3MultipartUploadWriter(
+            s3_client,
+            config_values["S3_BUCKET_NAME"],
+            f"{config_values['S3_PREFIX']}/{file_name}.zip",
+            part_size=upload_part_size * 1024 * 1024,
+            max_concurrency=upload_concurrency,
+        )
+    with (
+        zip_upload,
+        profile_stage(stage_profiler, patron_type),
+        run_metrics.stage("zip", patron_type),
+    ):
+        timed_zip_upload = TimedWriter(zip_upload, run_metrics, "upload", patron_type)
+        if xml_shards > 1:
+            xml_size = write_sharded_patrons_xml_to_zip_file(
+                timed_zip_upload,
+                [f"{file_name}_{shard:02}.xml" for shard in range(1, xml_shards + 1)],
+                patron_type,
+                patron_records,
+                krb_name_registry,
+                render_mode=render_mode,
+                patron_set_hash=patron_set_hash,
+                fingerprint_store=fingerprint_store,
+                fragment_cache=fragment_cache,
+                timed=lambda xml_fragments: run_metrics.timed(
+                    xml_fragments, "render", patron_type
+                ),
+            )
+        else:
+            xml_size = write_xml_fragments_to_zip_file(
+                timed_zip_upload,
+                f"{file_name}.xml",
+                run_metrics.timed(
+                    patrons_xml_from_records(
+                        patron_type,
+                        patron_records,
+                        krb_name_registry,
+                        render_mode,
+                        render_workers,
+                        patron_set_hash=patron_set_hash,
+                        fingerprint_store=fingerprint_store,
+                        fragment_cache=fragment_cache,
+                        render_pool=render_pool,
+                    ),
+                    "render",
+                    patron_type,
+                ),
+            )
+        # The upload is only completed if every other patron type is still loading
+        raise_if_load_failed(patron_type, load_failed)
+        with run_metrics.stage("upload", patron_type):
+            zip_upload.close()
+    return xml_size, zip_upload.bytes_written
+
+
+def stop_on_failed_load(
+    patron_records: Iterable[tuple], patron_type: str, load_failed: threading.Event | None
+) -> Iterator[tuple]:
+    """Yield the patron records, raising an error once the load has failed.
+
+    Args:
+        patron_records: An iterable of patron record tuples.
+        patron_type: The type of patron record being processed, staff or student.
+        load_failed: Set when another patron type failed, if provided.
+    """
+    for patron_record in patron_records:
+        raise_if_load_failed(patron_type, load_failed)
+        yield patron_record
+
+
+def raise_if_load_failed(patron_type: str, load_failed: threading.Event | None) -> None:
+    """Raise an error if another patron type failed.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        load_failed: Set when another patron type failed, if provided.
+    """
+    if load_failed and load_failed.is_set():
+        message = f"Load of {patron_type} patrons stopped, another patron type failed"
+        raise RuntimeError(message)
+
+
+def delete_zip_files_with_metrics(
+    run_metrics: RunMetrics,
+    s3_client: "S3Client",
+    s3_bucket_name: str,
+    s3_prefix: str,
+    *,
+    keep_keys: Collection[str] = (),
+    patron_type: str = ALL_PATRON_TYPES,
+    stage_profiler: StageProfiler | None = None,
+) -> list[str]:
+    """Delete the zip files with a prefix from a bucket, timed as the cleanup stage.
+
+    Args:
+        run_metrics: The metrics of the run.
+        s3_client: A configured s3 client.
+        s3_bucket_name: The bucket containing the objects to be deleted.
+        s3_prefix: The prefix of the keys of the objects to be deleted.
+        keep_keys: Keys of zip files that are not deleted.
+        patron_type: The patron type whose zip files are deleted, if only one.
+        stage_profiler: If provided, the cleanup is profiled as a stage.
+    """
+    with (
+        profile_stage(stage_profiler, "s3_cleanup"),
+        run_metrics.stage("s3_cleanup", patron_type) as cleanup_metrics,
+    ):
+        deleted_keys = delete_zip_files_from_bucket_with_prefix(
+            s3_client, s3_bucket_name, s3_prefix, keep_keys=keep_keys
+        )
+        cleanup_metrics.records += len(deleted_keys)
+    return deleted_keys
+
+
+def patron_set_unchanged(
+    patron_set_hash: PatronSetHash,
+    previous_manifest_entry: dict | None,
+    date: datetime.datetime,
+) -> bool:
+    """Check whether the patron records match the last upload recorded in the manifest.
+
+    The patron records are treated as changed when the last upload is older than
+    MANIFEST_MAX_AGE, so that the expiry and purge dates in Alma are refreshed.
+
+    Args:
+        patron_set_hash: The hash of the patron records of the current run.
+        previous_manifest_entry: The manifest entry for the patron type from the
+        previous run.
+        date: The date and time of the current run.
+    """
+    return bool(
+        previous_manifest_entry
+        and previous_manifest_entry["hash"] == patron_set_hash.hexdigest()
+        and date - datetime.datetime.fromisoformat(previous_manifest_entry["uploaded"])
+        < MANIFEST_MAX_AGE
+    )
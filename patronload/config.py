@@ -1,60 +1,90 @@
 import json
 import logging
 import os
+from functools import cache
 from io import StringIO
+from pathlib import Path
 
-import sentry_sdk
-
-STAFF_FIELDS = [
-    "MIT_ID",
-    "EMAIL_ADDRESS",
-    "KRB_NAME_UPPERCASE",
-    "LIBRARY_ID",
-    "PREFERRED_FIRST_NAME",
-    "PREFERRED_MIDDLE_NAME",
-    "PREFERRED_LAST_NAME",
-    "LEGAL_FIRST_NAME",
-    "LEGAL_MIDDLE_NAME",
-    "LEGAL_LAST_NAME",
-    "OFFICE_ADDRESS",
-    "OFFICE_PHONE",
-    "APPOINTMENT_END_DATE",
-    "LIBRARY_PERSON_TYPE_CODE",
-    "LIBRARY_PERSON_TYPE",
-    "ORG_UNIT_ID",
-    "ORG_UNIT_TITLE",
-    "POSITION_TITLE",
-    "DIRECTORY_TITLE",
-]
-
-STUDENT_FIELDS = [
-    "MIT_ID",
-    "EMAIL_ADDRESS",
-    "KRB_NAME_UPPERCASE",
-    "LIBRARY_ID",
-    "PREFERRED_FIRST_NAME",
-    "PREFERRED_MIDDLE_NAME",
-    "PREFERRED_LAST_NAME",
-    "LEGAL_FIRST_NAME",
-    "LEGAL_MIDDLE_NAME",
-    "LEGAL_LAST_NAME",
-    "TERM_STREET1",
-    "TERM_STREET2",
-    "TERM_CITY",
-    "TERM_STATE",
-    "TERM_ZIP",
-    "TERM_PHONE1",
-    "TERM_PHONE2",
-    "OFFICE_PHONE",
-    "STUDENT_YEAR",
-    "HOME_DEPARTMENT",
-]
-
-with open("config/staff_departments.txt", encoding="utf8") as txt_file:
-    STAFF_DEPARTMENTS: dict[str, str] = json.load(txt_file)
-
-with open("config/student_departments.txt", encoding="utf8") as txt_file:
-    STUDENT_DEPARTMENTS: dict[str, str] = json.load(txt_file)
+# The Data Warehouse fields of each patron type, in the order they are fetched, mapped
+# to the steps that consume them: "deduplicate" reads the MIT ID and KRB name by
+# position, "common" is populate_common_fields and common_slot_values, and "staff" and
+# "student" are the populate and slot value functions of that patron type. Fields that
+# no step consumes are not fetched. The declarations are checked against the render
+# steps by tests/test_patron.py.
+STAFF_FIELD_CONSUMERS: dict[str, tuple[str, ...]] = {
+    "MIT_ID": ("deduplicate", "common", "staff"),
+    "EMAIL_ADDRESS": ("common",),
+    "KRB_NAME_UPPERCASE": ("deduplicate", "common"),
+    "LIBRARY_ID": ("common",),
+    "PREFERRED_FIRST_NAME": ("common",),
+    "PREFERRED_MIDDLE_NAME": ("common",),
+    "PREFERRED_LAST_NAME": ("common",),
+    "LEGAL_FIRST_NAME": ("common",),
+    "LEGAL_MIDDLE_NAME": ("common",),
+    "LEGAL_LAST_NAME": ("common",),
+    "OFFICE_ADDRESS": ("staff",),
+    "OFFICE_PHONE": ("staff",),
+    "APPOINTMENT_END_DATE": (),
+    "LIBRARY_PERSON_TYPE_CODE": ("staff",),
+    "LIBRARY_PERSON_TYPE": ("staff",),
+    "ORG_UNIT_ID": ("staff",),
+    "ORG_UNIT_TITLE": ("staff",),
+    "POSITION_TITLE": (),
+    "DIRECTORY_TITLE": (),
+}
+
+STUDENT_FIELD_CONSUMERS: dict[str, tuple[str, ...]] = {
+    "MIT_ID": ("deduplicate", "common", "student"),
+    "EMAIL_ADDRESS": ("common",),
+    "KRB_NAME_UPPERCASE": ("deduplicate", "common"),
+    "LIBRARY_ID": ("common",),
+    "PREFERRED_FIRST_NAME": ("common",),
+    "PREFERRED_MIDDLE_NAME": ("common",),
+    "PREFERRED_LAST_NAME": ("common",),
+    "LEGAL_FIRST_NAME": ("common",),
+    "LEGAL_MIDDLE_NAME": ("common",),
+    "LEGAL_LAST_NAME": ("common",),
+    "TERM_STREET1": ("student",),
+    "TERM_STREET2": ("student",),
+    "TERM_CITY": ("student",),
+    "TERM_STATE": ("student",),
+    "TERM_ZIP": ("student",),
+    "TERM_PHONE1": ("student",),
+    "TERM_PHONE2": ("student",),
+    "OFFICE_PHONE": ("student",),
+    "STUDENT_YEAR": ("student",),
+    "HOME_DEPARTMENT": ("student",),
+}
+
+STAFF_FIELDS = [field for field, steps in STAFF_FIELD_CONSUMERS.items() if steps]
+
+STUDENT_FIELDS = [field for field, steps in STUDENT_FIELD_CONSUMERS.items() if steps]
+
+# The config files are found relative to the package rather than the working
+# directory, so patronload can be run from any directory
+CONFIG_DIRECTORY = Path(__file__).resolve().parent.parent / "config"
+
+
+def template_path(patron_type: str) -> Path:
+    """Return the path of the patron XML template of a patron type.
+
+    Args:
+        patron_type: The type of patron template, staff or student.
+    """
+    return CONFIG_DIRECTORY / f"{patron_type}_template.xml"
+
+
+@cache
+def load_departments(patron_type: str) -> dict[str, str]:
+    """Return the department mapping of a patron type, read on first use.
+
+    Args:
+        patron_type: The type of patron record, staff or student.
+    """
+    with open(
+        CONFIG_DIRECTORY / f"{patron_type}_departments.txt", encoding="utf8"
+    ) as txt_file:
+        return json.load(txt_file)
 
 
 def configure_logger(logger: logging.Logger, log_level_string: str) -> str:
@@ -85,6 +115,8 @@ def configure_sentry() -> str:
     env = os.getenv("WORKSPACE")
     sentry_dsn = os.getenv("SENTRY_DSN")
     if sentry_dsn and sentry_dsn.lower() != "none":
+        import sentry_sdk  # noqa: PLC0415
+
         sentry_sdk.init(sentry_dsn, environment=env)
         return f"Sentry DSN found, exceptions will be sent to Sentry with env={env}"
     return "No Sentry DSN found, exceptions will not be sent to Sentry"
@@ -0,0 +1,264 @@
+import csv
+import sqlite3
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Protocol
+
+from patronload.database import (
+    DEFAULT_ARRAYSIZE,
+    DEFAULT_PREFETCHROWS,
+    PartitionedQueryResults,
+    PooledQueryResults,
+    SQLiteConnectionPool,
+    build_sql_query,
+    create_database_connection_pool,
+)
+
+if TYPE_CHECKING:
+    import oracledb
+
+
+class QueryResults(Protocol):
+    """Rows of a query, with the number of rows read so far."""
+
+    @property
+    def row_count(self) -> int: ...
+
+    def __iter__(self) -> Iterator[tuple]:  # noqa: D105
+        ...
+
+
+class DataSource(Protocol):
+    """A source of Data Warehouse rows, returned in the order of the requested fields.
+
+    Predicates are SQL conditions that a data source may apply to exclude rows before
+    they are returned, sources that can not apply them return every row.
+    """
+
+    def describe(self) -> str: ...
+
+    def query(
+        self,
+        fields: list[str],
+        table: str,
+        *,
+        partitions: int = 1,
+        predicates: list[str] | None = None,
+    ) -> QueryResults: ...
+
+    def excluded_row_counts(
+        self, table: str, predicates: dict[str, str]
+    ) -> dict[str, int]: ...
+
+
+class SQLDataSource:
+    """Data source querying tables over a pool of Oracle or SQLite connections.
+
+    The Oracle pool connects to the Data Warehouse. The SQLite stand-in has the same
+    tables and columns, so full runs can be done locally without the network.
+    """
+
+    def __init__(
+        self,
+        connection_pool: "oracledb.ConnectionPool | SQLiteConnectionPool",
+        *,
+        arraysize: int = DEFAULT_ARRAYSIZE,
+        prefetchrows: int = DEFAULT_PREFETCHROWS,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+
+    def describe(self) -> str:
+        """Connect to the database and describe it for the run log."""
+        if isinstance(self.connection_pool, SQLiteConnectionPool):
+            return (
+                f"SQLite database '{self.connection_pool.database}' "
+                f"version: {sqlite3.sqlite_version}"
+            )
+        with self.connection_pool.acquire() as connection:
+            return f"Oracle Database version: {connection.version}"
+
+    def query(
+        self,
+        fields: list[str],
+        table: str,
+        *,
+        partitions: int = 1,
+        predicates: list[str] | None = None,
+    ) -> PooledQueryResults | PartitionedQueryResults:
+        """Query the fields of a table, in hash partitions fetched in parallel if > 1.
+
+        Partitioned rows are yielded ordered by MIT_ID, unpartitioned rows in the order
+        the database returns them.
+
+        Args:
+            fields: The list of fields to retrieve.
+            table: The table to retrieve the fields from.
+            partitions: Number of hash partitions the table is fetched in.
+            predicates: SQL conditions that every retrieved row must meet.
+        """
+        if partitions > 1:
+            return PartitionedQueryResults(
+                self.connection_pool,
+                fields,
+                table,
+                partitions,
+                predicates=predicates,
+                arraysize=self.arraysize,
+                prefetchrows=self.prefetchrows,
+            )
+        return PooledQueryResults(
+            self.connection_pool,
+            build_sql_query(fields, table, predicates=predicates),
+            arraysize=self.arraysize,
+            prefetchrows=self.prefetchrows,
+        )
+
+    def excluded_row_counts(
+        self, table: str, predicates: dict[str, str]
+    ) -> dict[str, int]:
+        """Count the rows of a table excluded by each predicate of a query.
+
+        A row is counted against the first predicate it does not meet, so the counts
+        add up to the number of rows excluded. Only a COUNT is returned for each
+        predicate, the excluded rows never leave the database.
+
+        Args:
+            table: The table that was queried.
+            predicates: The predicates of the query, keyed by a description of the
+            rows they exclude.
+        """
+        excluded_row_counts = {}
+        with self.connection_pool.acquire() as connection:
+            cursor = connection.cursor()
+            preceding_predicates: list[str] = []
+            for description, predicate in predicates.items():
+                cursor.execute(
+                    build_sql_query(
+                        ["COUNT(*)"],
+                        table,
+                        predicates=[*preceding_predicates, f"NOT ({predicate})"],
+                    )
+                )
+                excluded_row_counts[description] = cursor.fetchone()[0]
+                preceding_predicates.append(predicate)
+        return excluded_row_counts
+
+
+class FileQueryResults:
+    """Iterable over the rows of a CSV or Parquet file, in the order of the fields.
+
+    Empty CSV values are returned as None, matching the NULL values of the Data
+    Warehouse.
+    """
+
+    def __init__(self, path: Path, fields: list[str]) -> None:
+        self.path = path
+        self.fields = fields
+        self.row_count = 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Read the file and yield its rows as tuples of the fields."""
+        self.row_count = 0
+        rows = (
+            self._parquet_rows() if self.path.suffix == ".parquet" else self._csv_rows()
+        )
+        for row in rows:
+            self.row_count += 1
+            yield row
+
+    def _csv_rows(self) -> Iterable[tuple]:
+        with open(self.path, encoding="utf-8", newline="") as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield tuple(row[field] or None for field in self.fields)
+
+    def _parquet_rows(self) -> Iterable[tuple]:
+        try:
+            import pyarrow.parquet as pq  # type: ignore[import-not-found] # noqa: PLC0415
+        except ImportError as error:
+            message = "Reading Parquet files requires the pyarrow package"
+            raise RuntimeError(message) from error
+        for batch in pq.ParquetFile(self.path).iter_batches(columns=self.fields):
+            yield from zip(
+                *(batch.column(field).to_pylist() for field in self.fields), strict=True
+            )
+
+
+class FileDataSource:
+    """Data source reading each table from a CSV or Parquet file named after it.
+
+    The files are read whole, so partitioned extraction and predicates do not apply.
+    """
+
+    def __init__(self, directory: str, file_format: str) -> None:
+        self.directory = Path(directory)
+        self.file_format = file_format
+
+    def describe(self) -> str:
+        return f"{self.file_format.upper()} files in '{self.directory}'"
+
+    def query(
+        self,
+        fields: list[str],
+        table: str,
+        *,
+        partitions: int = 1,  # noqa: ARG002
+        predicates: list[str] | None = None,  # noqa: ARG002
+    ) -> FileQueryResults:
+        """Read the fields of a table from its file.
+
+        Args:
+            fields: The list of fields to retrieve.
+            table: The table to retrieve the fields from.
+            partitions: Ignored, files are not partitioned.
+            predicates: Ignored, every row is returned.
+        """
+        return FileQueryResults(self.directory / f"{table}.{self.file_format}", fields)
+
+    def excluded_row_counts(
+        self, table: str, predicates: dict[str, str]  # noqa: ARG002
+    ) -> dict[str, int]:
+        """Return no counts, as files do not apply predicates."""
+        return {}
+
+
+def create_data_source(
+    data_source: str,
+    config_values: dict[str, str],
+    *,
+    pool_size: int = 2,
+    arraysize: int = DEFAULT_ARRAYSIZE,
+    prefetchrows: int = DEFAULT_PREFETCHROWS,
+    driver_mode: str = "thick",
+) -> DataSource:
+    """Create a data source from a location such as 'oracle' or 'sqlite://patrons.db'.
+
+    'oracle' connects to the Data Warehouse, 'sqlite://<path>' queries a SQLite
+    database and 'csv://<directory>' or 'parquet://<directory>' read a file per table.
+
+    Args:
+        data_source: The data source location.
+        config_values: The config values for the run, used to connect to Oracle.
+        pool_size: The number of connections in an Oracle connection pool.
+        arraysize: Number of rows fetched per round trip from a SQL database.
+        prefetchrows: Number of rows prefetched when a SQL query is executed.
+        driver_mode: The python-oracledb driver mode used to connect to Oracle.
+    """
+    scheme, _, location = data_source.partition("://")
+    if scheme == "oracle":
+        return SQLDataSource(
+            create_database_connection_pool(
+                config_values, size=pool_size, driver_mode=driver_mode
+            ),
+            arraysize=arraysize,
+            prefetchrows=prefetchrows,
+        )
+    if scheme == "sqlite":
+        return SQLDataSource(
+            SQLiteConnectionPool(location), arraysize=arraysize, prefetchrows=prefetchrows
+        )
+    if scheme in ["csv", "parquet"]:
+        return FileDataSource(location, scheme)
+    message = f"'{data_source}' is not a valid data source"
+    raise ValueError(message)
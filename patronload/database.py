@@ -1,39 +1,197 @@
+import heapq
+import logging
 import os
+import queue
+import sqlite3
+import sys
+import threading
+import zlib
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
 
-import oracledb
+if TYPE_CHECKING:
+    import oracledb
 
+logger = logging.getLogger(__name__)
 
-def build_sql_query(fields: list[str], table: str) -> str:
+# Patron rows are a few hundred bytes wide, so batches of this size keep each
+# round trip to the Data Warehouse well under a megabyte
+DEFAULT_ARRAYSIZE = 1000
+DEFAULT_PREFETCHROWS = 1000
+
+# python-oracledb driver modes: "thick" loads the Oracle Instant Client, which the
+# Data Warehouse requires, "thin" connects without it and "auto" tries thin mode
+# first and falls back to thick mode
+ORACLE_DRIVER_MODES = ["thick", "thin", "auto"]
+
+# Staff and student tables are both split into hash partitions on the MIT ID
+PARTITION_COLUMN = "MIT_ID"
+
+# Fields with few distinct values, such as department codes and person types. Their
+# values are interned as they are fetched, so the rows held in memory share one copy
+# of each value instead of each row holding its own string
+INTERNED_FIELDS = frozenset(
+    {
+        "HOME_DEPARTMENT",
+        "LIBRARY_PERSON_TYPE",
+        "LIBRARY_PERSON_TYPE_CODE",
+        "ORG_UNIT_ID",
+        "ORG_UNIT_TITLE",
+        "STUDENT_YEAR",
+        "TERM_CITY",
+        "TERM_STATE",
+    }
+)
+
+
+def build_sql_query(
+    fields: list[str],
+    table: str,
+    partition: tuple[int, int] | None = None,
+    order_by: str | None = None,
+    predicates: list[str] | None = None,
+) -> str:
     """Build a SQL query for an Oracle database from a list of fields and a table name.
 
     Args:
         fields: The list of fields to retrieve.
         table: The table to retrieve the fields from.
+        partition: An optional (index, count) tuple, only rows whose PARTITION_COLUMN
+        hashes to the index out of count hash buckets are retrieved.
+        order_by: An optional field to order the rows by.
+        predicates: Optional SQL conditions that every retrieved row must meet.
     """
     query = "SELECT " + ", ".join(fields)
     query += " FROM " + table
+    conditions = list(predicates or [])
+    if partition:
+        index, count = partition
+        conditions.append(f"ORA_HASH({PARTITION_COLUMN}, {count - 1}) = {index}")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        query += " ORDER BY " + order_by
     return query
 
 
-def create_database_connection(config_values: dict[str, str]) -> oracledb.Connection:
+def create_database_connection(
+    config_values: dict[str, str], driver_mode: str = "thick"
+) -> "oracledb.Connection":
     """Create a connection to an Oracle database for submitting queries.
 
     Args:
         config_values: A dict with the necessary values to configure an
         Oracle database connection.
+        driver_mode: The python-oracledb driver mode, one of ORACLE_DRIVER_MODES.
+    """
+    import oracledb  # noqa: PLC0415
+
+    start_time = perf_counter()
+    connect_params = oracledb.ConnectParams(**connection_parameters(config_values))
+    connection = (
+        connect_in_thin_mode(connect_params, driver_mode)
+        if driver_mode != "thick"
+        else None
+    )
+    if connection is None:
+        oracledb.init_oracle_client(lib_dir=os.getenv("ORACLE_LIB_DIR"))
+        connection = oracledb.connect(params=connect_params)
+    logger.info(
+        "Oracle connection set up in %s mode in %.3fs",
+        "thin" if connection.thin else "thick",
+        perf_counter() - start_time,
+    )
+    return connection
+
+
+def create_database_connection_pool(
+    config_values: dict[str, str], size: int = 2, driver_mode: str = "thick"
+) -> "oracledb.ConnectionPool":
+    """Create a pool of connections to an Oracle database for concurrent queries.
+
+    In auto driver mode, a single connection is made in thin mode first to check that
+    the database accepts thin mode connections before the pool is created.
+
+    Args:
+        config_values: A dict with the necessary values to configure an
+        Oracle database connection.
+        size: The number of connections in the pool.
+        driver_mode: The python-oracledb driver mode, one of ORACLE_DRIVER_MODES.
     """
-    oracledb.init_oracle_client(lib_dir=os.getenv("ORACLE_LIB_DIR"))
-    connection_parameters = oracledb.ConnectParams(
-        user=config_values["USER"],
-        password=config_values["PASSWORD"],
-        host=config_values["HOST"],
-        port=config_values["PORT"],
-        sid=config_values["PATH"],
+    import oracledb  # noqa: PLC0415
+
+    start_time = perf_counter()
+    connection = (
+        connect_in_thin_mode(
+            oracledb.ConnectParams(**connection_parameters(config_values)), driver_mode
+        )
+        if driver_mode != "thick"
+        else None
+    )
+    if connection is not None:
+        connection.close()
+    else:
+        oracledb.init_oracle_client(lib_dir=os.getenv("ORACLE_LIB_DIR"))
+    connection_pool = oracledb.create_pool(
+        params=oracledb.PoolParams(
+            min=size, max=size, increment=0, **connection_parameters(config_values)
+        )
     )
-    return oracledb.connect(params=connection_parameters)
+    logger.info(
+        "Oracle connection pool of %s connections set up in %s mode in %.3fs",
+        size,
+        "thin" if connection_pool.thin else "thick",
+        perf_counter() - start_time,
+    )
+    return connection_pool
+
 
+def connect_in_thin_mode(
+    connect_params: "oracledb.ConnectParams", driver_mode: str
+) -> "oracledb.Connection | None":
+    """Connect in thin mode, returning None if auto mode falls back to thick mode.
 
-def query_database(connection: oracledb.Connection, query: str) -> list[tuple]:
+    A failed thin mode connection does not fix the driver mode of the process, so
+    thick mode can still be enabled after it.
+
+    Args:
+        connect_params: The parameters of the connection.
+        driver_mode: "thin" raises connection errors, "auto" logs them and returns
+        None.
+    """
+    import oracledb  # noqa: PLC0415
+
+    try:
+        return oracledb.connect(params=connect_params)
+    except oracledb.Error as error:
+        if driver_mode == "thin":
+            raise
+        logger.warning(
+            "Oracle thin mode connection failed, falling back to thick mode: %s", error
+        )
+        return None
+
+
+def connection_parameters(config_values: dict[str, str]) -> dict[str, Any]:
+    """Map config values to the parameters for connections to an Oracle database.
+
+    Args:
+        config_values: A dict with the necessary values to configure an
+        Oracle database connection.
+    """
+    return {
+        "user": config_values["USER"],
+        "password": config_values["PASSWORD"],
+        "host": config_values["HOST"],
+        "port": config_values["PORT"],
+        "sid": config_values["PATH"],
+    }
+
+
+def query_database(connection: "oracledb.Connection", query: str) -> list[tuple]:
     """Submit a SQL query to an Oracle Database and retrieve the results.
 
     Args:
@@ -44,3 +202,266 @@ def query_database(connection: oracledb.Connection, query: str) -> list[tuple]:
     cursor = connection.cursor()
     cursor.execute(query)
     return cursor.fetchall()
+
+
+class BatchedQueryResults:
+    """Iterable over the rows of a query, fetched from an Oracle database in batches.
+
+    Rows are yielded as each batch arrives instead of being materialized with
+    fetchall, and the number of rows, round trips and time spent fetching are recorded
+    so network round trips to the Data Warehouse can be tuned with arraysize and
+    prefetchrows. The round trip count is an estimate: the execute call plus each
+    fetched batch.
+    """
+
+    def __init__(
+        self,
+        connection: "oracledb.Connection | sqlite3.Connection",
+        query: str,
+        arraysize: int = DEFAULT_ARRAYSIZE,
+        prefetchrows: int = DEFAULT_PREFETCHROWS,
+    ) -> None:
+        self.connection = connection
+        self.query = query
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+        self.row_count = 0
+        self.round_trips = 0
+        self.fetch_time = 0.0
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Execute the query and yield its rows as they are fetched."""
+        cursor = self.connection.cursor()
+        cursor.arraysize = self.arraysize
+        if hasattr(cursor, "prefetchrows"):  # SQLite stand-in cursors do not prefetch
+            cursor.prefetchrows = self.prefetchrows
+            cursor.outputtypehandler = interning_output_type_handler  # type: ignore[union-attr]
+        start_time = perf_counter()
+        cursor.execute(self.query)
+        self.round_trips += 1
+        self.fetch_time += perf_counter() - start_time
+        while True:
+            start_time = perf_counter()
+            rows = cursor.fetchmany(self.arraysize)
+            self.fetch_time += perf_counter() - start_time
+            self.round_trips += 1
+            self.row_count += len(rows)
+            yield from rows
+            # A short batch means the result set is exhausted, skip the extra fetch
+            if len(rows) < self.arraysize:
+                break
+        logger.info(
+            "%s rows fetched in %s round trips, %s rows per second",
+            self.row_count,
+            self.round_trips,
+            self.rows_per_second,
+        )
+
+    @property
+    def rows_per_second(self) -> int:
+        return round(self.row_count / self.fetch_time) if self.fetch_time else 0
+
+
+class SQLiteConnectionPool:
+    """Local SQLite stand-in for an Oracle connection pool.
+
+    Each acquired connection has an ORA_HASH function that emulates the Oracle hash
+    function used for partitioned extraction, so extraction can be tested and
+    benchmarked without the Data Warehouse.
+    """
+
+    def __init__(self, database: str) -> None:
+        self.database = database
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.database)
+        connection.create_function("ORA_HASH", 2, sqlite_ora_hash, deterministic=True)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+class PooledQueryResults:
+    """Iterable over the rows of a query, fetched on a connection acquired from a pool.
+
+    The connection is only held while the rows are being iterated over.
+    """
+
+    def __init__(
+        self,
+        connection_pool: "oracledb.ConnectionPool | SQLiteConnectionPool",
+        query: str,
+        *,
+        arraysize: int = DEFAULT_ARRAYSIZE,
+        prefetchrows: int = DEFAULT_PREFETCHROWS,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.query = query
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+        self.results: BatchedQueryResults | None = None
+
+    @property
+    def row_count(self) -> int:
+        return self.results.row_count if self.results else 0
+
+    @property
+    def round_trips(self) -> int:
+        return self.results.round_trips if self.results else 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Acquire a connection and yield the rows of the query as they are fetched."""
+        with self.connection_pool.acquire() as connection:
+            self.results = BatchedQueryResults(
+                connection,
+                self.query,
+                arraysize=self.arraysize,
+                prefetchrows=self.prefetchrows,
+            )
+            yield from self.results
+
+
+class PartitionedQueryResults:
+    """Iterable over the rows of a table, fetched in hash partitions in parallel.
+
+    The table is split into disjoint partitions with ORA_HASH predicates on the
+    PARTITION_COLUMN, added to any predicates of the query, and each partition is
+    fetched on its own pooled connection. Each partition is ordered by PARTITION_COLUMN
+    and the partitions are merged as they arrive, so the rows are yielded ordered by
+    PARTITION_COLUMN. At most max_batches_in_flight batches per partition are held in
+    memory, and the partitions stop fetching once the consumer stops iterating.
+    """
+
+    def __init__(
+        self,
+        connection_pool: "oracledb.ConnectionPool | SQLiteConnectionPool",
+        fields: list[str],
+        table: str,
+        partitions: int,
+        *,
+        predicates: list[str] | None = None,
+        arraysize: int = DEFAULT_ARRAYSIZE,
+        prefetchrows: int = DEFAULT_PREFETCHROWS,
+        max_batches_in_flight: int = 4,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.fields = fields
+        self.table = table
+        self.partitions = partitions
+        self.predicates = predicates
+        self.arraysize = arraysize
+        self.prefetchrows = prefetchrows
+        self.max_batches_in_flight = max_batches_in_flight
+        self.partition_results: list[BatchedQueryResults] = []
+        self.stopped = threading.Event()
+
+    @property
+    def row_count(self) -> int:
+        return sum(results.row_count for results in self.partition_results)
+
+    @property
+    def round_trips(self) -> int:
+        return sum(results.round_trips for results in self.partition_results)
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Fetch the partitions in parallel and yield their rows in merged order."""
+        self.stopped.clear()
+        self.partition_results = []
+        batch_queues: list[queue.Queue] = [
+            queue.Queue(maxsize=self.max_batches_in_flight)
+            for _ in range(self.partitions)
+        ]
+        order_index = self.fields.index(PARTITION_COLUMN)
+        with ThreadPoolExecutor(max_workers=self.partitions) as executor:
+            for index, batch_queue in enumerate(batch_queues):
+                executor.submit(self._fetch_partition, index, batch_queue)
+            try:
+                yield from heapq.merge(
+                    *[self._partition_rows(batch_queue) for batch_queue in batch_queues],
+                    # Oracle sorts null values last in ascending order
+                    key=lambda row: (row[order_index] is None, row[order_index] or ""),
+                )
+            finally:
+                self.stopped.set()
+
+    def _fetch_partition(self, index: int, batch_queue: queue.Queue) -> None:
+        try:
+            with self.connection_pool.acquire() as connection:
+                results = BatchedQueryResults(
+                    connection,
+                    build_sql_query(
+                        self.fields,
+                        self.table,
+                        partition=(index, self.partitions),
+                        order_by=PARTITION_COLUMN,
+                        predicates=self.predicates,
+                    ),
+                    arraysize=self.arraysize,
+                    prefetchrows=self.prefetchrows,
+                )
+                self.partition_results.append(results)
+                batch: list[tuple] = []
+                for row in results:
+                    batch.append(row)
+                    if len(batch) == self.arraysize:
+                        self._put(batch_queue, batch)
+                        batch = []
+                        # Stop fetching if the consumer has stopped iterating
+                        if self.stopped.is_set():
+                            return
+                self._put(batch_queue, batch)
+            self._put(batch_queue, None)
+        except Exception as exception:  # noqa: BLE001
+            self._put(batch_queue, exception)
+
+    def _put(self, batch_queue: queue.Queue, item: object) -> None:
+        # Stop putting batches if the consumer has stopped iterating
+        while not self.stopped.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+    @staticmethod
+    def _partition_rows(batch_queue: queue.Queue) -> Iterator[tuple]:
+        while (batch := batch_queue.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+
+
+def interning_output_type_handler(
+    cursor: "oracledb.Cursor", metadata: "oracledb.FetchInfo"
+) -> "oracledb.Var | None":
+    """Have the Oracle driver intern the string values of INTERNED_FIELDS.
+
+    Used as the outputtypehandler of a cursor. The values are interned by the driver as
+    each row is fetched, null values and other fields are fetched as usual.
+
+    Args:
+        cursor: The cursor the query is executed on.
+        metadata: The metadata of a fetched column.
+    """
+    import oracledb  # noqa: PLC0415
+
+    if metadata.name in INTERNED_FIELDS and metadata.type_code in {
+        oracledb.DB_TYPE_CHAR,
+        oracledb.DB_TYPE_VARCHAR,
+    }:
+        return cursor.var(
+            metadata.type_code, arraysize=cursor.arraysize, outconverter=sys.intern
+        )
+    return None
+
+
+def sqlite_ora_hash(value: object, max_bucket: int) -> int:
+    """Emulate ORA_HASH(value, max_bucket) with a stable CRC32 of the value.
+
+    Args:
+        value: The value to hash.
+        max_bucket: The maximum bucket number, buckets range from 0 to max_bucket.
+    """
+    return zlib.crc32(str(value).encode("utf-8")) % (max_bucket + 1)
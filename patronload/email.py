@@ -1,8 +1,6 @@
 from email.message import EmailMessage
 from email.policy import EmailPolicy, default
 
-import boto3
-
 
 class Email(EmailMessage):
     """Email subclasses EmailMessage with added functionality to populate and send."""
@@ -51,6 +49,8 @@ class Email(EmailMessage):
         Currently uses SES but could easily be switched out for another method if
         needed.
         """
+        import boto3  # noqa: PLC0415
+
         ses = boto3.client("ses", region_name="us-east-1")
         destinations = self["To"].split(",")
         return ses.send_raw_email(
@@ -0,0 +1,161 @@
+import datetime
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from patronload.template import rendering_configuration_digest
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+
+logger = logging.getLogger(__name__)
+
+# Unchanged patrons are loaded again after this long, so that their expiry and purge
+# dates in Alma are refreshed well before they expire
+FINGERPRINT_MAX_AGE = datetime.timedelta(days=30)
+
+
+class FingerprintStore:
+    """Fingerprints of the patron records loaded by previous runs, keyed by KRB name.
+
+    The fingerprints are stored in a SQLite database, either a local file or an S3
+    object when the location is an s3:// URI. A fingerprint covers the patron type,
+    the source record and the rendering configuration, so a patron is loaded again
+    when any of them change. The store is only saved once the whole run succeeds.
+    """
+
+    def __init__(
+        self,
+        location: str,
+        s3_client: "S3Client | None" = None,
+        *,
+        full_load: bool = False,
+        max_age: datetime.timedelta = FINGERPRINT_MAX_AGE,
+    ) -> None:
+        self.location = location
+        self.s3_client = s3_client
+        self.full_load = full_load
+        self.today = datetime.datetime.now(tz=datetime.UTC).date().isoformat()
+        self.oldest_loaded = (
+            datetime.datetime.now(tz=datetime.UTC).date() - max_age
+        ).isoformat()
+        self.previous: dict[str, tuple[str, str]] = {}
+        self.current: dict[str, tuple[str, str, str]] = {}
+        self.changed: Counter[str] = Counter()
+        self.unchanged: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """Load the fingerprints saved by the previous run, if there are any."""
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            database = self._local_database(temporary_directory)
+            if not database.exists():
+                logger.info("No fingerprint store found at '%s'", self.location)
+                return
+            connection = sqlite3.connect(database)
+            try:
+                self.previous = {
+                    krb_name: (fingerprint, loaded)
+                    for krb_name, fingerprint, loaded in connection.execute(
+                        "SELECT krb_name, fingerprint, loaded FROM fingerprints"
+                    )
+                }
+            finally:
+                connection.close()
+        logger.info(
+            "%s patron fingerprints loaded from '%s'", len(self.previous), self.location
+        )
+
+    def save(self) -> None:
+        """Replace the saved fingerprints with those of the patrons seen in this run."""
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            database = (
+                Path(temporary_directory) / "fingerprints.sqlite"
+                if self._s3_location()
+                else Path(self.location)
+            )
+            connection = sqlite3.connect(database)
+            try:
+                with connection:
+                    connection.execute("DROP TABLE IF EXISTS fingerprints")
+                    connection.execute(
+                        "CREATE TABLE fingerprints (krb_name TEXT PRIMARY KEY, "
+                        "patron_type TEXT, fingerprint TEXT, loaded TEXT)"
+                    )
+                    connection.executemany(
+                        "INSERT INTO fingerprints VALUES (?, ?, ?, ?)",
+                        (
+                            (krb_name, *fingerprint)
+                            for krb_name, fingerprint in self.current.items()
+                        ),
+                    )
+            finally:
+                connection.close()
+            if s3_location := self._s3_location():
+                self.s3_client.upload_file(  # type: ignore[union-attr]
+                    str(database), *s3_location
+                )
+        logger.info(
+            "%s patron fingerprints saved to '%s'", len(self.current), self.location
+        )
+
+    def changed_records(
+        self, patron_type: str, patron_records: Iterable[tuple]
+    ) -> Iterator[tuple]:
+        """Yield the deduplicated patron records that are new or changed.
+
+        Records that have not been loaded for longer than the maximum age are yielded
+        as well. Every record is remembered for the next run, with the date it was
+        last loaded.
+
+        Args:
+            patron_type: The type of patron record being processed, staff or student.
+            patron_records: An iterable of deduplicated patron record tuples.
+        """
+        configuration_digest = rendering_configuration_digest(patron_type)
+        for patron_record in patron_records:
+            krb_name = patron_record[2]
+            fingerprint = hashlib.blake2b(
+                configuration_digest + repr(patron_record).encode("utf-8"),
+                digest_size=16,
+            ).hexdigest()
+            previous_fingerprint, loaded = self.previous.get(krb_name, ("", ""))
+            if (
+                self.full_load
+                or fingerprint != previous_fingerprint
+                or loaded < self.oldest_loaded
+            ):
+                loaded = self.today
+                with self.lock:
+                    self.current[krb_name] = (patron_type, fingerprint, loaded)
+                    self.changed[patron_type] += 1
+                yield patron_record
+            else:
+                with self.lock:
+                    self.current[krb_name] = (patron_type, fingerprint, loaded)
+                    self.unchanged[patron_type] += 1
+
+    def _s3_location(self) -> tuple[str, str] | None:
+        if not self.location.startswith("s3://"):
+            return None
+        bucket, _, key = self.location.removeprefix("s3://").partition("/")
+        return bucket, key
+
+    def _local_database(self, temporary_directory: str) -> Path:
+        if not (s3_location := self._s3_location()):
+            return Path(self.location)
+        database = Path(temporary_directory) / "fingerprints.sqlite"
+        try:
+            self.s3_client.download_file(  # type: ignore[union-attr]
+                *s3_location, str(database)
+            )
+        except self.s3_client.exceptions.ClientError as error:  # type: ignore[union-attr]
+            if error.response["Error"]["Code"] not in {"404", "NoSuchKey"}:
+                raise
+        return database
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from patronload.template import rendering_configuration_digest
+
+logger = logging.getLogger(__name__)
+
+# Rendered in place of the expiry and purge dates, which change daily, so that cached
+# fragments can be reused on any day
+EXPIRY_DATE_SLOT = "\x00expiry_date\x00"
+PURGE_DATE_SLOT = "\x00purge_date\x00"
+# Bump when a code change alters the rendered XML, to invalidate cached fragments
+CACHE_VERSION = "1"
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+# Cache writes are batched, to avoid a SQLite statement per patron record
+WRITE_BATCH_SIZE = 1000
+
+
+class FragmentCache:
+    """On-disk cache of rendered patron XML fragments, keyed by a hash of the record.
+
+    The fragments are stored with open expiry and purge date slots, which are filled
+    in with fill_date_slots. The whole cache is invalidated when a template or
+    department mapping changes. When the cache is closed it is shrunk to max_size by
+    evicting the least recently used fragments.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.now = int(time.time())
+        self.used_keys: list[tuple[int, bytes]] = []
+        self.new_fragments: dict[bytes, bytes] = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS fragments (key BLOB PRIMARY KEY, "
+                "fragment BLOB, size INTEGER, last_used INTEGER)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            configuration = self.connection.execute(
+                "SELECT value FROM metadata WHERE name = 'configuration'"
+            ).fetchone()
+            if configuration != (self.configuration_digest(),):
+                if configuration:
+                    logger.info(
+                        "Patron templates or departments changed, fragment cache cleared"
+                    )
+                self.connection.execute("DELETE FROM fragments")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES ('configuration', ?)",
+                    (self.configuration_digest(),),
+                )
+
+    @staticmethod
+    def configuration_digest() -> str:
+        """Return a digest of everything that cached fragments depend on."""
+        configuration_digest = hashlib.sha256(CACHE_VERSION.encode("utf-8"))
+        for patron_type in ["staff", "student"]:
+            configuration_digest.update(rendering_configuration_digest(patron_type))
+        return configuration_digest.hexdigest()
+
+    @staticmethod
+    def key(patron_type: str, patron_record: tuple) -> bytes:
+        """Return the cache key of a patron record.
+
+        Args:
+            patron_type: The type of patron record being processed, staff or student.
+            patron_record: A patron record tuple.
+        """
+        return hashlib.blake2b(
+            f"{patron_type}{patron_record!r}".encode(), digest_size=16
+        ).digest()
+
+    def get(self, key: bytes) -> bytes | None:
+        """Return the cached fragment for a key, or None if it is not cached.
+
+        Args:
+            key: The cache key of a patron record.
+        """
+        with self.lock:
+            if key in self.new_fragments:
+                self.hits += 1
+                return self.new_fragments[key]
+            row = self.connection.execute(
+                "SELECT fragment FROM fragments WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used_keys.append((self.now, key))
+            if len(self.used_keys) >= WRITE_BATCH_SIZE:
+                self._write()
+            return row[0]
+
+    def put(self, key: bytes, fragment: bytes) -> None:
+        """Cache a fragment rendered with open date slots.
+
+        Args:
+            key: The cache key of a patron record.
+            fragment: The UTF-8 encoded XML fragment.
+        """
+        with self.lock:
+            self.new_fragments[key] = fragment
+            if len(self.new_fragments) >= WRITE_BATCH_SIZE:
+                self._write()
+
+    def close(self) -> None:
+        """Write pending changes, evict least recently used fragments and close."""
+        with self.lock:
+            self._write()
+            with self.connection:
+                evicted = self.connection.execute(
+                    "DELETE FROM fragments WHERE key IN (SELECT key FROM (SELECT key, "
+                    "SUM(size) OVER (ORDER BY last_used DESC, key) AS total_size "
+                    "FROM fragments) WHERE total_size > ?)",
+                    (self.max_size,),
+                ).rowcount
+            self.connection.close()
+        logger.info(
+            "Fragment cache: %s hits, %s misses, %s fragments evicted",
+            self.hits,
+            self.misses,
+            evicted,
+        )
+
+    def _write(self) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE fragments SET last_used = ? WHERE key = ?", self.used_keys
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)",
+                (
+                    (key, fragment, len(fragment), self.now)
+                    for key, fragment in self.new_fragments.items()
+                ),
+            )
+        self.used_keys.clear()
+        self.new_fragments.clear()
+
+
+def fill_date_slots(fragment: bytes, six_months: str, two_years: str) -> bytes:
+    """Fill in the expiry and purge dates of a fragment rendered with open date slots.
+
+    Args:
+        fragment: The UTF-8 encoded XML fragment.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+    """
+    return fragment.replace(
+        EXPIRY_DATE_SLOT.encode("utf-8"), six_months.encode("utf-8")
+    ).replace(PURGE_DATE_SLOT.encode("utf-8"), two_years.encode("utf-8"))
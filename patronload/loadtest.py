@@ -0,0 +1,233 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
+from unittest.mock import patch
+
+import click
+
+from patronload.cli import PATRON_QUERIES, main
+from patronload.synthetic import SyntheticPatrons
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+
+DEFAULT_STAFF_RECORDS = 200000
+DEFAULT_STUDENT_RECORDS = 300000
+LOADTEST_BUCKET_NAME = "patronload-loadtest"
+LOADTEST_S3_PREFIX = "patronload"
+LOADTEST_FROM_EMAIL = "from@example.com"
+# The config values of a run against the moto stand-ins. The Data Warehouse
+# credentials are empty, as the stand-in warehouse is a SQLite database.
+LOADTEST_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_SECURITY_TOKEN": "testing",
+    "AWS_SESSION_TOKEN": "testing",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "DATAWAREHOUSE_CLOUDCONNECTOR_JSON": "{}",
+    "S3_BUCKET_NAME": LOADTEST_BUCKET_NAME,
+    "S3_PREFIX": LOADTEST_S3_PREFIX,
+    "SENTRY_DSN": "None",
+    "SES_RECIPIENT_EMAIL": "to@example.com",
+    "SES_SEND_FROM_EMAIL": LOADTEST_FROM_EMAIL,
+    "WORKSPACE": "loadtest",
+}
+
+
+def write_patron_database(
+    database: str,
+    synthetic_patrons: SyntheticPatrons,
+    staff_records: int,
+    student_records: int,
+) -> None:
+    """Write synthetic patrons to a SQLite stand-in for the Data Warehouse tables.
+
+    Args:
+        database: The path of the SQLite database, which must not exist.
+        synthetic_patrons: The seeded generator of the patron rows.
+        staff_records: The number of LIBRARY_EMPLOYEE rows.
+        student_records: The number of LIBRARY_STUDENT rows.
+    """
+    patron_records = {
+        "staff": synthetic_patrons.staff_records(staff_records),
+        "student": synthetic_patrons.student_records(
+            student_records, staff_count=staff_records
+        ),
+    }
+    with contextlib.closing(sqlite3.connect(database)) as connection, connection:
+        for patron_type, query_params in PATRON_QUERIES.items():
+            fields = query_params["fields"]
+            connection.execute(
+                f"CREATE TABLE {query_params['table']} ({', '.join(fields)})"
+            )
+            connection.executemany(
+                f"INSERT INTO {query_params['table']} "  # noqa: S608
+                f"VALUES ({', '.join('?' for _ in fields)})",
+                patron_records[patron_type],
+            )
+            # The student query excludes student employees with a lookup of the KRB
+            # names of the staff table, which is quadratic without an index
+            connection.execute(
+                f"CREATE INDEX {query_params['table']}_KRB_NAME "
+                f"ON {query_params['table']} (KRB_NAME_UPPERCASE)"
+            )
+
+
+@contextlib.contextmanager
+def offline_aws() -> Iterator["S3Client"]:
+    """Run the block against moto S3 and SES, yielding a client of the empty bucket."""
+    # moto is a dev dependency, so it is only imported when a load test runs
+    import boto3  # noqa: PLC0415
+    from moto import mock_aws  # noqa: PLC0415
+
+    with patch.dict(os.environ, LOADTEST_ENV), mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=LOADTEST_BUCKET_NAME)
+        boto3.client("ses").verify_email_identity(EmailAddress=LOADTEST_FROM_EMAIL)
+        yield s3_client
+
+
+def peak_rss() -> dict[str, int]:
+    """Return the peak resident set size in bytes of the process and its children.
+
+    Children are the render worker processes that have exited.
+    """
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+
+def run_load_test(database: str, main_args: list[str]) -> dict[str, Any]:
+    """Run patronload against the stand-in warehouse and AWS, returning the results.
+
+    Args:
+        database: The path of the SQLite stand-in for the Data Warehouse.
+        main_args: Further options of the patronload command, e.g. --xml_shards 4.
+    """
+    with offline_aws() as s3_client:
+        run_output = io.StringIO()
+        start_time = perf_counter()
+        with contextlib.redirect_stdout(run_output):
+            main.main(
+                args=["--data_source", f"sqlite://{database}", *main_args],
+                standalone_mode=False,
+            )
+        wall_time = perf_counter() - start_time
+        zip_files = {
+            s3_object["Key"]: s3_object["Size"]
+            for page in s3_client.get_paginator("list_objects_v2").paginate(
+                Bucket=LOADTEST_BUCKET_NAME, Prefix=LOADTEST_S3_PREFIX
+            )
+            for s3_object in page.get("Contents", [])
+            if s3_object["Key"].endswith(".zip")
+        }
+    # The first line is the run record, any further lines are EMF records
+    run_metrics = json.loads(run_output.getvalue().splitlines()[0])
+    return {
+        "wall_time": round(wall_time, 6),
+        "peak_rss": peak_rss(),
+        "zip_files": zip_files,
+        "run": run_metrics,
+    }
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option(
+    "--staff",
+    "staff_records",
+    type=click.IntRange(min=1),
+    default=DEFAULT_STAFF_RECORDS,
+    help="Number of synthetic staff records.",
+)
+@click.option(
+    "--students",
+    "student_records",
+    type=click.IntRange(min=1),
+    default=DEFAULT_STUDENT_RECORDS,
+    help="Number of synthetic student records.",
+)
+@click.option("--seed", type=int, default=0, help="Seed of the synthetic records.")
+@click.option(
+    "--database",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="SQLite stand-in for the Data Warehouse. Created with the synthetic records "
+    "if it does not exist, otherwise reused as is. Defaults to a temporary file.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default="loadtest_results.json",
+    help="JSON file the results are written to.",
+)
+@click.argument("main_args", nargs=-1, type=click.UNPROCESSED)
+def loadtest(
+    *,
+    staff_records: int,
+    student_records: int,
+    seed: int,
+    database: str | None,
+    output: str,
+    main_args: tuple[str, ...],
+) -> None:
+    """Run the full patronload process offline with synthetic patrons.
+
+    The Data Warehouse is a SQLite database and S3 and SES are mocked with moto, so
+    whole-pipeline changes can be measured without the network. Any further options
+    are passed to patronload, e.g. `loadtest --staff 1000 -- --xml_shards 4`.
+    """
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        database = database or str(Path(temporary_directory) / "patrons.sqlite")
+        setup_time = 0.0
+        if not Path(database).exists():
+            start_time = perf_counter()
+            write_patron_database(
+                database, SyntheticPatrons(seed), staff_records, student_records
+            )
+            setup_time = perf_counter() - start_time
+            click.echo(
+                f"{staff_records} staff and {student_records} student records written "
+                f"to '{database}' in {setup_time:.2f}s"
+            )
+        results = run_load_test(database, list(main_args))
+    results = {
+        "created": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "seed": seed,
+        "main_args": list(main_args),
+        "setup_time": round(setup_time, 6),
+        **results,
+    }
+    click.echo(f"Total wall time: {results['wall_time']:.2f}s")
+    for stage in results["run"]["stages"]:
+        click.echo(
+            f"{stage['stage']} ({stage['patron_type']}): {stage['wall_time']:.2f}s, "
+            f"{stage['records']} records, {stage['records_per_second']:.0f} records/s"
+        )
+    click.echo(
+        f"Peak RSS: {results['peak_rss']['process'] / 1024 / 1024:.1f} MiB, "
+        f"render workers {results['peak_rss']['children'] / 1024 / 1024:.1f} MiB"
+    )
+    for key, size in results["zip_files"].items():
+        click.echo(f"{key}: {size} bytes")
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    click.echo(f"Results written to '{output}'")
+
+
+if __name__ == "__main__":
+    loadtest()
@@ -0,0 +1,241 @@
+import datetime
+import io
+import json
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from time import perf_counter, process_time, thread_time
+from typing import IO, Any
+
+# Stages that run once per run rather than once per patron type are reported with
+# this patron type, so every stage has the same EMF dimensions
+ALL_PATRON_TYPES = "all"
+EMF_METRICS = {
+    "wall_time": ("WallTime", "Seconds"),
+    "cpu_time": ("CPUTime", "Seconds"),
+    "records": ("Records", "Count"),
+    "records_per_second": ("RecordsPerSecond", "Count/Second"),
+    "bytes_in": ("BytesIn", "Bytes"),
+    "bytes_out": ("BytesOut", "Bytes"),
+}
+# Stages whose bytes are not measured, such as the rows fetched by the query, have no
+# bytes metrics rather than bytes metrics that are always zero
+STAGES_WITHOUT_BYTES = frozenset({"connect", "query", "reserve", "s3_cleanup"})
+
+
+class StageMetrics:
+    """Time, records and bytes of one stage of a run, for one patron type."""
+
+    def __init__(self, stage: str, patron_type: str) -> None:
+        self.stage = stage
+        self.patron_type = patron_type
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.records = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records / self.wall_time if self.wall_time else 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        stage_dict = {
+            "stage": self.stage,
+            "patron_type": self.patron_type,
+            "wall_time": round(self.wall_time, 6),
+            "cpu_time": round(self.cpu_time, 6),
+            "records": self.records,
+            "records_per_second": round(self.records_per_second, 3),
+        }
+        if self.stage not in STAGES_WITHOUT_BYTES:
+            stage_dict["bytes_in"] = self.bytes_in
+            stage_dict["bytes_out"] = self.bytes_out
+        return stage_dict
+
+
+class RunMetrics:
+    """Per-stage timing and throughput metrics of a run.
+
+    Stages nest, and the time of a stage excludes the time of the stages entered
+    within it on the same thread, so stages that are streamed through each other,
+    such as query, render, zip and upload, are each timed separately. CPU time is that
+    of the thread running the stage, so work handed to other processes or threads,
+    such as render worker processes and S3 part uploads, is only counted as wall time
+    of the stage waiting for it. Stages are thread safe and a stage run on several
+    threads adds up the time of each thread.
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.datetime.now(tz=datetime.UTC)
+        self.start_wall_time = perf_counter()
+        self.start_cpu_time = process_time()
+        self.stages: dict[tuple[str, str], StageMetrics] = {}
+        self.lock = threading.Lock()
+        self.active_stages = threading.local()
+
+    def stage_metrics(
+        self, stage: str, patron_type: str = ALL_PATRON_TYPES
+    ) -> StageMetrics:
+        """Return the metrics of a stage, created the first time it is requested.
+
+        Args:
+            stage: The name of the stage, e.g. query or upload.
+            patron_type: The patron type the stage processes, if any.
+        """
+        with self.lock:
+            return self.stages.setdefault(
+                (stage, patron_type), StageMetrics(stage, patron_type)
+            )
+
+    @contextmanager
+    def stage(
+        self, stage: str, patron_type: str = ALL_PATRON_TYPES
+    ) -> Iterator[StageMetrics]:
+        """Time the block as a stage, pausing the stage it is nested in.
+
+        Args:
+            stage: The name of the stage, e.g. query or upload.
+            patron_type: The patron type the stage processes, if any.
+        """
+        stage_metrics = self.stage_metrics(stage, patron_type)
+        if not hasattr(self.active_stages, "stack"):
+            self.active_stages.stack = []
+        stack: list[list] = self.active_stages.stack
+        self._pause(stack)
+        stack.append([stage_metrics, perf_counter(), thread_time()])
+        try:
+            yield stage_metrics
+        finally:
+            self._pause(stack)
+            stack.pop()
+            if stack:
+                stack[-1][1:] = [perf_counter(), thread_time()]
+
+    def timed(
+        self, items: Iterable, stage: str, patron_type: str = ALL_PATRON_TYPES
+    ) -> Iterator:
+        """Yield the items of an iterable, timing the production of each as a stage.
+
+        Args:
+            items: An iterable that is lazily produced, e.g. query results.
+            stage: The name of the stage, e.g. query or render.
+            patron_type: The patron type the stage processes, if any.
+        """
+        iterator = iter(items)
+        while True:
+            with self.stage(stage, patron_type):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def as_dict(self, workspace: str) -> dict[str, Any]:
+        """Return the structured record of the run, with a record per stage.
+
+        Args:
+            workspace: The workspace the run is in, e.g. stage or prod.
+        """
+        with self.lock:
+            stages = [stage.as_dict() for stage in self.stages.values()]
+        return {
+            "workspace": workspace,
+            "started": self.started.isoformat(),
+            "wall_time": round(perf_counter() - self.start_wall_time, 6),
+            "cpu_time": round(process_time() - self.start_cpu_time, 6),
+            "stages": stages,
+        }
+
+    def emf_records(self, namespace: str, workspace: str) -> list[dict[str, Any]]:
+        """Return a CloudWatch Embedded Metric Format record per stage of the run.
+
+        Each metric has the workspace, stage and patron type as dimensions. Stages
+        without bytes metrics have no BytesIn and BytesOut metrics.
+
+        Args:
+            namespace: The CloudWatch metrics namespace.
+            workspace: The workspace the run is in, e.g. stage or prod.
+        """
+        timestamp = int(datetime.datetime.now(tz=datetime.UTC).timestamp() * 1000)
+        return [
+            {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": namespace,
+                            "Dimensions": [["Workspace", "Stage", "PatronType"]],
+                            "Metrics": [
+                                {"Name": name, "Unit": unit}
+                                for field, (name, unit) in EMF_METRICS.items()
+                                if field in stage
+                            ],
+                        }
+                    ],
+                },
+                "Workspace": workspace,
+                "Stage": stage["stage"],
+                "PatronType": stage["patron_type"],
+                **{
+                    name: stage[field]
+                    for field, (name, _) in EMF_METRICS.items()
+                    if field in stage
+                },
+            }
+            for stage in self.as_dict(workspace)["stages"]
+        ]
+
+    def to_json_lines(self, workspace: str, emf_namespace: str | None = None) -> str:
+        """Return the run record as a JSON line, followed by any EMF lines.
+
+        Args:
+            workspace: The workspace the run is in, e.g. stage or prod.
+            emf_namespace: If provided, an EMF line per stage is added in this
+            CloudWatch metrics namespace.
+        """
+        records = [self.as_dict(workspace)]
+        if emf_namespace:
+            records.extend(self.emf_records(emf_namespace, workspace))
+        return "\n".join(json.dumps(record, separators=(",", ":")) for record in records)
+
+    def _pause(self, stack: list[list]) -> None:
+        if not stack:
+            return
+        stage_metrics, wall_time, cpu_time = stack[-1]
+        with self.lock:
+            stage_metrics.wall_time += perf_counter() - wall_time
+            stage_metrics.cpu_time += thread_time() - cpu_time
+
+
+class TimedWriter(io.RawIOBase):
+    """Writable file object timing each write to another file object as a stage.
+
+    Writes are passed through to the wrapped file object and the bytes written are
+    counted as the bytes in of the stage.
+    """
+
+    def __init__(
+        self,
+        file_object: IO[bytes] | io.RawIOBase,
+        run_metrics: RunMetrics,
+        stage: str,
+        patron_type: str = ALL_PATRON_TYPES,
+    ) -> None:
+        super().__init__()
+        self.file_object = file_object
+        self.run_metrics = run_metrics
+        self.stage = stage
+        self.patron_type = patron_type
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.file_object.tell()
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        with self.run_metrics.stage(self.stage, self.patron_type) as stage_metrics:
+            bytes_written = self.file_object.write(data) or 0
+            stage_metrics.bytes_in += bytes_written
+        return bytes_written
@@ -1,86 +1,665 @@
 import datetime
+import hashlib
+import itertools
 import logging
+import multiprocessing
+import pickle
 import re
+import threading
+import zlib
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from copy import deepcopy
-from io import BytesIO
-from typing import Any
-from zipfile import ZipFile
-
-from bs4 import BeautifulSoup
-from dateutil.relativedelta import relativedelta
+from io import BytesIO, RawIOBase
+from queue import Queue
+from tempfile import TemporaryFile
+from typing import IO, TYPE_CHECKING, Any
+from zipfile import ZIP_DEFLATED, ZipFile
 
+from patronload.archive import (
+    CompressedMember,
+    DeflateSpool,
+    write_compressed_members_to_zip_file,
+)
 from patronload.config import (
-    STAFF_DEPARTMENTS,
     STAFF_FIELDS,
-    STUDENT_DEPARTMENTS,
     STUDENT_FIELDS,
+    load_departments,
+    template_path,
+)
+from patronload.fingerprint import FingerprintStore
+from patronload.fragment_cache import (
+    EXPIRY_DATE_SLOT,
+    PURGE_DATE_SLOT,
+    FragmentCache,
+    fill_date_slots,
+)
+from patronload.template import (
+    compile_patron_template,
+    rendering_configuration_digest,
 )
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 logger = logging.getLogger(__name__)
 
+RENDER_MODES = ["compiled", "soup"]
+XML_HEADER = b'<?xml version="1.0" encoding="utf-8"?><userRecords>'
+XML_FOOTER = b"</userRecords>"
+# Patron records rendered per chunk in parallel render mode, large enough that
+# sending a chunk to a worker process costs far less than rendering it
+RENDER_CHUNK_SIZE = 2000
+# Patron records waiting to be rendered per XML shard
+SHARD_QUEUE_SIZE = 1000
+
+
+class KrbNameRegistry:
+    """Registry of the KRB names claimed by patron records during a run.
+
+    Each KRB name is recorded with the patron type that claimed it first, so only one
+    Alma profile is created per patron. Student employees have both a staff and a
+    student record and must be created as staff, so either staff records must be
+    processed before student records, or the staff KRB names must be reserved for staff
+    before student records are processed. Claims are thread safe, so patron types with
+    reserved KRB names can be processed concurrently.
+    """
+
+    def __init__(self) -> None:
+        self.patron_types: dict[str, str] = {}
+        self.reserved: dict[str, str] = {}
+        self.claims: Counter[str] = Counter()
+        self.duplicates: Counter[str] = Counter()
+        self.lock = threading.Lock()
+
+    def __contains__(self, krb_name: object) -> bool:
+        """Return True if the KRB name has been claimed."""
+        return krb_name in self.patron_types
+
+    def __len__(self) -> int:
+        """Return the number of claimed KRB names."""
+        return len(self.patron_types)
+
+    def reserve(self, krb_names: Iterable[str], patron_type: str) -> None:
+        """Reserve KRB names so that only records of a patron type can claim them.
+
+        Args:
+            krb_names: The KRB names to reserve.
+            patron_type: The type of patron record the KRB names are reserved for.
+        """
+        with self.lock:
+            for krb_name in krb_names:
+                self.reserved.setdefault(krb_name, patron_type)
+
+    def claim(self, krb_name: str, patron_type: str) -> bool:
+        """Claim a KRB name for a patron type, returns False if already claimed.
+
+        A KRB name reserved for another patron type can not be claimed.
+
+        Args:
+            krb_name: The KRB name of the patron record.
+            patron_type: The type of patron record being processed, staff or student.
+        """
+        with self.lock:
+            if krb_name in self.patron_types or (
+                self.reserved.get(krb_name, patron_type) != patron_type
+            ):
+                self.duplicates[patron_type] += 1
+                return False
+            self.patron_types[krb_name] = patron_type
+            self.claims[patron_type] += 1
+            return True
+
+    def claimed_by(self, krb_name: str) -> str | None:
+        """Return the patron type that claimed a KRB name, if any."""
+        return self.patron_types.get(krb_name)
+
+
+class PatronSetHash:
+    """Hash of the deduplicated patron records of one patron type.
+
+    Each record is hashed separately and the digests are summed modulo 2**256, so the
+    hash does not depend on the order that the Data Warehouse returns records in. The
+    template and department mapping are part of the hash, so a change to how patrons
+    are rendered also changes it. The expiry and purge dates are not part of the hash,
+    as they change daily.
+    """
+
+    def __init__(self, patron_type: str) -> None:
+        self.patron_type = patron_type
+        self.record_count = 0
+        self.digest_sum = 0
+
+    def update(self, patron_record: tuple) -> None:
+        """Add a patron record to the hash.
+
+        Args:
+            patron_record: A deduplicated patron record tuple.
+        """
+        self.digest_sum = (
+            self.digest_sum
+            + int.from_bytes(hashlib.sha256(repr(patron_record).encode("utf-8")).digest())
+        ) % 2**256
+        self.record_count += 1
+
+    def hash_records(self, patron_records: Iterable[tuple]) -> Iterator[tuple]:
+        """Yield the patron records, adding each to the hash as it is consumed.
+
+        Args:
+            patron_records: An iterable of deduplicated patron record tuples.
+        """
+        for patron_record in patron_records:
+            self.update(patron_record)
+            yield patron_record
+
+    def hexdigest(self) -> str:
+        """Return the hash of the patron records and rendering configuration."""
+        patron_set_hash = hashlib.sha256(rendering_configuration_digest(self.patron_type))
+        patron_set_hash.update(self.digest_sum.to_bytes(32))
+        patron_set_hash.update(str(self.record_count).encode("utf-8"))
+        return patron_set_hash.hexdigest()
+
+
+class PatronRecordSpool:
+    """Patron records spooled to a temporary file, so they can be iterated again.
+
+    Records are pickled in chunks as they are written. Used to hash the deduplicated
+    records of a patron type before deciding whether to render them, without querying
+    the Data Warehouse twice.
+    """
+
+    def __init__(self, chunk_size: int = RENDER_CHUNK_SIZE) -> None:
+        self.file: IO[bytes] = TemporaryFile()  # noqa: SIM115
+        self.chunk_size = chunk_size
+
+    def write(self, patron_records: Iterable[tuple]) -> None:
+        """Append patron records to the spool.
+
+        Args:
+            patron_records: An iterable of patron record tuples.
+        """
+        for chunk in itertools.batched(patron_records, self.chunk_size):
+            pickle.dump(chunk, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Yield the spooled patron records in the order they were written."""
+        self.file.seek(0)
+        while True:
+            try:
+                # The spool only holds records pickled by this process
+                chunk = pickle.load(self.file)  # noqa: S301
+            except EOFError:
+                return
+            yield from chunk
+
+    def close(self) -> None:
+        """Close and remove the temporary file."""
+        self.file.close()
+
 
 def patrons_xml_string_from_records(
-    patron_type: str, patron_records: list[tuple], existing_krb_names: list[str]
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    krb_name_registry: KrbNameRegistry,
+    render_mode: str = "compiled",
+    render_workers: int = 1,
 ) -> str:
     """Create patrons XML string from patron records.
 
     Args:
         patron_type: The type of patron record being processed, staff or student.
         patron_records: A list of patron record tuples.
-        existing_krb_names: A list of IDs that have already been processed. Used to ensure
+        krb_name_registry: The KRB names that have already been processed. Used to ensure
         that duplicate profiles are not created, such as when students have already been
         added as staff.
+        render_mode: "compiled" renders each patron from the precompiled template,
+        "soup" populates a copy of the BeautifulSoup template for each patron and is kept
+        as the reference implementation.
+        render_workers: The number of processes rendering patron records, records are
+        rendered in the current process if 1.
     """
-    patrons_xml_string = '<?xml version="1.0" encoding="utf-8"?><userRecords>'
-
-    with open(f"config/{patron_type}_template.xml", encoding="utf8") as xml_template:
-        patron_template = BeautifulSoup(xml_template, "html.parser")
-        six_months = (
-            datetime.datetime.now(tz=datetime.UTC).date() + relativedelta(months=+6)
-        ).strftime("%Y-%m-%d") + "Z"
-        two_years = (
-            datetime.datetime.now(tz=datetime.UTC).date()
-            + relativedelta(years=+2, months=+6)
-        ).strftime("%Y-%m-%d") + "Z"
+    return b"".join(
+        patrons_xml_from_records(
+            patron_type, patron_records, krb_name_registry, render_mode, render_workers
+        )
+    ).decode("utf-8")
 
-        for patron_record in patron_records:
-            if patron_record[2]:  # Check for KRB_NAME_UPPERCASE field
-                if patron_record[2] not in existing_krb_names:
-                    existing_krb_names.append(patron_record[2])
-                    template = deepcopy(patron_template)
-                    if patron_type == "staff":
-                        patron_dict = dict(zip(STAFF_FIELDS, patron_record, strict=True))
-                        updated_template = populate_staff_fields(template, patron_dict)
-                    elif patron_type == "student":
-                        patron_dict = dict(
-                            zip(STUDENT_FIELDS, patron_record, strict=True)
-                        )
-                        updated_template = populate_student_fields(template, patron_dict)
-                    patron_xml = populate_common_fields(
-                        updated_template,
-                        patron_dict,
-                        six_months,
-                        two_years,
-                    )
-                    patrons_xml_string += patron_xml.decode_contents()
-                else:
-                    logger.debug(
-                        "Patron record has already been created for MIT ID # '%s'",
-                        patron_record[0],
-                    )
+
+def patrons_xml_from_records(
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    krb_name_registry: KrbNameRegistry,
+    render_mode: str = "compiled",
+    render_workers: int = 1,
+    *,
+    patron_set_hash: PatronSetHash | None = None,
+    fingerprint_store: FingerprintStore | None = None,
+    fragment_cache: FragmentCache | None = None,
+    render_pool: ProcessPoolExecutor | None = None,
+) -> Iterator[bytes]:
+    """Yield UTF-8 encoded patrons XML, one patron fragment at a time.
+
+    The XML declaration and opening userRecords tag are yielded first and the closing
+    tag last. Records are processed as the generator is consumed, so a staff generator
+    must be exhausted before a student generator sharing the same krb_name_registry.
+
+    With more than one render worker, duplicate and rejected records are still removed
+    in the current process, then chunks of records are rendered in a process pool and
+    yielded in input order, so the XML is identical to rendering in one process.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: An iterable of patron record tuples.
+        krb_name_registry: The KRB names that have already been processed. Used to ensure
+        that duplicate profiles are not created, such as when students have already been
+        added as staff.
+        render_mode: "compiled" renders each patron from the precompiled template,
+        "soup" populates a copy of the BeautifulSoup template for each patron and is kept
+        as the reference implementation.
+        render_workers: The number of processes rendering patron records, records are
+        rendered in the current process if 1.
+        patron_set_hash: Updated with each deduplicated patron record, if provided.
+        fingerprint_store: If provided, only new and changed patron records are
+        rendered, see FingerprintStore.
+        fragment_cache: If provided, cached fragments are reused for unchanged patron
+        records, see FragmentCache. Only supported with one render worker.
+        render_pool: A process pool from create_render_pool shared with other patron
+        types, if provided. Otherwise a pool of render_workers is started.
+    """
+    if render_mode not in RENDER_MODES:
+        message = f"'{render_mode}' is not a valid render mode"
+        raise ValueError(message)
+    if fragment_cache and render_workers > 1:
+        message = "A fragment cache can not be used with more than one render worker"
+        raise ValueError(message)
+    yield XML_HEADER
+    six_months, two_years = expiry_and_purge_dates()
+    unique_patron_records = deduplicate_patron_records(
+        patron_type, patron_records, krb_name_registry
+    )
+    if patron_set_hash:
+        unique_patron_records = patron_set_hash.hash_records(unique_patron_records)
+    if fingerprint_store:
+        unique_patron_records = fingerprint_store.changed_records(
+            patron_type, unique_patron_records
+        )
+    if render_workers > 1:
+        yield from render_patron_records_in_parallel(
+            patron_type,
+            unique_patron_records,
+            render_mode,
+            six_months,
+            two_years,
+            render_workers=render_workers,
+            render_pool=render_pool,
+        )
+    else:
+        yield from render_patron_records(
+            patron_type,
+            unique_patron_records,
+            render_mode,
+            six_months,
+            two_years,
+            fragment_cache=fragment_cache,
+        )
+    yield XML_FOOTER
+
+
+def write_sharded_patrons_xml_to_zip_file(
+    zip_file_object: IO[bytes] | RawIOBase,
+    xml_file_names: list[str],
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    krb_name_registry: KrbNameRegistry,
+    *,
+    render_mode: str = "compiled",
+    patron_set_hash: PatronSetHash | None = None,
+    fingerprint_store: FingerprintStore | None = None,
+    fragment_cache: FragmentCache | None = None,
+    timed: Callable[[Iterable[bytes]], Iterable[bytes]] | None = None,
+) -> int:
+    """Split patrons XML into shards that are rendered and compressed in parallel.
+
+    Duplicate and rejected records are removed in the current thread, then each record
+    is assigned to a shard by a hash of its KRB name. Each shard is rendered and
+    deflate-compressed to a temporary file on its own thread, and the compressed shards
+    are written to the zip file as separate XML files once all the records have been
+    processed. Returns the total uncompressed size of the XML files.
+
+    Args:
+        zip_file_object: A writable binary file object for the zip file.
+        xml_file_names: The names of the XML files, one per shard.
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: An iterable of patron record tuples.
+        krb_name_registry: The KRB names that have already been processed.
+        render_mode: "compiled" or "soup", see patrons_xml_from_records.
+        patron_set_hash: Updated with each deduplicated patron record, if provided.
+        fingerprint_store: If provided, only new and changed patron records are
+        rendered, see FingerprintStore.
+        fragment_cache: If provided, cached fragments are reused for unchanged patron
+        records, see FragmentCache. Only supported with one render worker.
+        timed: If provided, wraps the XML fragments rendered on each shard thread, e.g.
+        to time the render separately from the compression.
+    """
+    if render_mode not in RENDER_MODES:
+        message = f"'{render_mode}' is not a valid render mode"
+        raise ValueError(message)
+    six_months, two_years = expiry_and_purge_dates()
+    shard_queues: list[Queue[tuple | None]] = [
+        Queue(maxsize=SHARD_QUEUE_SIZE) for _ in xml_file_names
+    ]
+    with (
+        ExitStack() as stack,
+        ThreadPoolExecutor(max_workers=len(xml_file_names)) as executor,
+    ):
+        shards = [
+            executor.submit(
+                compress_patrons_xml_shard,
+                xml_file_name,
+                iter(shard_queue.get, None),
+                patron_type,
+                render_mode=render_mode,
+                six_months=six_months,
+                two_years=two_years,
+                fragment_cache=fragment_cache,
+                timed=timed,
+            )
+            for xml_file_name, shard_queue in zip(
+                xml_file_names, shard_queues, strict=True
+            )
+        ]
+        # The executor waits for every shard before the stack is closed, so the
+        # compressed shards are closed even if another shard or the zip file failed
+        for shard in shards:
+            stack.callback(close_compressed_shard, shard)
+        unique_patron_records = deduplicate_patron_records(
+            patron_type, patron_records, krb_name_registry
+        )
+        if patron_set_hash:
+            unique_patron_records = patron_set_hash.hash_records(unique_patron_records)
+        if fingerprint_store:
+            unique_patron_records = fingerprint_store.changed_records(
+                patron_type, unique_patron_records
+            )
+        try:
+            for patron_record in unique_patron_records:
+                shard_queues[
+                    zlib.crc32(patron_record[2].encode("utf-8")) % len(shard_queues)
+                ].put(patron_record)
+        finally:
+            for shard_queue in shard_queues:
+                shard_queue.put(None)
+        members = [shard.result() for shard in shards]
+        write_compressed_members_to_zip_file(zip_file_object, members)
+    return sum(member.file_size for member in members)
+
+
+def close_compressed_shard(shard: Future[CompressedMember]) -> None:
+    """Close the temporary file of a compressed shard, if it was compressed.
+
+    Args:
+        shard: The future of a compress_patrons_xml_shard call.
+    """
+    if shard.exception() is None:
+        shard.result().file.close()
+
+
+def compress_patrons_xml_shard(
+    xml_file_name: str,
+    patron_records: Iterator[tuple],
+    patron_type: str,
+    *,
+    render_mode: str,
+    six_months: str,
+    two_years: str,
+    fragment_cache: FragmentCache | None = None,
+    timed: Callable[[Iterable[bytes]], Iterable[bytes]] | None = None,
+) -> CompressedMember:
+    """Render a shard of deduplicated patron records to deflate-compressed XML.
+
+    If rendering fails the remaining records are consumed, so that the thread
+    distributing records to the shards is not blocked on a full queue.
+
+    Args:
+        xml_file_name: The name of the XML file in the zip file.
+        patron_records: An iterator of deduplicated patron record tuples.
+        patron_type: The type of patron record being processed, staff or student.
+        render_mode: "compiled" or "soup", see patrons_xml_from_records.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+        fragment_cache: If provided, used to reuse and cache rendered fragments.
+        timed: If provided, wraps the rendered XML fragments, e.g. to time them.
+    """
+    spool = DeflateSpool(xml_file_name)
+    try:
+        spool.write(XML_HEADER)
+        xml_fragments = render_patron_records(
+            patron_type,
+            patron_records,
+            render_mode,
+            six_months,
+            two_years,
+            fragment_cache=fragment_cache,
+        )
+        for xml_fragment in timed(xml_fragments) if timed else xml_fragments:
+            spool.write(xml_fragment)
+        spool.write(XML_FOOTER)
+    except Exception:
+        spool.file.close()
+        for _ in patron_records:
+            pass
+        raise
+    return spool.finish()
+
+
+def expiry_and_purge_dates() -> tuple[str, str]:
+    """Return the patron expiry date, six months from now, and the purge date."""
+    from dateutil.relativedelta import relativedelta  # noqa: PLC0415
+
+    today = datetime.datetime.now(tz=datetime.UTC).date()
+    return (
+        (today + relativedelta(months=+6)).strftime("%Y-%m-%d") + "Z",
+        (today + relativedelta(years=+2, months=+6)).strftime("%Y-%m-%d") + "Z",
+    )
+
+
+def deduplicate_patron_records(
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    krb_name_registry: KrbNameRegistry,
+) -> Iterator[tuple]:
+    """Yield the patron records with a KRB name that has not already been processed.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: An iterable of patron record tuples.
+        krb_name_registry: The KRB names that have already been processed.
+    """
+    for patron_record in patron_records:
+        if patron_record[2]:  # Check for KRB_NAME_UPPERCASE field
+            if krb_name_registry.claim(patron_record[2], patron_type):
+                yield patron_record
             else:
                 logger.debug(
-                    "Rejected record: MIT ID # '%s', missing field KRB_NAME_UPPERCASE",
+                    "Patron record has already been created for MIT ID # '%s'",
                     patron_record[0],
                 )
-    patrons_xml_string += "</userRecords>"
-    return patrons_xml_string
+        else:
+            logger.debug(
+                "Rejected record: MIT ID # '%s', missing field KRB_NAME_UPPERCASE",
+                patron_record[0],
+            )
+
+
+def render_patron_records(
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    render_mode: str,
+    six_months: str,
+    two_years: str,
+    *,
+    fragment_cache: FragmentCache | None = None,
+) -> Iterator[bytes]:
+    """Yield the UTF-8 encoded XML of each patron record.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: An iterable of deduplicated patron record tuples.
+        render_mode: "compiled" or "soup", see patrons_xml_from_records.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+        fragment_cache: If provided, cached fragments are reused for unchanged patron
+        records and newly rendered fragments are added to the cache.
+    """
+    if render_mode == "soup":
+        from bs4 import BeautifulSoup  # noqa: PLC0415
+
+        with open(template_path(patron_type), encoding="utf8") as xml_template:
+            patron_template = BeautifulSoup(xml_template, "html.parser")
+    else:
+        compiled_template = compile_patron_template(patron_type)
+    # One dict is refilled with the values of each patron record, rather than a new
+    # dict being allocated per record. The render steps do not keep a reference to it.
+    fields = STAFF_FIELDS if patron_type == "staff" else STUDENT_FIELDS
+    patron_dict: dict[str, Any] = dict.fromkeys(fields)
+    # Cached fragments are rendered with open date slots, filled in on every use
+    expiry_date, purge_date = (
+        (EXPIRY_DATE_SLOT, PURGE_DATE_SLOT) if fragment_cache else (six_months, two_years)
+    )
+    for patron_record in patron_records:
+        if fragment_cache:
+            fragment_key = fragment_cache.key(patron_type, patron_record)
+            cached_fragment = fragment_cache.get(fragment_key)
+            if cached_fragment is not None:
+                yield fill_date_slots(cached_fragment, six_months, two_years)
+                continue
+        patron_dict.update(zip(fields, patron_record, strict=True))
+        if render_mode == "soup":
+            template = deepcopy(patron_template)
+            if patron_type == "staff":
+                updated_template = populate_staff_fields(template, patron_dict)
+            elif patron_type == "student":
+                updated_template = populate_student_fields(template, patron_dict)
+            patron_xml = (
+                populate_common_fields(
+                    updated_template,
+                    patron_dict,
+                    expiry_date,
+                    purge_date,
+                )
+                .decode_contents()
+                .encode("utf-8")
+            )
+        else:
+            patron_xml = compiled_template.render(
+                patron_slot_values(patron_type, patron_dict, expiry_date, purge_date)
+            )
+        if fragment_cache:
+            fragment_cache.put(fragment_key, patron_xml)
+            patron_xml = fill_date_slots(patron_xml, six_months, two_years)
+        yield patron_xml
+
+
+def render_patron_records_in_parallel(
+    patron_type: str,
+    patron_records: Iterable[tuple],
+    render_mode: str,
+    six_months: str,
+    two_years: str,
+    *,
+    render_workers: int,
+    chunk_size: int = RENDER_CHUNK_SIZE,
+    render_pool: ProcessPoolExecutor | None = None,
+) -> Iterator[bytes]:
+    """Render chunks of patron records in a process pool, yielding them in input order.
+
+    At most two chunks per worker are in flight, so memory use is bounded. If all the
+    records fit in one chunk they are rendered in the current process, since starting
+    the process pool would take longer than rendering them. Debug logs from rendering,
+    such as unknown departments, are not captured from the worker processes.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: An iterable of deduplicated patron record tuples.
+        render_mode: "compiled" or "soup", see patrons_xml_from_records.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+        render_workers: The number of processes rendering patron records.
+        chunk_size: The number of patron records rendered by a worker at a time.
+        render_pool: A process pool from create_render_pool shared with other patron
+        types, if provided. Otherwise a pool of render_workers is started.
+    """
+    chunks = itertools.batched(patron_records, chunk_size)
+    first_chunk = next(chunks, ())
+    if len(first_chunk) < chunk_size:
+        yield from render_patron_records(
+            patron_type, first_chunk, render_mode, six_months, two_years
+        )
+        return
+    with ExitStack() as stack:
+        executor = render_pool or stack.enter_context(create_render_pool(render_workers))
+        rendered_chunks: deque[Future[bytes]] = deque()
+        for chunk in itertools.chain([first_chunk], chunks):
+            rendered_chunks.append(
+                executor.submit(
+                    render_patron_chunk,
+                    patron_type,
+                    chunk,
+                    render_mode,
+                    six_months,
+                    two_years,
+                )
+            )
+            if len(rendered_chunks) >= render_workers * 2:
+                yield rendered_chunks.popleft().result()
+        while rendered_chunks:
+            yield rendered_chunks.popleft().result()
+
+
+def create_render_pool(render_workers: int) -> ProcessPoolExecutor:
+    """Create a process pool rendering chunks of patron records.
+
+    Worker processes are started as chunks are submitted, so a pool that renders no
+    chunks starts no processes.
+
+    Args:
+        render_workers: The number of processes rendering patron records.
+    """
+    # Worker processes are spawned, forking a process that runs threads is unsafe
+    return ProcessPoolExecutor(
+        max_workers=render_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def render_patron_chunk(
+    patron_type: str,
+    patron_records: tuple[tuple, ...],
+    render_mode: str,
+    six_months: str,
+    two_years: str,
+) -> bytes:
+    """Render a chunk of patron records to UTF-8 encoded XML in a worker process.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_records: A chunk of deduplicated patron record tuples.
+        render_mode: "compiled" or "soup", see patrons_xml_from_records.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+    """
+    return b"".join(
+        render_patron_records(
+            patron_type, patron_records, render_mode, six_months, two_years
+        )
+    )
 
 
 def populate_staff_fields(
-    patron_template: BeautifulSoup,
+    patron_template: "BeautifulSoup",
     patron_dict: dict[str, Any],
-) -> BeautifulSoup:
+) -> "BeautifulSoup":
     """Populate the staff fields in a patron record.
 
     The order of the patron record fields must be in same order as they in the
@@ -111,9 +690,10 @@ def populate_staff_fields(
     else:
         patron_template.phones.clear()  # type: ignore[union-attr]
 
-    if patron_dict["ORG_UNIT_ID"] in STAFF_DEPARTMENTS:
+    staff_departments = load_departments("staff")
+    if patron_dict["ORG_UNIT_ID"] in staff_departments:
         patron_template.statistic_category.string = (  # type: ignore[union-attr]
-            STAFF_DEPARTMENTS[patron_dict["ORG_UNIT_ID"]]
+            staff_departments[patron_dict["ORG_UNIT_ID"]]
         )
     else:
         patron_template.statistic_category.string = "ZQ"  # type: ignore[union-attr]
@@ -129,9 +709,9 @@ def populate_staff_fields(
 
 
 def populate_student_fields(
-    patron_template: BeautifulSoup,
+    patron_template: "BeautifulSoup",
     patron_dict: dict[str, Any],
-) -> BeautifulSoup:
+) -> "BeautifulSoup":
     """Populate the student fields in a patron record.
 
     The order of the patron record fields must be in same order as they in the
@@ -172,9 +752,10 @@ def populate_student_fields(
     for phone in patron_template.find_all("phone"):
         if not phone.phone_number.string:
             phone.extract()
-    if patron_dict["HOME_DEPARTMENT"] in STUDENT_DEPARTMENTS:
+    student_departments = load_departments("student")
+    if patron_dict["HOME_DEPARTMENT"] in student_departments:
         patron_template.statistic_category.string = (  # type: ignore[union-attr]
-            STUDENT_DEPARTMENTS[patron_dict["HOME_DEPARTMENT"]]
+            student_departments[patron_dict["HOME_DEPARTMENT"]]
         )
     else:
         patron_template.statistic_category.string = "ZZ"  # type: ignore[union-attr]
@@ -201,11 +782,11 @@ def populate_student_fields(
 
 
 def populate_common_fields(
-    patron_template: BeautifulSoup,
+    patron_template: "BeautifulSoup",
     patron_dict: dict[str, Any],
     six_months: str,
     two_years: str,
-) -> BeautifulSoup:
+) -> "BeautifulSoup":
     """Populate the fields common to both staff and student patron records.
 
     The order of the patron record fields must be in same order as they in the
@@ -252,6 +833,149 @@ def populate_common_fields(
     return patron_template
 
 
+def patron_slot_values(
+    patron_type: str,
+    patron_dict: dict[str, Any],
+    six_months: str,
+    two_years: str,
+) -> dict[str, str | None]:
+    """Build the compiled template slot values for a patron record.
+
+    Slot values of None omit the optional block containing that slot, e.g. the emails
+    of a patron without an email address.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+        patron_dict: A dict of patron record values.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+    """
+    if patron_type == "staff":
+        slot_values = staff_slot_values(patron_dict)
+    elif patron_type == "student":
+        slot_values = student_slot_values(patron_dict)
+    slot_values.update(common_slot_values(patron_dict, six_months, two_years))
+    return slot_values
+
+
+def staff_slot_values(patron_dict: dict[str, Any]) -> dict[str, str | None]:
+    """Build the staff slot values, mirroring populate_staff_fields.
+
+    Args:
+        patron_dict: A dict of patron record values.
+    """
+    staff_departments = load_departments("staff")
+    if patron_dict["ORG_UNIT_ID"] in staff_departments:
+        statistic_category = staff_departments[patron_dict["ORG_UNIT_ID"]]
+    else:
+        statistic_category = "ZQ"
+        logger.debug(
+            "Unknown dept: '%s' in record with MIT ID # '%s'",
+            patron_dict["ORG_UNIT_ID"],
+            patron_dict["MIT_ID"],
+        )
+    return {
+        "user_group": patron_dict["LIBRARY_PERSON_TYPE_CODE"] or "",
+        "user_group_desc": patron_dict["LIBRARY_PERSON_TYPE"] or "",
+        "line1": patron_dict["OFFICE_ADDRESS"] or "NO ADDRESS ON FILE IN DATA WAREHOUSE",
+        "phone_number": (
+            format_phone_number(patron_dict["OFFICE_PHONE"])
+            if patron_dict["OFFICE_PHONE"]
+            else None
+        ),
+        "statistic_category": statistic_category,
+        "statistic_category_desc": patron_dict["ORG_UNIT_TITLE"] or "Unknown",
+    }
+
+
+def student_slot_values(patron_dict: dict[str, Any]) -> dict[str, str | None]:
+    """Build the student slot values, mirroring populate_student_fields.
+
+    Args:
+        patron_dict: A dict of patron record values.
+    """
+    student_departments = load_departments("student")
+    if patron_dict["HOME_DEPARTMENT"] in student_departments:
+        statistic_category = student_departments[patron_dict["HOME_DEPARTMENT"]]
+    else:
+        statistic_category = "ZZ"
+        logger.debug(
+            "Unknown dept: '%s' in record with MIT ID # '%s'",
+            patron_dict["HOME_DEPARTMENT"],
+            patron_dict["MIT_ID"],
+        )
+
+    # User Group codes
+    # 31 = Student - Undergraduate
+    # 32 = Student - Graduate
+    # 54 = Non-MIT - Cross-registered
+    user_group = ""
+    if patron_dict["STUDENT_YEAR"]:
+        if re.search("^[1234Uu]$", patron_dict["STUDENT_YEAR"]):
+            user_group = "31"
+        elif re.search("^[Gg]$", patron_dict["STUDENT_YEAR"]):
+            user_group = "32"
+    if patron_dict["HOME_DEPARTMENT"] and re.search(
+        "^NI[UVWTRH]$", patron_dict["HOME_DEPARTMENT"]
+    ):
+        user_group = "54"
+
+    return {
+        "line1": patron_dict["TERM_STREET1"] or "NO ADDRESS ON FILE IN DATA WAREHOUSE",
+        "line3": patron_dict["TERM_STREET2"] or "",
+        "city": patron_dict["TERM_CITY"] or "",
+        "state_province": patron_dict["TERM_STATE"] or "",
+        "postal_code": patron_dict["TERM_ZIP"] or "",
+        "preferred_phone_number": format_phone_number(
+            patron_dict["OFFICE_PHONE"]
+            or patron_dict["TERM_PHONE1"]
+            or patron_dict["TERM_PHONE2"]
+            or ""
+        )
+        or None,
+        "other_phone_number": (
+            format_phone_number(patron_dict["TERM_PHONE1"])
+            if patron_dict["OFFICE_PHONE"] and patron_dict["TERM_PHONE1"]
+            else None
+        ),
+        "statistic_category": statistic_category,
+        "user_group": user_group,
+    }
+
+
+def common_slot_values(
+    patron_dict: dict[str, Any],
+    six_months: str,
+    two_years: str,
+) -> dict[str, str | None]:
+    """Build the slot values common to all patrons, mirroring populate_common_fields.
+
+    Args:
+        patron_dict: A dict of patron record values.
+        six_months: Six months from the current date.
+        two_years: Two years from the current date.
+    """
+    slot_values: dict[str, str | None] = {}
+    for part in ["FIRST", "MIDDLE", "LAST"]:
+        pref = (patron_dict.get(f"PREFERRED_{part}_NAME") or "").strip()
+        legal = (patron_dict.get(f"LEGAL_{part}_NAME") or "").strip()
+        slot_values[f"{part.lower()}_name"] = legal
+        slot_values[f"pref_{part.lower()}_name"] = (
+            pref if pref.lower() != legal.lower() and pref else ""
+        )
+    slot_values["primary_id"] = patron_dict["KRB_NAME_UPPERCASE"] + "@MIT.EDU"
+    slot_values["expiry_date"] = six_months
+    slot_values["purge_date"] = two_years
+    slot_values["email_address"] = patron_dict["EMAIL_ADDRESS"] or None
+    slot_values["mit_id"] = patron_dict["MIT_ID"] or ""
+    slot_values["barcode"] = (
+        patron_dict["LIBRARY_ID"]
+        if patron_dict["LIBRARY_ID"] and patron_dict["LIBRARY_ID"] != "NONE"
+        else None
+    )
+    return slot_values
+
+
 def create_and_write_to_zip_file_in_memory(
     xml_file_name: str, file_content: str
 ) -> BytesIO:
@@ -272,6 +996,47 @@ def create_and_write_to_zip_file_in_memory(
         return zip_file_object
 
 
+def write_xml_fragments_to_zip_file(
+    zip_file_object: IO[bytes] | RawIOBase,
+    xml_file_name: str,
+    xml_fragments: Iterable[bytes],
+    compression: int = ZIP_DEFLATED,
+) -> int:
+    """Stream encoded XML fragments into a new zip file member as they are produced.
+
+    The uncompressed XML is never held in memory as a whole, the fragments are
+    compressed as they are written. As the size of the XML file is not known up front,
+    the member is always written with Zip64 sizes so it may exceed 2 GiB. Returns the
+    uncompressed size of the XML file.
+
+    Args:
+        zip_file_object: A writable binary file object for the zip file.
+        xml_file_name: The name of the XML file to be zipped.
+        xml_fragments: Encoded XML fragments, e.g. from patrons_xml_from_records.
+        compression: The zipfile compression method for the XML file.
+    """
+    with (
+        ZipFile(zip_file_object, "w", compression=compression) as zip_file,
+        zip_file.open(xml_file_name, "w", force_zip64=True) as xml_file,
+    ):
+        return write_patrons_xml(xml_file, xml_fragments)
+
+
+def write_patrons_xml(file_object: IO[bytes], xml_fragments: Iterable[bytes]) -> int:
+    """Write encoded patrons XML fragments to a binary file object as they are produced.
+
+    Returns the number of bytes written.
+
+    Args:
+        file_object: A writable binary file object.
+        xml_fragments: Encoded XML fragments, e.g. from patrons_xml_from_records.
+    """
+    bytes_written = 0
+    for xml_fragment in xml_fragments:
+        bytes_written += file_object.write(xml_fragment)
+    return bytes_written
+
+
 def format_phone_number(phone_number: str) -> str:
     """Format a string of 10 numbers as a phone number with dashes.
 
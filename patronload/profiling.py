@@ -0,0 +1,151 @@
+import cProfile
+import datetime
+import logging
+import threading
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_ALLOCATIONS = 25
+
+
+class StageProfiler:
+    """cProfile and tracemalloc profiles of the stages of a run, written to a directory.
+
+    Each profiled stage writes a <stage>.pstats file, which can be read with pstats or
+    snakeviz, and a <stage>.allocations.txt file with the peak traced memory and the
+    lines that allocated the most memory during the stage. The files of a run are
+    written to a subdirectory named after the date and time the run started.
+
+    cProfile and tracemalloc trace the whole process, so profiled stages are run one
+    at a time: a stage waits while a stage on another thread is profiled, and a stage
+    nested in a profiled stage on the same thread is part of its profile. Calls made
+    on helper threads, such as S3 part uploads, are included in the profile of the
+    stage that started them. Render worker processes are not profiled.
+    """
+
+    def __init__(
+        self, directory: str, top_allocations: int = DEFAULT_TOP_ALLOCATIONS
+    ) -> None:
+        self.run_name = datetime.datetime.now(tz=datetime.UTC).strftime(
+            "%Y-%m-%d_%H.%M.%S"
+        )
+        self.directory = Path(directory) / self.run_name
+        self.top_allocations = top_allocations
+        self.files: list[Path] = []
+        self.lock = threading.RLock()
+        self.profiling = False
+        self.started_tracing = False
+
+    @contextmanager
+    def profile(self, stage: str) -> Iterator[None]:
+        """Profile the block as a stage, once no other stage is being profiled.
+
+        Args:
+            stage: The name of the stage, used for the names of the profile files.
+        """
+        with self.lock:
+            if self.profiling:
+                yield
+                return
+            self.profiling = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+            start_snapshot = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                end_snapshot = tracemalloc.take_snapshot()
+                _, peak_size = tracemalloc.get_traced_memory()
+                self.profiling = False
+                self._write(stage, profile, start_snapshot, end_snapshot, peak_size)
+
+    def close(self) -> None:
+        """Stop tracing memory allocations, if the profiler started it."""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def upload(self, s3_client: "S3Client", s3_bucket_name: str, s3_prefix: str) -> None:
+        """Upload the profile files of the run under a prefix in a bucket.
+
+        Args:
+            s3_client: A configured s3 client.
+            s3_bucket_name: The bucket to upload the profile files to.
+            s3_prefix: The prefix the run subdirectory is uploaded under.
+        """
+        for path in self.files:
+            s3_client.upload_file(
+                str(path), s3_bucket_name, f"{s3_prefix}/{self.run_name}/{path.name}"
+            )
+        logger.info(
+            "%s profile files uploaded to '%s/%s/%s'",
+            len(self.files),
+            s3_bucket_name,
+            s3_prefix,
+            self.run_name,
+        )
+
+    def _write(
+        self,
+        stage: str,
+        profile: cProfile.Profile,
+        start_snapshot: tracemalloc.Snapshot,
+        end_snapshot: tracemalloc.Snapshot,
+        peak_size: int,
+    ) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        pstats_path = self.directory / f"{stage}.pstats"
+        profile.dump_stats(pstats_path)
+        ignore_tracemalloc = [
+            tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__)
+        ]
+        allocations = end_snapshot.filter_traces(ignore_tracemalloc).compare_to(
+            start_snapshot.filter_traces(ignore_tracemalloc), "lineno"
+        )
+        allocations_path = self.directory / f"{stage}.allocations.txt"
+        allocations_path.write_text(
+            "\n".join(
+                [
+                    f"Peak traced memory: {peak_size} bytes",
+                    f"Top {self.top_allocations} allocations by size:",
+                    *(
+                        str(statistic)
+                        for statistic in allocations[: self.top_allocations]
+                    ),
+                ]
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+        self.files.extend([pstats_path, allocations_path])
+        logger.info(
+            "Profile of %s written to '%s', peak traced memory %s bytes",
+            stage,
+            self.directory,
+            peak_size,
+        )
+
+
+def profile_stage(
+    stage_profiler: StageProfiler | None, stage: str
+) -> AbstractContextManager:
+    """Profile the block as a stage if a profiler is provided, see StageProfiler.
+
+    Args:
+        stage_profiler: The profiler of the run, if profiling is enabled.
+        stage: The name of the stage.
+    """
+    return stage_profiler.profile(stage) if stage_profiler else nullcontext()
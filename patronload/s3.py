@@ -1,33 +1,244 @@
+import io
+import itertools
+import json
 import logging
+import threading
+from collections.abc import Collection
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter
+from types import TracebackType
+from typing import TYPE_CHECKING, Any
 
-from mypy_boto3_s3 import S3Client
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
 
 logger = logging.getLogger(__name__)
 
+# S3 requires every part of a multipart upload except the last to be at least 5 MiB
+S3_MINIMUM_PART_SIZE = 5 * 1024 * 1024
+# S3 accepts at most 1000 keys per DeleteObjects request
+S3_MAXIMUM_DELETE_KEYS = 1000
+MANIFEST_FILE_NAME = "patronload_manifest.json"
+
 
 def delete_zip_files_from_bucket_with_prefix(
-    s3_client: S3Client,
+    s3_client: "S3Client",
     s3_bucket_name: str,
     s3_prefix: str,
-) -> None:
+    *,
+    keep_keys: Collection[str] = (),
+) -> list[str]:
     """Delete zip file objects with the specified prefix from the specified bucket.
 
+    All pages of the listing are deleted, in batches of up to 1000 keys per
+    DeleteObjects request. Returns the keys of the deleted objects.
+
     Args:
         s3_client: A configured s3 client.
         s3_bucket_name: The bucket containing the objects to be deleted.
         s3_prefix: The prefix of the keys of the objects to be deleted.
+        keep_keys: Keys of zip files that are not deleted.
     """
-    s3_objects_with_prefix = s3_client.list_objects_v2(
-        Bucket=s3_bucket_name, Prefix=s3_prefix
+    start_time = perf_counter()
+    deleted_keys: list[str] = []
+    zip_file_keys = (
+        s3_object["Key"]
+        for page in s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=s3_bucket_name, Prefix=s3_prefix
+        )
+        for s3_object in page.get("Contents", [])
+        if s3_object["Key"].endswith(".zip") and s3_object["Key"] not in keep_keys
     )
-    if "Contents" in s3_objects_with_prefix:
-        for object_to_delete_key in [
-            s3_object["Key"]
-            for s3_object in s3_objects_with_prefix["Contents"]
-            if s3_object["Key"].endswith(".zip")
-        ]:
-            s3_client.delete_object(Bucket=s3_bucket_name, Key=object_to_delete_key)
+    for keys_to_delete in itertools.batched(zip_file_keys, S3_MAXIMUM_DELETE_KEYS):
+        response = s3_client.delete_objects(
+            Bucket=s3_bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys_to_delete], "Quiet": True},
+        )
+        if errors := response.get("Errors"):
+            message = (
+                f"{len(errors)} zip files could not be deleted from '{s3_bucket_name}', "
+                f"first error for '{errors[0].get('Key')}': {errors[0].get('Message')}"
+            )
+            raise RuntimeError(message)
+        for object_to_delete_key in keys_to_delete:
             logger.debug(
                 "'%s' deleted before processing new patron zip files",
                 object_to_delete_key,
             )
+        deleted_keys.extend(keys_to_delete)
+    logger.info(
+        "%s zip files deleted from S3 bucket '%s' in %.2f seconds",
+        len(deleted_keys),
+        s3_bucket_name,
+        perf_counter() - start_time,
+    )
+    return deleted_keys
+
+
+def read_manifest(s3_client: "S3Client", s3_bucket_name: str, s3_key: str) -> dict:
+    """Read the JSON manifest of the previous run, or an empty manifest if none exists.
+
+    Args:
+        s3_client: A configured s3 client.
+        s3_bucket_name: The bucket containing the manifest.
+        s3_key: The key of the manifest.
+    """
+    try:
+        manifest_object = s3_client.get_object(Bucket=s3_bucket_name, Key=s3_key)
+    except s3_client.exceptions.NoSuchKey:
+        logger.info("No manifest found at '%s'", s3_key)
+        return {}
+    return json.loads(manifest_object["Body"].read())
+
+
+def write_manifest(
+    s3_client: "S3Client", s3_bucket_name: str, s3_key: str, manifest: dict
+) -> None:
+    """Write the JSON manifest of the current run.
+
+    Args:
+        s3_client: A configured s3 client.
+        s3_bucket_name: The bucket to write the manifest to.
+        s3_key: The key of the manifest.
+        manifest: The manifest, an entry per patron type.
+    """
+    s3_client.put_object(
+        Body=json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+        Bucket=s3_bucket_name,
+        ContentType="application/json",
+        Key=s3_key,
+    )
+    logger.debug("Manifest written to '%s'", s3_key)
+
+
+class S3MultipartUploadWriter(io.RawIOBase):
+    """Writable file object that uploads to S3 with a multipart upload as it is written.
+
+    Bytes are buffered until a part is full, then uploaded on a thread pool while the
+    caller keeps writing. At most max_concurrency parts are in flight at once, which
+    bounds memory use to roughly (max_concurrency + 1) * part_size. The upload is
+    completed when the writer is closed and aborted if writing or uploading fails. A
+    writer that is garbage collected without being closed aborts the upload, so a
+    truncated object is never completed.
+
+    The writer can not seek, so a ZipFile writing to it streams its members with data
+    descriptors.
+    """
+
+    def __init__(
+        self,
+        s3_client: "S3Client",
+        s3_bucket_name: str,
+        s3_key: str,
+        part_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 4,
+    ) -> None:
+        super().__init__()
+        if part_size < S3_MINIMUM_PART_SIZE:
+            message = f"Part size must be at least {S3_MINIMUM_PART_SIZE} bytes"
+            raise ValueError(message)
+        self.s3_client = s3_client
+        self.s3_bucket_name = s3_bucket_name
+        self.s3_key = s3_key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self.buffer = bytearray()
+        self.parts: list[Future] = []
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=s3_bucket_name, Key=s3_key
+        )["UploadId"]
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.parts_in_flight = threading.BoundedSemaphore(max_concurrency)
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Complete the upload, or abort it if the block raised an exception."""
+        if exc_type is not None:
+            self.abort()
+        super().__exit__(exc_type, exc_value, traceback)
+
+    def __del__(self) -> None:
+        """Abort the upload if the writer was never closed, rather than complete it."""
+        # The upload is not created if the part size is invalid
+        if not self.closed and hasattr(self, "upload_id"):
+            self.abort()
+        super().__del__()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        if self.closed:
+            message = "I/O operation on closed S3 upload"
+            raise ValueError(message)
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def close(self) -> None:
+        """Upload the remaining bytes and complete the multipart upload."""
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.parts:
+                self._upload_part(bytes(self.buffer))
+                self.buffer.clear()
+            parts = [part.result() for part in self.parts]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket_name,
+                Key=self.s3_key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            logger.debug(
+                "'%s' uploaded in %s parts, %s bytes",
+                self.s3_key,
+                len(parts),
+                self.bytes_written,
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown()
+            super().close()
+
+    def abort(self) -> None:
+        """Abort the multipart upload so no incomplete parts are left in the bucket."""
+        if self.closed:
+            return
+        self.executor.shutdown(cancel_futures=True)
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.s3_bucket_name, Key=self.s3_key, UploadId=self.upload_id
+        )
+        logger.warning("Multipart upload of '%s' aborted", self.s3_key)
+        super().close()
+
+    def _upload_part(self, body: bytes) -> None:
+        for part in self.parts:
+            if part.done() and part.exception():
+                raise part.exception()  # type: ignore[misc]
+        self.parts_in_flight.acquire()
+        part = self.executor.submit(self._upload_part_body, len(self.parts) + 1, body)
+        part.add_done_callback(lambda _: self.parts_in_flight.release())
+        self.parts.append(part)
+
+    def _upload_part_body(self, part_number: int, body: bytes) -> dict[str, Any]:
+        response = self.s3_client.upload_part(
+            Body=body,
+            Bucket=self.s3_bucket_name,
+            Key=self.s3_key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
@@ -0,0 +1,256 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from patronload.data_source import DataSource, QueryResults
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+
+logger = logging.getLogger(__name__)
+
+# Snapshots older than this are not replayed, so that a retry does not load patron
+# records that are out of date
+SNAPSHOT_TTL = datetime.timedelta(hours=24)
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """Compressed columnar snapshots of query results, one per table.
+
+    Each snapshot is a gzipped JSON document holding a list of values per field, so
+    that any subset of the fields can be replayed. Datetime values are stored as ISO
+    8601 strings and restored on replay. The location is either a local directory or
+    an s3://bucket/prefix URI.
+    """
+
+    def __init__(
+        self,
+        location: str,
+        s3_client: "S3Client | None" = None,
+        *,
+        ttl: datetime.timedelta = SNAPSHOT_TTL,
+    ) -> None:
+        self.location = location.removesuffix("/")
+        self.s3_client = s3_client
+        self.ttl = ttl
+
+    def write(self, table: str, fields: list[str], columns: list[list]) -> None:
+        """Write the snapshot of a table, replacing any previous snapshot.
+
+        Args:
+            table: The table the query results are from.
+            fields: The fields of the query results.
+            columns: A list of the values of each field, in the order of fields.
+        """
+        datetime_fields = [
+            field
+            for field, column in zip(fields, columns, strict=True)
+            if any(isinstance(value, datetime.datetime) for value in column)
+        ]
+        snapshot = gzip.compress(
+            json.dumps(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "table": table,
+                    "created": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+                    "fields": fields,
+                    "datetime_fields": datetime_fields,
+                    "columns": [
+                        (
+                            [value and value.isoformat() for value in column]
+                            if field in datetime_fields
+                            else column
+                        )
+                        for field, column in zip(fields, columns, strict=True)
+                    ],
+                },
+                separators=(",", ":"),
+            ).encode("utf-8")
+        )
+        if s3_location := self._s3_location(table):
+            self.s3_client.put_object(  # type: ignore[union-attr]
+                Bucket=s3_location[0], Key=s3_location[1], Body=snapshot
+            )
+        else:
+            path = Path(self.location) / f"{table}.json.gz"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = path.with_suffix(".tmp")
+            temporary_path.write_bytes(snapshot)
+            os.replace(temporary_path, path)
+        logger.info(
+            "Snapshot of %s %s records written to '%s', %s bytes",
+            len(columns[0]) if columns else 0,
+            table,
+            self.location,
+            len(snapshot),
+        )
+
+    def read(self, table: str, fields: list[str]) -> list[list]:
+        """Read the columns of the fields from the snapshot of a table.
+
+        A RuntimeError is raised if there is no snapshot of the table, if it is older
+        than the TTL or if it does not have all the fields.
+
+        Args:
+            table: The table the query results are from.
+            fields: The fields to read, in the order they are returned.
+        """
+        if s3_location := self._s3_location(table):
+            try:
+                snapshot = self.s3_client.get_object(  # type: ignore[union-attr]
+                    Bucket=s3_location[0], Key=s3_location[1]
+                )["Body"].read()
+            except self.s3_client.exceptions.NoSuchKey as error:  # type: ignore[union-attr]
+                message = f"No snapshot of {table} found at '{self.location}'"
+                raise RuntimeError(message) from error
+        else:
+            path = Path(self.location) / f"{table}.json.gz"
+            if not path.exists():
+                message = f"No snapshot of {table} found at '{self.location}'"
+                raise RuntimeError(message)
+            snapshot = path.read_bytes()
+        contents = json.loads(gzip.decompress(snapshot))
+        created = datetime.datetime.fromisoformat(contents["created"])
+        if datetime.datetime.now(tz=datetime.UTC) - created > self.ttl:
+            message = (
+                f"Snapshot of {table} at '{self.location}' was created at {created} "
+                f"and has expired"
+            )
+            raise RuntimeError(message)
+        if missing_fields := set(fields) - set(contents["fields"]):
+            message = (
+                f"Snapshot of {table} at '{self.location}' does not have the fields: "
+                f"{', '.join(sorted(missing_fields))}"
+            )
+            raise RuntimeError(message)
+        columns = dict(zip(contents["fields"], contents["columns"], strict=True))
+        for field in contents["datetime_fields"]:
+            columns[field] = [
+                value and datetime.datetime.fromisoformat(value)
+                for value in columns[field]
+            ]
+        return [columns[field] for field in fields]
+
+    def _s3_location(self, table: str) -> tuple[str, str] | None:
+        if not self.location.startswith("s3://"):
+            return None
+        bucket, _, prefix = self.location.removeprefix("s3://").partition("/")
+        return bucket, f"{prefix}/{table}.json.gz".removeprefix("/")
+
+
+class SnapshotQueryResults:
+    """Iterable over the rows of a table replayed from its snapshot."""
+
+    def __init__(self, snapshot_store: SnapshotStore, fields: list[str], table: str):
+        self.snapshot_store = snapshot_store
+        self.fields = fields
+        self.table = table
+        self.row_count = 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Read the snapshot and yield its rows as tuples of the fields."""
+        self.row_count = 0
+        for row in zip(*self.snapshot_store.read(self.table, self.fields), strict=True):
+            self.row_count += 1
+            yield row
+
+
+class RecordedQueryResults:
+    """Iterable over query results that writes them to a snapshot once exhausted.
+
+    Nothing is written if the iteration fails or is not completed, so a snapshot
+    always holds every row of a table.
+    """
+
+    def __init__(
+        self,
+        snapshot_store: SnapshotStore,
+        fields: list[str],
+        table: str,
+        results: QueryResults,
+    ) -> None:
+        self.snapshot_store = snapshot_store
+        self.fields = fields
+        self.table = table
+        self.results = results
+
+    @property
+    def row_count(self) -> int:
+        return self.results.row_count
+
+    def __iter__(self) -> Iterator[tuple]:
+        """Yield the rows of the query results, recording their values."""
+        columns: list[list] = [[] for _ in self.fields]
+        for row in self.results:
+            for column, value in zip(columns, row, strict=True):
+                column.append(value)
+            yield row
+        self.snapshot_store.write(self.table, self.fields, columns)
+
+
+class SnapshotDataSource:
+    """Data source replaying query results from snapshots, or recording them.
+
+    When a data source is provided its query results are recorded to the snapshot
+    store, otherwise they are replayed from it and the data source is not needed.
+    """
+
+    def __init__(
+        self, snapshot_store: SnapshotStore, data_source: DataSource | None = None
+    ) -> None:
+        self.snapshot_store = snapshot_store
+        self.data_source = data_source
+
+    def describe(self) -> str:
+        if self.data_source:
+            return self.data_source.describe()
+        return f"snapshots in '{self.snapshot_store.location}'"
+
+    def query(
+        self,
+        fields: list[str],
+        table: str,
+        *,
+        partitions: int = 1,
+        predicates: list[str] | None = None,
+    ) -> SnapshotQueryResults | RecordedQueryResults:
+        """Replay the fields of a table from its snapshot, or query and record them.
+
+        Args:
+            fields: The list of fields to retrieve.
+            table: The table to retrieve the fields from.
+            partitions: Number of hash partitions the table is fetched in, only used
+            when recording.
+            predicates: SQL conditions that every row must meet, only used when
+            recording. Replayed rows were already filtered when they were recorded.
+        """
+        if not self.data_source:
+            return SnapshotQueryResults(self.snapshot_store, fields, table)
+        return RecordedQueryResults(
+            self.snapshot_store,
+            fields,
+            table,
+            self.data_source.query(
+                fields, table, partitions=partitions, predicates=predicates
+            ),
+        )
+
+    def excluded_row_counts(
+        self, table: str, predicates: dict[str, str]
+    ) -> dict[str, int]:
+        """Count the rows excluded by the predicates when recording, none on replay.
+
+        Args:
+            table: The table that was queried.
+            predicates: The predicates of the query, keyed by a description of the
+            rows they exclude.
+        """
+        if not self.data_source:
+            return {}
+        return self.data_source.excluded_row_counts(table, predicates)
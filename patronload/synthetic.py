@@ -0,0 +1,241 @@
+import random
+from collections.abc import Iterator
+from typing import Any
+
+from patronload.config import STAFF_FIELDS, STUDENT_FIELDS, load_departments
+
+FIRST_NAMES = [
+    "Alex",
+    "Ana",
+    "Chen",
+    "Dana",
+    "Emeka",
+    "Fatima",
+    "Grace",
+    "Hiro",
+    "Isabel",
+    "Jamal",
+    "Kai",
+    "Leila",
+    "Mateo",
+    "Nia",
+    "Olga",
+    "Priya",
+    "Quinn",
+    "Rosa",
+    "Sven",
+    "Tomás",
+]
+LAST_NAMES = [
+    "Anderson",
+    "Brown",
+    "Castillo",
+    "Dubois",
+    "Eriksson",
+    "Fernández",
+    "García",
+    "Hoang",
+    "Ibrahim",
+    "Johnson",
+    "Kowalski",
+    "Lee",
+    "Martin",
+    "Nakamura",
+    "O'Brien",
+    "Patel",
+    "Rossi",
+    "Smith",
+    "Tanaka",
+    "Williams",
+]
+STREETS = [
+    "Massachusetts Ave",
+    "Vassar St",
+    "Memorial Dr",
+    "Amherst St",
+    "Main St",
+    "Ames St",
+    "Albany St",
+    "Beacon St",
+]
+CITIES = [
+    ("Cambridge", "MA", "02139"),
+    ("Cambridge", "MA", "02142"),
+    ("Boston", "MA", "02115"),
+    ("Somerville", "MA", "02143"),
+    ("Lexington", "MA", "02421"),
+    ("Providence", "RI", "02903"),
+]
+STAFF_PERSON_TYPES = [
+    ("21", "Staff"),
+    ("22", "Faculty"),
+    ("23", "Other Academic"),
+    ("27", "Staff - Lincoln Labs"),
+]
+STUDENT_YEARS = ["1", "2", "3", "4", "U", "G", "G", "G"]
+KRB_NAME_PREFIXES = {"staff": "E", "student": "S"}
+UNKNOWN_STAFF_DEPARTMENT = "99999999"
+UNKNOWN_STUDENT_DEPARTMENT = "XYZ"
+
+
+class SyntheticPatrons:
+    """Seeded generator of realistic staff and student Data Warehouse rows.
+
+    Rows are tuples in the order of STAFF_FIELDS or STUDENT_FIELDS, with the value
+    formats of the Data Warehouse. The same seed and arguments always produce the same
+    rows. The shares are the probability of each kind of irregular row:
+
+    - null_share: each optional value is None.
+    - missing_krb_name_share: the KRB name is None, so the row is rejected.
+    - duplicate_share: the KRB name of an earlier row of the same patron type is
+    reused, so the row is skipped as a duplicate.
+    - unknown_department_share: the department is not in the department mapping.
+    - student_employee_share: a student row has the KRB name and MIT ID of a staff
+    row, so the student is only loaded as staff.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        *,
+        null_share: float = 0.05,
+        missing_krb_name_share: float = 0.005,
+        duplicate_share: float = 0.01,
+        unknown_department_share: float = 0.02,
+        student_employee_share: float = 0.03,
+    ) -> None:
+        self.seed = seed
+        self.null_share = null_share
+        self.missing_krb_name_share = missing_krb_name_share
+        self.duplicate_share = duplicate_share
+        self.unknown_department_share = unknown_department_share
+        self.student_employee_share = student_employee_share
+
+    def staff_records(self, count: int) -> Iterator[tuple]:
+        """Yield staff rows in the order of STAFF_FIELDS.
+
+        Args:
+            count: The number of rows.
+        """
+        # Synthetic rows only need to be reproducible, not unpredictable
+        rng = random.Random(f"{self.seed}-staff")  # noqa: S311
+        staff_departments = sorted(load_departments("staff"))
+        for index in range(count):
+            first_name, last_name = self._names(rng, index)
+            person_type_code, person_type = rng.choice(STAFF_PERSON_TYPES)
+            org_unit_id = (
+                UNKNOWN_STAFF_DEPARTMENT
+                if rng.random() < self.unknown_department_share
+                else rng.choice(staff_departments)
+            )
+            patron = {
+                "MIT_ID": staff_mit_id(index),
+                "KRB_NAME_UPPERCASE": self._krb_name(rng, "staff", index),
+                "PREFERRED_FIRST_NAME": first_name,
+                "PREFERRED_MIDDLE_NAME": None,
+                "PREFERRED_LAST_NAME": last_name,
+                "LEGAL_FIRST_NAME": first_name,
+                "LEGAL_MIDDLE_NAME": rng.choice(FIRST_NAMES),
+                "LEGAL_LAST_NAME": last_name,
+                "OFFICE_ADDRESS": f"{rng.randint(1, 68)}-{rng.randint(100, 599)}",
+                "OFFICE_PHONE": f"617{rng.randint(0, 9999999):07}",
+                "LIBRARY_PERSON_TYPE_CODE": person_type_code,
+                "LIBRARY_PERSON_TYPE": person_type,
+                "ORG_UNIT_ID": org_unit_id,
+                "ORG_UNIT_TITLE": f"Department {org_unit_id}",
+            }
+            yield self._record(rng, patron, STAFF_FIELDS)
+
+    def student_records(self, count: int, staff_count: int = 0) -> Iterator[tuple]:
+        """Yield student rows in the order of STUDENT_FIELDS.
+
+        Args:
+            count: The number of rows.
+            staff_count: The number of staff rows generated with the same seed, which
+            student employees are picked from.
+        """
+        rng = random.Random(f"{self.seed}-student")  # noqa: S311
+        student_departments = sorted(load_departments("student"))
+        for index in range(count):
+            first_name, last_name = self._names(rng, index)
+            city, state, postal_code = rng.choice(CITIES)
+            home_department = (
+                UNKNOWN_STUDENT_DEPARTMENT
+                if rng.random() < self.unknown_department_share
+                else rng.choice(student_departments)
+            )
+            patron = {
+                "MIT_ID": student_mit_id(index),
+                "KRB_NAME_UPPERCASE": self._krb_name(rng, "student", index),
+                "PREFERRED_FIRST_NAME": first_name[:3],
+                "PREFERRED_MIDDLE_NAME": None,
+                "PREFERRED_LAST_NAME": None,
+                "LEGAL_FIRST_NAME": first_name,
+                "LEGAL_MIDDLE_NAME": rng.choice(FIRST_NAMES),
+                "LEGAL_LAST_NAME": last_name,
+                "TERM_STREET1": f"{rng.randint(1, 999)} {rng.choice(STREETS)}",
+                "TERM_STREET2": f"Apt {rng.randint(1, 40)}",
+                "TERM_CITY": city,
+                "TERM_STATE": state,
+                "TERM_ZIP": postal_code,
+                "TERM_PHONE1": f"617{rng.randint(0, 9999999):07}",
+                "TERM_PHONE2": f"857{rng.randint(0, 9999999):07}",
+                "OFFICE_PHONE": None,
+                "STUDENT_YEAR": rng.choice(STUDENT_YEARS),
+                "HOME_DEPARTMENT": home_department,
+            }
+            if staff_count and rng.random() < self.student_employee_share:
+                staff_index = rng.randrange(staff_count)
+                patron["MIT_ID"] = staff_mit_id(staff_index)
+                patron["KRB_NAME_UPPERCASE"] = krb_name("staff", staff_index)
+                patron["OFFICE_PHONE"] = f"617{rng.randint(0, 9999999):07}"
+            yield self._record(rng, patron, STUDENT_FIELDS)
+
+    def _names(self, rng: random.Random, index: int) -> tuple[str, str]:
+        return FIRST_NAMES[index % len(FIRST_NAMES)], rng.choice(LAST_NAMES)
+
+    def _krb_name(self, rng: random.Random, patron_type: str, index: int) -> str | None:
+        if rng.random() < self.missing_krb_name_share:
+            return None
+        if index and rng.random() < self.duplicate_share:
+            return krb_name(patron_type, rng.randrange(index))
+        return krb_name(patron_type, index)
+
+    def _record(
+        self, rng: random.Random, patron: dict[str, Any], fields: list[str]
+    ) -> tuple:
+        patron["EMAIL_ADDRESS"] = (
+            f"{patron['KRB_NAME_UPPERCASE']}@MIT.EDU"
+            if patron["KRB_NAME_UPPERCASE"]
+            else None
+        )
+        patron["LIBRARY_ID"] = f"39080{patron['MIT_ID']}"
+        return tuple(
+            (
+                patron[field]
+                if field in {"MIT_ID", "KRB_NAME_UPPERCASE"}
+                or rng.random() >= self.null_share
+                else None
+            )
+            for field in fields
+        )
+
+
+def krb_name(patron_type: str, index: int) -> str:
+    """Return the KRB name of the synthetic patron at an index.
+
+    Args:
+        patron_type: The type of patron record, staff or student.
+        index: The index of the patron row.
+    """
+    last_name = LAST_NAMES[index % len(LAST_NAMES)].upper()
+    letters = "".join(letter for letter in last_name if "A" <= letter <= "Z")
+    return f"{KRB_NAME_PREFIXES[patron_type]}{letters[:4]}{index}"
+
+
+def staff_mit_id(index: int) -> str:
+    return f"{900000000 + index}"
+
+
+def student_mit_id(index: int) -> str:
+    return f"{800000000 + index}"
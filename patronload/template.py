@@ -0,0 +1,219 @@
+import hashlib
+import json
+import re
+from collections.abc import Mapping
+from functools import cache
+from typing import TYPE_CHECKING, NamedTuple
+
+from patronload.config import load_departments, template_path
+
+if TYPE_CHECKING:
+    from bs4 import Tag
+
+# Sentinels written into the BeautifulSoup tree when compiling a template. NUL can
+# not appear in the template files, so the sentinels can be located unambiguously in
+# the serialized markup.
+SENTINEL_PATTERN = re.compile(r'"\x00@(\w+)\x00"|\x00([#/]?)(\w+)\x00')
+
+
+class Slot(NamedTuple):
+    name: str
+    attribute: bool = False
+
+
+class Block(NamedTuple):
+    name: str
+    parts: tuple["str | Slot | Block", ...]
+    guards: tuple[str, ...]
+
+
+class CompiledTemplate:
+    """A patron XML template compiled into static segments, slots and optional blocks.
+
+    A block is only rendered when none of the slots inside it have a value of None,
+    which mirrors the elements that are cleared or removed from the BeautifulSoup
+    template when a patron has no value for them.
+    """
+
+    def __init__(self, parts: tuple[str | Slot | Block, ...]) -> None:
+        self.parts = parts
+
+    def render(self, values: Mapping[str, str | None]) -> bytes:
+        """Render the template with the slot values and return UTF-8 encoded XML.
+
+        Args:
+            values: A mapping of slot names to values, None omits the enclosing block.
+        """
+        output: list[str] = []
+        self._render_parts(self.parts, values, output)
+        return "".join(output).encode("utf-8")
+
+    def _render_parts(
+        self,
+        parts: tuple[str | Slot | Block, ...],
+        values: Mapping[str, str | None],
+        output: list[str],
+    ) -> None:
+        for part in parts:
+            if isinstance(part, str):
+                output.append(part)
+            elif isinstance(part, Slot):
+                value = values[part.name] or ""
+                output.append(
+                    escape_attribute(value) if part.attribute else escape_text(value)
+                )
+            elif all(values[guard] is not None for guard in part.guards):
+                self._render_parts(part.parts, values, output)
+
+
+def escape_text(value: str) -> str:
+    """Escape a text value the same way as the BeautifulSoup 'minimal' formatter.
+
+    Args:
+        value: The text value to escape.
+    """
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_attribute(value: str) -> str:
+    """Escape and quote an attribute value the same way as BeautifulSoup.
+
+    Args:
+        value: The attribute value to escape.
+    """
+    value = escape_text(value)
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+def slot(tag: "Tag", name: str) -> None:
+    tag.string = f"\x00{name}\x00"
+
+
+def attribute_slot(tag: "Tag", attribute: str, name: str) -> None:
+    tag[attribute] = f"\x00@{name}\x00"
+
+
+def block_around(tag: "Tag", name: str) -> None:
+    from bs4 import NavigableString  # noqa: PLC0415
+
+    tag.insert_before(NavigableString(f"\x00#{name}\x00"))
+    tag.insert_after(NavigableString(f"\x00/{name}\x00"))
+
+
+def block_within(tag: "Tag", name: str) -> None:
+    from bs4 import NavigableString  # noqa: PLC0415
+
+    tag.insert(0, NavigableString(f"\x00#{name}\x00"))
+    tag.append(NavigableString(f"\x00/{name}\x00"))
+
+
+def compile_markup(markup: str) -> CompiledTemplate:
+    """Compile serialized template markup containing sentinels.
+
+    Args:
+        markup: The decoded contents of a template with slot and block sentinels.
+    """
+    stack: list[tuple[str, list]] = [("", [])]
+    position = 0
+    for match in SENTINEL_PATTERN.finditer(markup):
+        if match.start() > position:
+            stack[-1][1].append(markup[position : match.start()])
+        position = match.end()
+        attribute_name, marker, name = match.groups()
+        if attribute_name:
+            stack[-1][1].append(Slot(attribute_name, attribute=True))
+        elif marker == "#":
+            stack.append((name, []))
+        elif marker == "/":
+            block_name, block_parts = stack.pop()
+            if block_name != name:
+                message = f"Unbalanced template block '{name}'"
+                raise ValueError(message)
+            guards = tuple(part.name for part in block_parts if isinstance(part, Slot))
+            stack[-1][1].append(Block(name, tuple(block_parts), guards))
+        else:
+            stack[-1][1].append(Slot(name))
+    if len(stack) != 1:
+        message = f"Unclosed template block '{stack[-1][0]}'"
+        raise ValueError(message)
+    if position < len(markup):
+        stack[-1][1].append(markup[position:])
+    return CompiledTemplate(tuple(stack[0][1]))
+
+
+@cache
+def compile_patron_template(patron_type: str) -> CompiledTemplate:
+    """Parse a patron XML template once and compile it for fast rendering.
+
+    The template is serialized by BeautifulSoup with sentinels in place of the
+    patron values, so the static segments are identical to the output of the
+    BeautifulSoup rendering path.
+
+    Args:
+        patron_type: The type of patron template to compile, staff or student.
+    """
+    from bs4 import BeautifulSoup  # noqa: PLC0415
+
+    with open(template_path(patron_type), encoding="utf8") as xml_template:
+        template = BeautifulSoup(xml_template, "html.parser")
+
+    for part in ["first", "middle", "last"]:
+        slot(getattr(template, f"{part}_name"), f"{part}_name")
+        slot(getattr(template, f"pref_{part}_name"), f"pref_{part}_name")
+    slot(template.primary_id, "primary_id")  # type: ignore[arg-type]
+    slot(template.expiry_date, "expiry_date")  # type: ignore[arg-type]
+    slot(template.purge_date, "purge_date")  # type: ignore[arg-type]
+    slot(template.user_group, "user_group")  # type: ignore[arg-type]
+    slot(template.statistic_category, "statistic_category")  # type: ignore[arg-type]
+    slot(template.address.line1, "line1")  # type: ignore[arg-type,union-attr]
+    slot(template.email_address, "email_address")  # type: ignore[arg-type]
+    block_within(template.emails, "emails")  # type: ignore[arg-type]
+
+    for user_identifier in template.find_all("user_identifier"):
+        if user_identifier.find("id_type", desc="MIT ID"):
+            slot(user_identifier.value, "mit_id")
+        elif user_identifier.find("id_type", desc="Barcode"):
+            slot(user_identifier.value, "barcode")
+            block_around(user_identifier, "barcode")
+
+    if patron_type == "staff":
+        attribute_slot(template.user_group, "desc", "user_group_desc")  # type: ignore[arg-type]
+        attribute_slot(
+            template.statistic_category,  # type: ignore[arg-type]
+            "desc",
+            "statistic_category_desc",
+        )
+        slot(template.phone_number, "phone_number")  # type: ignore[arg-type]
+        block_within(template.phones, "phones")  # type: ignore[arg-type]
+    elif patron_type == "student":
+        for field in ["line3", "city", "state_province", "postal_code"]:
+            slot(getattr(template.address, field), field)
+        for name, phone in zip(
+            ["preferred_phone_number", "other_phone_number"],
+            template.find_all("phone"),
+            strict=True,
+        ):
+            slot(phone.phone_number, name)
+            block_around(phone, name)
+
+    return compile_markup(template.decode_contents())
+
+
+@cache
+def rendering_configuration_digest(patron_type: str) -> bytes:
+    """Return a digest of the template and department mapping of a patron type.
+
+    Args:
+        patron_type: The type of patron record being processed, staff or student.
+    """
+    configuration_digest = hashlib.sha256()
+    with open(template_path(patron_type), "rb") as xml_template:
+        configuration_digest.update(xml_template.read())
+    configuration_digest.update(
+        json.dumps(load_departments(patron_type), sort_keys=True).encode("utf-8")
+    )
+    return configuration_digest.digest()
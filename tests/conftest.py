@@ -1,4 +1,5 @@
-import datetime
+import sys
+from unittest.mock import MagicMock, patch
 
 import boto3
 import pytest
@@ -61,6 +62,14 @@ def mocked_s3():
         yield s3_instance
 
 
+@pytest.fixture
+def mocked_oracledb():
+    """Mock the oracledb module, which is imported when a connection is created."""
+    mocked_oracledb = MagicMock()
+    with patch.dict(sys.modules, {"oracledb": mocked_oracledb}):
+        yield mocked_oracledb
+
+
 @pytest.fixture
 def s3_client():
     return boto3.client("s3", region_name="us-east-1")
@@ -89,13 +98,10 @@ def staff_database_record_with_all_values():
         "Drew",
         "AA-B1-11",
         "5555555555",
-        datetime.datetime(2023, 6, 30, 0, 0, tzinfo=datetime.UTC),
         "27",
         "Staff - Lincoln Labs",
         "10000948",
         "LL-Homeland Protection & Air Traffic Con",
-        "Part-time Flexible/LL",
-        "Part-time Flexible/LL",
     )
 
 
@@ -118,9 +124,6 @@ def staff_database_record_krb_and_null_values():
         None,
         None,
         None,
-        None,
-        None,
-        None,
     )
 
 
@@ -143,9 +146,6 @@ def staff_database_record_with_null_values():
         None,
         None,
         None,
-        None,
-        None,
-        None,
     )
 
 
@@ -162,14 +162,11 @@ def staff_patron_all_values_dict():
         "OFFICE_PHONE": "5555555555",
         "MIT_ID": "222222222",
         "EMAIL_ADDRESS": "STAFF_KRB_NAME@MIT.EDU",
-        "APPOINTMENT_END_DATE": datetime.datetime(2023, 6, 30, 0, 0, tzinfo=datetime.UTC),
         "KRB_NAME_UPPERCASE": "STAFF_KRB_NAME",
         "LIBRARY_PERSON_TYPE_CODE": "27",
         "LIBRARY_PERSON_TYPE": "Staff - Lincoln Labs",
         "ORG_UNIT_ID": "10000948",
         "ORG_UNIT_TITLE": "LL-Homeland Protection & Air Traffic Con",
-        "POSITION_TITLE": "Part-time Flexible/LL",
-        "DIRECTORY_TITLE": "Part-time Flexible/LL",
         "LIBRARY_ID": "22222222222222",
     }
 
@@ -305,3 +302,27 @@ def student_patrons_xml():
 @pytest.fixture
 def runner():
     return CliRunner()
+
+
+@pytest.fixture
+def mock_query_results():
+    """Route queries on a mocked oracledb module to results chosen by the query."""
+
+    def _mock_query_results(mocked_oracledb, query_results):
+        def cursor():
+            mocked_cursor = MagicMock()
+            mocked_cursor.fetchone.return_value = (0,)
+            mocked_cursor.execute.side_effect = (
+                lambda query, *_args, **_kwargs: mocked_cursor.fetchmany.configure_mock(
+                    side_effect=[query_results(query), []]
+                )
+            )
+            return mocked_cursor
+
+        connection = mocked_oracledb.connect.return_value
+        connection.cursor.side_effect = cursor
+        connection.__enter__.return_value = connection
+        mocked_oracledb.create_pool.return_value.acquire.return_value = connection
+        return connection
+
+    return _mock_query_results
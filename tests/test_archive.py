@@ -0,0 +1,50 @@
+import time
+from io import BytesIO
+from unittest.mock import MagicMock
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import pytest
+
+from patronload.archive import (
+    CompressedMember,
+    DeflateSpool,
+    write_compressed_members_to_zip_file,
+)
+
+
+def test_write_compressed_members_to_zip_file_success():
+    members = []
+    for index in range(3):
+        spool = DeflateSpool(f"test_{index}.xml")
+        for _ in range(1000):
+            spool.write(f"<xml>{index}</xml>".encode())
+        members.append(spool.finish())
+    zip_file_object = BytesIO()
+    zip_size = write_compressed_members_to_zip_file(
+        zip_file_object, members, time.localtime(1677672000)
+    )
+    assert zip_size == len(zip_file_object.getvalue())
+    with ZipFile(zip_file_object, "r") as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == ["test_0.xml", "test_1.xml", "test_2.xml"]
+        assert zip_file.getinfo("test_1.xml").compress_type == ZIP_DEFLATED
+        assert zip_file.getinfo("test_1.xml").create_system == 3  # noqa: PLR2004
+        assert zip_file.getinfo("test_1.xml").date_time == time.localtime(1677672000)[:6]
+        assert zip_file.read("test_2.xml") == b"<xml>2</xml>" * 1000
+
+
+def test_write_compressed_members_to_zip_file_member_too_large_raises_error():
+    member = CompressedMember("test.xml", MagicMock(), 0, 1024, 0xFFFFFFFF)
+    with pytest.raises(ValueError, match=r"'test\.xml' exceeds the 4 GiB zip size limit"):
+        write_compressed_members_to_zip_file(BytesIO(), [member])
+
+
+def test_write_compressed_members_to_zip_file_too_large_raises_error():
+    members = [
+        CompressedMember(f"test_{index}.xml", MagicMock(), 0, 0x80000000, 0x80000000)
+        for index in range(2)
+    ]
+    zip_file_object = BytesIO()
+    with pytest.raises(ValueError, match="Zip file exceeds the 4 GiB zip size limit"):
+        write_compressed_members_to_zip_file(zip_file_object, members)
+    assert zip_file_object.getvalue() == b""
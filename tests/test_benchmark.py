@@ -0,0 +1,114 @@
+import json
+
+from patronload.benchmark import BENCHMARKS, benchmark, compare_results, run_benchmark
+from patronload.synthetic import SyntheticPatrons
+
+
+def benchmark_results(seconds, peak_memory):
+    return {
+        "results": [
+            {
+                "benchmark": "format_phone_number",
+                "records": 1000,
+                "seconds": seconds,
+                "records_per_second": 1000 / seconds,
+                "peak_memory": peak_memory,
+            }
+        ]
+    }
+
+
+def test_run_benchmark_records_time_and_peak_memory():
+    for name in BENCHMARKS:
+        result = run_benchmark(name, SyntheticPatrons(), 10, repeat=1)
+        assert result["benchmark"] == name
+        assert result["records"] == 10  # noqa: PLR2004
+        assert result["seconds"] > 0
+        assert result["peak_memory"] > 0
+
+
+def test_compare_results_flags_regressions():
+    lines, regressions = compare_results(
+        benchmark_results(1.0, 1000), benchmark_results(1.05, 1200), threshold=0.1
+    )
+    assert lines == regressions
+    assert lines == [
+        (
+            "REGRESSION format_phone_number x 1000: 1.0000s -> 1.0500s (+5.0%), "
+            "peak memory 1000 -> 1200 bytes (+20.0%)"
+        )
+    ]
+
+
+def test_compare_results_without_regressions():
+    lines, regressions = compare_results(
+        benchmark_results(1.0, 1000), benchmark_results(0.5, 1000), threshold=0.1
+    )
+    assert len(lines) == 1
+    assert not regressions
+
+
+def test_benchmark_run_and_compare(runner, tmp_path):
+    results_path = tmp_path / "results.json"
+    result = runner.invoke(
+        benchmark,
+        [
+            "run",
+            "--output",
+            str(results_path),
+            "--size",
+            "10",
+            "--size",
+            "20",
+            "--benchmark",
+            "format_phone_number",
+            "--repeat",
+            "1",
+        ],
+    )
+    assert result.exit_code == 0
+    results = json.loads(results_path.read_text())
+    assert [
+        (benchmark_result["benchmark"], benchmark_result["records"])
+        for benchmark_result in results["results"]
+    ] == [("format_phone_number", 10), ("format_phone_number", 20)]
+    result = runner.invoke(benchmark, ["compare", str(results_path), str(results_path)])
+    assert result.exit_code == 0
+    assert "format_phone_number x 20" in result.output
+
+
+def test_benchmark_compare_fails_on_regression(runner, tmp_path):
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(benchmark_results(1.0, 1000)))
+    results_path = tmp_path / "results.json"
+    results_path.write_text(json.dumps(benchmark_results(2.0, 1000)))
+    result = runner.invoke(benchmark, ["compare", str(baseline_path), str(results_path)])
+    assert result.exit_code == 1
+    assert "1 benchmarks regressed by more than 10%" in result.output
+
+
+def test_benchmark_run_skips_soup_benchmarks_above_max_records(runner, tmp_path):
+    results_path = tmp_path / "results.json"
+    result = runner.invoke(
+        benchmark,
+        [
+            "run",
+            "--output",
+            str(results_path),
+            "--size",
+            "5",
+            "--size",
+            "20",
+            "--benchmark",
+            "populate_staff_fields",
+            "--repeat",
+            "1",
+            "--soup_max_records",
+            "10",
+        ],
+    )
+    assert result.exit_code == 0
+    assert [
+        benchmark_result["records"]
+        for benchmark_result in json.loads(results_path.read_text())["results"]
+    ] == [5]
@@ -1,13 +1,22 @@
+import csv
+import json
+import sqlite3
+import threading
 from io import BytesIO
 from unittest.mock import patch
 from zipfile import ZipFile
 
 from freezegun import freeze_time
 
-from patronload.cli import main
+from patronload.cli import main, raise_if_load_failed
+from patronload.config import STAFF_FIELDS, STUDENT_FIELDS
+from patronload.patron import create_render_pool
+
+STAFF_KRB_NAME_QUERY = (
+    "SELECT KRB_NAME_UPPERCASE FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE IS NOT NULL"
+)
 
 
-@patch("patronload.database.oracledb")
 def test_cli_log_configured_from_env(
     mocked_oracledb,
     caplog,
@@ -21,8 +30,7 @@ def test_cli_log_configured_from_env(
     assert "Logger 'root' configured with level=DEBUG" in caplog.text
 
 
-@patch("patronload.database.oracledb")
-@patch("patronload.cli.client")
+@patch("boto3.client")
 def test_cli_database_connection_success(
     mocked_cli_client,
     mocked_oracledb,
@@ -38,8 +46,16 @@ def test_cli_database_connection_success(
     mocked_cli_client.assert_not_called()
 
 
+def test_cli_database_connection_thin_mode(caplog, mocked_oracledb, runner):
+    mocked_oracledb.connect.return_value.version = 23.4
+    result = runner.invoke(main, ["-t", "--oracle_driver_mode", "thin"])
+    assert result.exit_code == 0
+    mocked_oracledb.init_oracle_client.assert_not_called()
+    assert "Oracle connection set up in thin mode" in caplog.text
+    assert "Successfully connected to Oracle Database version: 23.4" in caplog.text
+
+
 @freeze_time("2023-03-01 12:00:00")
-@patch("patronload.database.oracledb")
 def test_cli_success(
     mocked_oracledb,  # pylint: disable=W0613
     caplog,
@@ -62,48 +78,146 @@ def test_cli_success(
     s3_bucket_path_contents = mocked_s3.list_objects_v2(
         Bucket="test-bucket", Prefix="patronload"
     )["Contents"]
-    assert s3_bucket_path_contents[0]["Key"] == "patronload/staff_2023-03-01_12.00.00.zip"
+    assert [s3_object["Key"] for s3_object in s3_bucket_path_contents] == [
+        "patronload/staff_2023-03-01_12.00.00.zip",
+        "patronload/student_2023-03-01_12.00.00.zip",
+    ]
+    assert "Total time to complete process" in caplog.text
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_profiles_stages(
+    mocked_oracledb,
+    mocked_s3,
+    runner,
+    tmp_path,
+):
+    result = runner.invoke(
+        main,
+        [
+            "--profile_directory",
+            str(tmp_path),
+            "--profile_top_allocations",
+            "5",
+            "--profile_s3_prefix",
+            "diagnostics",
+        ],
+    )
+    assert result.exit_code == 0
+    profile_files = {
+        f"{stage}.{suffix}"
+        for stage in ["connect", "s3_cleanup", "reserve", "staff", "student", "email"]
+        for suffix in ["pstats", "allocations.txt"]
+    }
+    assert {path.name for path in (tmp_path / "2023-03-01_12.00.00").iterdir()} == (
+        profile_files
+    )
+    assert {
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(
+            Bucket="test-bucket", Prefix="diagnostics"
+        )["Contents"]
+    } == {f"diagnostics/2023-03-01_12.00.00/{name}" for name in profile_files}
+
+
+def test_cli_profile_s3_prefix_requires_profile_directory(runner):
+    result = runner.invoke(main, ["--profile_s3_prefix", "diagnostics"])
+    assert result.exit_code == 2  # noqa: PLR2004
+    assert "--profile_s3_prefix requires --profile_directory" in result.output
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_writes_run_metrics(
+    mocked_oracledb,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return [student_database_record_with_all_values]
+
+    mock_query_results(mocked_oracledb, query_results)
+    result = runner.invoke(main, ["--emf_namespace", "patronload"])
+    assert result.exit_code == 0
+    run_record, *emf_records = (json.loads(line) for line in result.stdout.splitlines())
+    assert run_record["workspace"] == "test"
+    stages = {
+        (stage["stage"], stage["patron_type"]): stage for stage in run_record["stages"]
+    }
+    assert set(stages) == {
+        ("connect", "all"),
+        ("email", "all"),
+        ("reserve", "staff"),
+        ("s3_cleanup", "all"),
+        *(
+            (stage, patron_type)
+            for stage in ["query", "render", "zip", "upload"]
+            for patron_type in ["staff", "student"]
+        ),
+    }
+    assert stages["query", "staff"]["records"] == 1
+    assert stages["render", "staff"]["records"] == 1
     assert (
-        s3_bucket_path_contents[1]["Key"] == "patronload/student_2023-03-01_12.00.00.zip"
+        stages["render", "staff"]["bytes_out"] == stages["zip", "staff"]["bytes_in"] > 0
     )
-    assert "Total time to complete process" in caplog.text
+    assert (
+        stages["zip", "staff"]["bytes_out"]
+        == stages["upload", "staff"]["bytes_in"]
+        == stages["upload", "staff"]["bytes_out"]
+        > 0
+    )
+    assert stages["email", "all"]["bytes_out"] > 0
+    assert len(emf_records) == len(stages)
+    assert {
+        emf_record["_aws"]["CloudWatchMetrics"][0]["Namespace"]
+        for emf_record in emf_records
+    } == {"patronload"}
 
 
 @freeze_time("2023-03-01 12:00:00")
-@patch("patronload.database.oracledb")
 def test_cli_duplicate_krb_name_remains_staff_patron(
     mocked_oracledb,
+    caplog,
+    mock_query_results,
     mocked_s3,  # pylint: disable=W0613
     runner,
     s3_client,
     staff_database_record_with_all_values,
 ):
-    mocked_oracledb.connect.return_value.cursor.return_value.fetchall.side_effect = [
-        [
-            staff_database_record_with_all_values,
-        ],
-        [
-            (
-                "111111111",
-                None,
-                "STAFF_KRB_NAME",
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-            ),
-        ],
-    ]
+    student_record_with_staff_krb_name = (
+        "111111111",
+        None,
+        "STAFF_KRB_NAME",
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+    )
+
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return [student_record_with_staff_krb_name]
+
+    mock_query_results(mocked_oracledb, query_results)
     runner.invoke(main)
     staff_zip_file = s3_client.get_object(
         Bucket="test-bucket",
@@ -122,3 +236,523 @@ def test_cli_duplicate_krb_name_remains_staff_patron(
         assert "STAFF_KRB_NAME" not in zip_file.read(
             "student_2023-03-01_12.00.00.xml"
         ).decode("utf-8")
+    assert "1 staff patron records created, 0 duplicate records skipped" in caplog.text
+    assert "0 student patron records created, 1 duplicate records skipped" in caplog.text
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_sequential_extraction_duplicate_krb_name_remains_staff_patron(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,  # pylint: disable=W0613
+    runner,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    student_record_with_staff_krb_name = (
+        *student_database_record_with_all_values[:2],
+        staff_database_record_with_all_values[2],
+        *student_database_record_with_all_values[3:],
+    )
+    connection = mock_query_results(
+        mocked_oracledb,
+        lambda query: (
+            [staff_database_record_with_all_values]
+            if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query
+            else [student_record_with_staff_krb_name]
+        ),
+    )
+    result = runner.invoke(main, ["--sequential_extraction", "--sequential_s3_cleanup"])
+    assert result.exit_code == 0
+    # A patron query and a cursor for its COUNT queries per patron type
+    assert connection.cursor.call_count == 4  # noqa: PLR2004
+    assert "staff KRB names reserved" not in caplog.text
+    assert "1 zip files deleted from S3 bucket 'test-bucket'" in caplog.text
+    assert "1 staff patron records created, 0 duplicate records skipped" in caplog.text
+    assert "0 student patron records created, 1 duplicate records skipped" in caplog.text
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_partitioned_extraction_success(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,  # pylint: disable=W0613
+    runner,
+    staff_database_record_with_all_values,
+):
+    mock_query_results(
+        mocked_oracledb,
+        lambda query: (
+            [staff_database_record_with_all_values]
+            if query.endswith("AND ORA_HASH(MIT_ID, 1) = 1 ORDER BY MIT_ID")
+            and "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query
+            else []
+        ),
+    )
+    result = runner.invoke(main, ["--partitions", "2"])
+    assert result.exit_code == 0
+    assert mocked_oracledb.PoolParams.call_args.kwargs["max"] == 4  # noqa: PLR2004
+    assert "1 staff patron records retrieved from Data Warehouse" in caplog.text
+    assert "1 staff patron records created, 0 duplicate records skipped" in caplog.text
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_xml_shards_success(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    staff_database_record_with_all_values,
+):
+    mock_query_results(
+        mocked_oracledb,
+        lambda query: (
+            [staff_database_record_with_all_values]
+            if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query
+            else []
+        ),
+    )
+    result = runner.invoke(main, ["--xml_shards", "2", "--sequential_extraction"])
+    assert result.exit_code == 0
+    assert "1 staff patron records created, 0 duplicate records skipped" in caplog.text
+    zip_file_object = mocked_s3.get_object(
+        Bucket="test-bucket", Key="patronload/staff_2023-03-01_12.00.00.zip"
+    )["Body"].read()
+    with ZipFile(BytesIO(zip_file_object), "r") as zip_file:
+        assert zip_file.namelist() == [
+            "staff_2023-03-01_12.00.00_01.xml",
+            "staff_2023-03-01_12.00.00_02.xml",
+        ]
+        xml_size = sum(member.file_size for member in zip_file.infolist())
+    run_record = json.loads(result.stdout.splitlines()[0])
+    render_metrics = next(
+        stage
+        for stage in run_record["stages"]
+        if (stage["stage"], stage["patron_type"]) == ("render", "staff")
+    )
+    assert render_metrics["records"] == 1
+    assert render_metrics["cpu_time"] > 0
+    assert render_metrics["bytes_out"] == xml_size
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_csv_data_source_success(
+    caplog,
+    mocked_s3,
+    runner,
+    tmp_path,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    student_record_with_staff_krb_name = (
+        "111111111",
+        None,
+        staff_database_record_with_all_values[2],
+        *student_database_record_with_all_values[3:],
+    )
+    for table, fields, records in [
+        ("LIBRARY_EMPLOYEE", STAFF_FIELDS, [staff_database_record_with_all_values]),
+        (
+            "LIBRARY_STUDENT",
+            STUDENT_FIELDS,
+            [
+                student_database_record_with_all_values,
+                student_record_with_staff_krb_name,
+            ],
+        ),
+    ]:
+        with open(tmp_path / f"{table}.csv", "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(fields)
+            writer.writerows(records)
+    result = runner.invoke(main, ["--data_source", f"csv://{tmp_path}"])
+    assert result.exit_code == 0
+    assert f"Successfully connected to CSV files in '{tmp_path}'" in caplog.text
+    assert "1 staff patron records created, 0 duplicate records skipped" in caplog.text
+    assert "1 student patron records created, 1 duplicate records skipped" in caplog.text
+    zip_file_object = mocked_s3.get_object(
+        Bucket="test-bucket", Key="patronload/student_2023-03-01_12.00.00.zip"
+    )["Body"].read()
+    with ZipFile(BytesIO(zip_file_object), "r") as zip_file:
+        assert "STUDENT_KRB_NAME" in zip_file.read(
+            "student_2023-03-01_12.00.00.xml"
+        ).decode("utf-8")
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_sqlite_data_source_excludes_rows_in_database(
+    caplog,
+    mocked_s3,
+    runner,
+    tmp_path,
+    staff_database_record_with_all_values,
+    staff_database_record_with_null_values,
+    student_database_record_with_all_values,
+):
+    student_record_with_staff_krb_name = (
+        "111111111",
+        None,
+        staff_database_record_with_all_values[2],
+        *student_database_record_with_all_values[3:],
+    )
+    database = tmp_path / "patrons.db"
+    with sqlite3.connect(database) as connection:
+        for table, fields, records in [
+            (
+                "LIBRARY_EMPLOYEE",
+                STAFF_FIELDS,
+                [
+                    staff_database_record_with_all_values,
+                    staff_database_record_with_null_values,
+                ],
+            ),
+            (
+                "LIBRARY_STUDENT",
+                STUDENT_FIELDS,
+                [
+                    student_database_record_with_all_values,
+                    student_record_with_staff_krb_name,
+                ],
+            ),
+        ]:
+            connection.execute(f"CREATE TABLE {table} ({', '.join(fields)})")
+            connection.executemany(
+                f"INSERT INTO {table} VALUES ({', '.join('?' * len(fields))})",  # noqa: S608
+                records,
+            )
+    connection.close()
+    result = runner.invoke(main, ["--data_source", f"sqlite://{database}"])
+    assert result.exit_code == 0
+    assert (
+        "1 staff patron records without a KRB name excluded by the Data Warehouse query"
+        in caplog.text
+    )
+    assert (
+        "1 student patron records with the KRB name of a staff patron excluded by the "
+        "Data Warehouse query" in caplog.text
+    )
+    assert "1 staff patron records retrieved from Data Warehouse" in caplog.text
+    assert "1 student patron records retrieved from Data Warehouse" in caplog.text
+    assert "1 student patron records created, 0 duplicate records skipped" in caplog.text
+
+
+def test_cli_from_snapshot_replays_recorded_patron_records(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    tmp_path,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return [student_database_record_with_all_values]
+
+    mock_query_results(mocked_oracledb, query_results)
+    with freeze_time("2023-03-01 12:00:00"):
+        result = runner.invoke(main, ["--snapshot_location", str(tmp_path)])
+    assert result.exit_code == 0
+    assert "Snapshot of 1 LIBRARY_EMPLOYEE records written" in caplog.text
+    recorded_zip_file_object = mocked_s3.get_object(
+        Bucket="test-bucket", Key="patronload/staff_2023-03-01_12.00.00.zip"
+    )["Body"].read()
+    mocked_oracledb.reset_mock()
+    caplog.clear()
+    with freeze_time("2023-03-01 18:00:00"):
+        result = runner.invoke(
+            main, ["--snapshot_location", str(tmp_path), "--from_snapshot"]
+        )
+    assert result.exit_code == 0
+    mocked_oracledb.create_pool.assert_not_called()
+    assert f"Successfully connected to snapshots in '{tmp_path}'" in caplog.text
+    replayed_zip_file_object = mocked_s3.get_object(
+        Bucket="test-bucket", Key="patronload/staff_2023-03-01_18.00.00.zip"
+    )["Body"].read()
+    with (
+        ZipFile(BytesIO(recorded_zip_file_object), "r") as recorded_zip_file,
+        ZipFile(BytesIO(replayed_zip_file_object), "r") as replayed_zip_file,
+    ):
+        assert recorded_zip_file.read(
+            "staff_2023-03-01_12.00.00.xml"
+        ) == replayed_zip_file.read("staff_2023-03-01_18.00.00.xml")
+
+    with freeze_time("2023-03-02 13:00:00"):
+        result = runner.invoke(
+            main, ["--snapshot_location", str(tmp_path), "--from_snapshot"]
+        )
+    assert result.exit_code == 1
+    assert "has expired" in str(result.exception)
+
+
+def test_cli_from_snapshot_without_snapshot_location_raises_error(runner):
+    result = runner.invoke(main, ["--from_snapshot"])
+    assert result.exit_code == 2  # noqa: PLR2004
+    assert "--from_snapshot requires --snapshot_location" in result.output
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_only_consumed_fields_are_queried(
+    mocked_oracledb, mock_query_results, mocked_s3, runner
+):
+    queries = []
+    mock_query_results(mocked_oracledb, lambda query: queries.append(query) or [])
+    result = runner.invoke(main)
+    assert result.exit_code == 0
+    staff_query = next(
+        query
+        for query in queries
+        if query.startswith("SELECT MIT_ID")
+        and "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query
+    )
+    assert "ORG_UNIT_TITLE" in staff_query
+    for field in ["APPOINTMENT_END_DATE", "POSITION_TITLE", "DIRECTORY_TITLE"]:
+        assert field not in staff_query
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_render_workers_share_one_render_pool(mocked_oracledb, mocked_s3, runner):
+    with patch(
+        "patronload.cli.create_render_pool", wraps=create_render_pool
+    ) as mocked_create_render_pool:
+        result = runner.invoke(main, ["--render_workers", "2"])
+    assert result.exit_code == 0
+    mocked_create_render_pool.assert_called_once_with(2)
+
+
+def test_cli_render_workers_and_xml_shards_raises_error(runner):
+    result = runner.invoke(main, ["--render_workers", "2", "--xml_shards", "2"])
+    assert result.exit_code == 2  # noqa: PLR2004
+    assert "can not both be greater than 1" in result.output
+
+
+def test_cli_skip_unchanged_skips_upload_of_unchanged_patrons(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    student_records = [student_database_record_with_all_values]
+
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return student_records
+
+    mock_query_results(mocked_oracledb, query_results)
+    with freeze_time("2023-03-01 12:00:00"):
+        assert runner.invoke(main, ["--skip_unchanged"]).exit_code == 0
+    student_records.append(
+        (
+            "999999999",
+            None,
+            "NEW_STUDENT_KRB_NAME",
+            *student_database_record_with_all_values[3:],
+        )
+    )
+    caplog.clear()
+    with freeze_time("2023-03-02 12:00:00"):
+        assert runner.invoke(main, ["--skip_unchanged"]).exit_code == 0
+    assert (
+        "staff patron records unchanged since 'staff_2023-03-01_12.00.00.zip' was "
+        "uploaded, upload skipped" in caplog.text
+    )
+    assert "XML data created and zipped for staff patrons" not in caplog.text
+    assert "XML data created and zipped for student patrons" in caplog.text
+    assert [
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(
+            Bucket="test-bucket", Prefix="patronload"
+        )["Contents"]
+    ] == [
+        "patronload/patronload_manifest.json",
+        "patronload/staff_2023-03-01_12.00.00.zip",
+        "patronload/student_2023-03-02_12.00.00.zip",
+    ]
+    manifest = json.loads(
+        mocked_s3.get_object(
+            Bucket="test-bucket", Key="patronload/patronload_manifest.json"
+        )["Body"].read()
+    )
+    assert manifest["staff"]["uploaded"] == "2023-03-01T12:00:00+00:00"
+    assert manifest["student"]["record_count"] == 2  # noqa: PLR2004
+
+    with freeze_time("2023-03-09 12:00:00"):
+        assert runner.invoke(main, ["--skip_unchanged"]).exit_code == 0
+    assert mocked_s3.get_object(
+        Bucket="test-bucket", Key="patronload/staff_2023-03-09_12.00.00.zip"
+    )
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_fingerprint_store_loads_only_changed_patrons(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    tmp_path,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    student_records = [
+        student_database_record_with_all_values,
+        (
+            *student_database_record_with_all_values[:2],
+            staff_database_record_with_all_values[2],
+            *student_database_record_with_all_values[3:],
+        ),
+    ]
+
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return student_records
+
+    mock_query_results(mocked_oracledb, query_results)
+    fingerprint_store = str(tmp_path / "fingerprints.sqlite")
+    result = runner.invoke(main, ["--fingerprint_store", fingerprint_store])
+    assert result.exit_code == 0
+    assert "1 student patron records new or changed, 0 unchanged" in caplog.text
+
+    student_records[0] = (*student_database_record_with_all_values[:-1], "2")
+    caplog.clear()
+    result = runner.invoke(main, ["--fingerprint_store", fingerprint_store])
+    assert result.exit_code == 0
+    assert "0 staff patron records new or changed, 1 unchanged" in caplog.text
+    assert "1 student patron records new or changed, 0 unchanged" in caplog.text
+    assert "0 student patron records created, 1 duplicate" not in caplog.text
+    assert "1 student patron records created, 1 duplicate" in caplog.text
+
+    caplog.clear()
+    result = runner.invoke(
+        main, ["--fingerprint_store", fingerprint_store, "--force_full_load"]
+    )
+    assert result.exit_code == 0
+    assert "1 staff patron records new or changed, 0 unchanged" in caplog.text
+
+
+def test_cli_skip_unchanged_and_fingerprint_store_raises_error(runner):
+    result = runner.invoke(
+        main, ["--skip_unchanged", "--fingerprint_store", "fingerprints.sqlite"]
+    )
+    assert result.exit_code == 2  # noqa: PLR2004
+    assert "can not be combined with --fingerprint_store" in result.output
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_cli_fragment_cache_reuses_fragments(
+    mocked_oracledb,
+    caplog,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    tmp_path,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            return [staff_database_record_with_all_values]
+        return [student_database_record_with_all_values]
+
+    mock_query_results(mocked_oracledb, query_results)
+    fragment_cache = str(tmp_path / "fragments.sqlite")
+    result = runner.invoke(main, ["--fragment_cache", fragment_cache])
+    assert result.exit_code == 0
+    assert "Fragment cache: 0 hits, 2 misses, 0 fragments evicted" in caplog.text
+    result = runner.invoke(main, ["--fragment_cache", fragment_cache])
+    assert result.exit_code == 0
+    assert "Fragment cache: 2 hits, 0 misses, 0 fragments evicted" in caplog.text
+
+
+def test_cli_staff_failure_aborts_concurrent_student_upload(
+    mocked_oracledb,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    staff_database_record_with_all_values,
+    student_database_record_with_all_values,
+):
+    student_queried = threading.Event()
+    staff_failed = threading.Event()
+    student_stopped = threading.Event()
+    waits = []
+
+    def query_results(query):
+        if query == STAFF_KRB_NAME_QUERY:
+            return [(staff_database_record_with_all_values[2],)]
+        if "FROM LIBRARY_EMPLOYEE WHERE KRB_NAME_UPPERCASE" in query:
+            waits.append(student_queried.wait(timeout=5))
+            staff_failed.set()
+            message = "staff query failed"
+            raise RuntimeError(message)
+        student_queried.set()
+        waits.append(staff_failed.wait(timeout=5))
+        return [student_database_record_with_all_values]
+
+    def raise_if_student_load_failed(patron_type, load_failed):
+        if patron_type == "student" and staff_failed.is_set():
+            # The staff failure is recorded by a done callback once the staff query
+            # has raised, so the student records are only loaded once it is
+            waits.append(load_failed.wait(timeout=5))
+            student_stopped.set()
+        raise_if_load_failed(patron_type, load_failed)
+
+    mock_query_results(mocked_oracledb, query_results)
+    with patch(
+        "patronload.cli.raise_if_load_failed", side_effect=raise_if_student_load_failed
+    ):
+        result = runner.invoke(main)
+    assert waits == [True, True, True]
+    assert student_stopped.is_set()
+    assert str(result.exception) == "staff query failed"
+    assert [
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(
+            Bucket="test-bucket", Prefix="patronload"
+        ).get("Contents", [])
+    ] == []
+    assert mocked_s3.list_multipart_uploads(Bucket="test-bucket").get("Uploads", []) == []
+
+
+def test_cli_sequential_staff_failure_skips_student_load(
+    mocked_oracledb,
+    mock_query_results,
+    mocked_s3,
+    runner,
+    student_database_record_with_all_values,
+):
+    queries = []
+
+    def query_results(query):
+        queries.append(query)
+        if "FROM LIBRARY_EMPLOYEE" in query:
+            message = "staff query failed"
+            raise RuntimeError(message)
+        return [student_database_record_with_all_values]
+
+    mock_query_results(mocked_oracledb, query_results)
+    result = runner.invoke(main, ["--sequential_extraction"])
+    assert str(result.exception) == "staff query failed"
+    assert not any("FROM LIBRARY_STUDENT" in query for query in queries)
+    assert "Contents" not in mocked_s3.list_objects_v2(
+        Bucket="test-bucket", Prefix="patronload"
+    )
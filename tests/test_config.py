@@ -1,4 +1,8 @@
 import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
 
 import pytest
 
@@ -7,6 +11,8 @@ from patronload.config import (
     configure_sentry,
     create_log_stream_for_email,
     load_config_values,
+    load_departments,
+    template_path,
 )
 
 
@@ -76,3 +82,40 @@ def load_config_values_missing_variable_raises_error(
     monkeypatch.delenv("WORKSPACE", raising=False)
     with pytest.raises(KeyError):
         load_config_values()
+
+
+def test_load_departments_does_not_depend_on_working_directory(monkeypatch, tmp_path):
+    load_departments.cache_clear()
+    monkeypatch.chdir(tmp_path)
+    assert load_departments("staff")["10000948"]
+    assert load_departments("student")
+    assert template_path("student").exists()
+
+
+def test_import_defers_heavy_dependencies(tmp_path):
+    # -X importtime reports each module imported, on stderr
+    import_report = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import patronload.cli"],
+        capture_output=True,
+        check=True,
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parent.parent)},
+        text=True,
+    ).stderr
+    imported_modules = {
+        line.rsplit("|", 1)[-1].strip().split(".")[0]
+        for line in import_report.splitlines()
+        if line.startswith("import time:")
+    }
+    assert "patronload" in imported_modules
+    assert imported_modules.isdisjoint(
+        [
+            "boto3",
+            "botocore",
+            "bs4",
+            "dateutil",
+            "mypy_boto3_s3",
+            "oracledb",
+            "sentry_sdk",
+        ]
+    )
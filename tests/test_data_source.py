@@ -0,0 +1,139 @@
+import csv
+import sqlite3
+
+import pytest
+
+from patronload.config import STAFF_FIELDS
+from patronload.data_source import (
+    FileDataSource,
+    SQLDataSource,
+    create_data_source,
+)
+from patronload.database import SQLiteConnectionPool
+
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    database = str(tmp_path / "warehouse.db")
+    with sqlite3.connect(database) as connection:
+        connection.execute("CREATE TABLE LIBRARY_EMPLOYEE (MIT_ID TEXT, NAME TEXT)")
+        connection.executemany(
+            "INSERT INTO LIBRARY_EMPLOYEE VALUES (?, ?)",
+            [(f"{mit_id:09d}", f"Name {mit_id}") for mit_id in range(1, 101)],
+        )
+    connection.close()
+    return database
+
+
+def test_sql_data_source_query_same_rows_for_any_partition_count(sqlite_database):
+    data_source = SQLDataSource(SQLiteConnectionPool(sqlite_database), arraysize=7)
+    patron_records = data_source.query(["NAME", "MIT_ID"], "LIBRARY_EMPLOYEE")
+    rows = list(patron_records)
+    assert rows == [(f"Name {mit_id}", f"{mit_id:09d}") for mit_id in range(1, 101)]
+    assert patron_records.row_count == 100  # noqa: PLR2004
+    assert sorted(
+        data_source.query(["NAME", "MIT_ID"], "LIBRARY_EMPLOYEE", partitions=3)
+    ) == sorted(rows)
+
+
+@pytest.fixture
+def sqlite_patron_tables(tmp_path):
+    database = str(tmp_path / "patrons.db")
+    with sqlite3.connect(database) as connection:
+        connection.execute(
+            "CREATE TABLE LIBRARY_EMPLOYEE (MIT_ID TEXT, KRB_NAME_UPPERCASE)"
+        )
+        connection.execute(
+            "CREATE TABLE LIBRARY_STUDENT (MIT_ID TEXT, KRB_NAME_UPPERCASE)"
+        )
+        connection.executemany(
+            "INSERT INTO LIBRARY_EMPLOYEE VALUES (?, ?)",
+            [("1", "STAFF"), ("2", "STUDENT_EMPLOYEE"), ("3", None)],
+        )
+        connection.executemany(
+            "INSERT INTO LIBRARY_STUDENT VALUES (?, ?)",
+            [("2", "STUDENT_EMPLOYEE"), ("4", "STUDENT"), ("5", None), ("6", None)],
+        )
+    connection.close()
+    return database
+
+
+STUDENT_PREDICATES = {
+    "without a KRB name": "KRB_NAME_UPPERCASE IS NOT NULL",
+    "with the KRB name of a staff patron": (
+        "NOT EXISTS (SELECT 1 FROM LIBRARY_EMPLOYEE WHERE "
+        "LIBRARY_EMPLOYEE.KRB_NAME_UPPERCASE = LIBRARY_STUDENT.KRB_NAME_UPPERCASE)"
+    ),
+}
+
+
+@pytest.mark.parametrize("partitions", [1, 2])
+def test_sql_data_source_query_applies_predicates(sqlite_patron_tables, partitions):
+    data_source = SQLDataSource(SQLiteConnectionPool(sqlite_patron_tables))
+    assert list(
+        data_source.query(
+            ["MIT_ID", "KRB_NAME_UPPERCASE"],
+            "LIBRARY_STUDENT",
+            partitions=partitions,
+            predicates=list(STUDENT_PREDICATES.values()),
+        )
+    ) == [("4", "STUDENT")]
+
+
+def test_sql_data_source_excluded_row_counts(sqlite_patron_tables):
+    data_source = SQLDataSource(SQLiteConnectionPool(sqlite_patron_tables))
+    assert data_source.excluded_row_counts("LIBRARY_STUDENT", STUDENT_PREDICATES) == {
+        "without a KRB name": 2,
+        "with the KRB name of a staff patron": 1,
+    }
+
+
+def test_file_data_source_excluded_row_counts_empty(tmp_path):
+    assert (
+        create_data_source(f"csv://{tmp_path}", {}).excluded_row_counts(
+            "LIBRARY_STUDENT", STUDENT_PREDICATES
+        )
+        == {}
+    )
+
+
+def test_sql_data_source_describe_sqlite(sqlite_database):
+    data_source = create_data_source(f"sqlite://{sqlite_database}", {})
+    assert data_source.describe().startswith(f"SQLite database '{sqlite_database}'")
+
+
+def test_file_data_source_csv_returns_fields_in_order_with_nulls(tmp_path):
+    with open(tmp_path / "LIBRARY_EMPLOYEE.csv", "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(reversed(STAFF_FIELDS)))
+        writer.writeheader()
+        writer.writerow(
+            {field: f"{field.lower()}" for field in STAFF_FIELDS} | {"OFFICE_PHONE": ""}
+        )
+    data_source = create_data_source(f"csv://{tmp_path}", {})
+    assert isinstance(data_source, FileDataSource)
+    patron_records = data_source.query(STAFF_FIELDS, "LIBRARY_EMPLOYEE", partitions=4)
+    assert list(patron_records) == [
+        tuple(
+            None if field == "OFFICE_PHONE" else field.lower() for field in STAFF_FIELDS
+        )
+    ]
+    assert patron_records.row_count == 1
+
+
+def test_file_data_source_parquet_returns_fields_in_order(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    parquet = pytest.importorskip("pyarrow.parquet")
+    parquet.write_table(
+        pyarrow.table({"NAME": ["Name 1", None], "MIT_ID": ["000000001", "000000002"]}),
+        tmp_path / "LIBRARY_EMPLOYEE.parquet",
+    )
+    data_source = create_data_source(f"parquet://{tmp_path}", {})
+    assert list(data_source.query(["MIT_ID", "NAME"], "LIBRARY_EMPLOYEE")) == [
+        ("000000001", "Name 1"),
+        ("000000002", None),
+    ]
+
+
+def test_create_data_source_invalid_raises_error():
+    with pytest.raises(ValueError, match="'ftp://patrons' is not a valid data source"):
+        create_data_source("ftp://patrons", {})
@@ -1,8 +1,20 @@
-from unittest.mock import MagicMock, patch
+import logging
+import sqlite3
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import oracledb
+import pytest
 
 from patronload.database import (
+    BatchedQueryResults,
+    PartitionedQueryResults,
+    SQLiteConnectionPool,
     build_sql_query,
     create_database_connection,
+    create_database_connection_pool,
+    interning_output_type_handler,
     query_database,
 )
 
@@ -11,7 +23,24 @@ def test_build_sql_query():
     assert build_sql_query(["NAME", "DATE"], "TABLE") == "SELECT NAME, DATE FROM TABLE"
 
 
-@patch("patronload.database.oracledb")
+def test_build_sql_query_with_partition_and_order():
+    assert build_sql_query(
+        ["MIT_ID", "NAME"], "TABLE", partition=(2, 4), order_by="MIT_ID"
+    ) == ("SELECT MIT_ID, NAME FROM TABLE WHERE ORA_HASH(MIT_ID, 3) = 2 ORDER BY MIT_ID")
+
+
+def test_build_sql_query_with_predicates_and_partition():
+    assert build_sql_query(
+        ["MIT_ID"],
+        "TABLE",
+        partition=(1, 2),
+        predicates=["NAME IS NOT NULL", "MIT_ID <> 'NONE'"],
+    ) == (
+        "SELECT MIT_ID FROM TABLE WHERE NAME IS NOT NULL AND MIT_ID <> 'NONE' "
+        "AND ORA_HASH(MIT_ID, 1) = 1"
+    )
+
+
 def test_create_database_connection_success(mocked_oracledb, config_values):
     create_database_connection(config_values)
     mocked_oracledb.init_oracle_client.assert_called()
@@ -19,8 +48,202 @@ def test_create_database_connection_success(mocked_oracledb, config_values):
     mocked_oracledb.connect.assert_called()
 
 
+def test_create_database_connection_pool_success(mocked_oracledb, config_values):
+    create_database_connection_pool(config_values, size=3)
+    mocked_oracledb.init_oracle_client.assert_called()
+    mocked_oracledb.PoolParams.assert_called_with(
+        min=3,
+        max=3,
+        increment=0,
+        user="user123",
+        password="pass123",  # noqa: S106
+        host="http://localhost",
+        port="1234",
+        sid="database5678",
+    )
+    mocked_oracledb.create_pool.assert_called()
+
+
+def test_create_database_connection_thin_mode_skips_instant_client(
+    caplog, mocked_oracledb, config_values
+):
+    mocked_oracledb.connect.return_value.thin = True
+    create_database_connection(config_values, driver_mode="thin")
+    mocked_oracledb.init_oracle_client.assert_not_called()
+    assert "Oracle connection set up in thin mode" in caplog.text
+
+
+def test_create_database_connection_thin_mode_raises_error(
+    mocked_oracledb, config_values
+):
+    mocked_oracledb.Error = oracledb.Error
+    mocked_oracledb.connect.side_effect = oracledb.Error("DPY-3010: not supported")
+    with pytest.raises(oracledb.Error, match="DPY-3010"):
+        create_database_connection(config_values, driver_mode="thin")
+    mocked_oracledb.init_oracle_client.assert_not_called()
+
+
+def test_create_database_connection_auto_mode_falls_back_to_thick_mode(
+    caplog, mocked_oracledb, config_values
+):
+    thick_connection = MagicMock(thin=False)
+    mocked_oracledb.Error = oracledb.Error
+    mocked_oracledb.connect.side_effect = [
+        oracledb.Error("DPY-3010: not supported"),
+        thick_connection,
+    ]
+    assert create_database_connection(config_values, driver_mode="auto") == (
+        thick_connection
+    )
+    mocked_oracledb.init_oracle_client.assert_called_once()
+    assert "falling back to thick mode: DPY-3010: not supported" in caplog.text
+    assert "Oracle connection set up in thick mode" in caplog.text
+
+
+def test_create_database_connection_pool_auto_mode_checks_thin_mode(
+    caplog, mocked_oracledb, config_values
+):
+    mocked_oracledb.create_pool.return_value.thin = True
+    create_database_connection_pool(config_values, size=3, driver_mode="auto")
+    mocked_oracledb.connect.return_value.close.assert_called_once()
+    mocked_oracledb.init_oracle_client.assert_not_called()
+    mocked_oracledb.create_pool.assert_called_once()
+    assert "Oracle connection pool of 3 connections set up in thin mode" in caplog.text
+
+
+def test_create_database_connection_pool_auto_mode_falls_back_to_thick_mode(
+    mocked_oracledb, config_values
+):
+    mocked_oracledb.Error = oracledb.Error
+    mocked_oracledb.connect.side_effect = oracledb.Error("DPY-3015: verifier")
+    create_database_connection_pool(config_values, driver_mode="auto")
+    mocked_oracledb.init_oracle_client.assert_called_once()
+    mocked_oracledb.create_pool.assert_called_once()
+
+
 def test_query_database_success():
     query = "SELECT ROW1 FROM TABLE1"
     connection = MagicMock()
     connection.cursor.return_value.fetchall.return_value = [("1", "2"), ("3", "4")]
     assert query_database(connection, query) == [("1", "2"), ("3", "4")]
+
+
+def test_batched_query_results_yields_rows_in_batches(caplog):
+    caplog.set_level(logging.INFO)
+    connection = MagicMock()
+    cursor = connection.cursor.return_value
+    cursor.fetchmany.side_effect = [[("1", "2"), ("3", "4")], [("5", "6")]]
+    patron_records = BatchedQueryResults(
+        connection, "SELECT ROW1 FROM TABLE1", arraysize=2, prefetchrows=3
+    )
+    assert list(patron_records) == [("1", "2"), ("3", "4"), ("5", "6")]
+    assert cursor.arraysize == 2  # noqa: PLR2004
+    assert cursor.prefetchrows == 3  # noqa: PLR2004
+    assert cursor.outputtypehandler is interning_output_type_handler
+    cursor.execute.assert_called_once_with("SELECT ROW1 FROM TABLE1")
+    assert cursor.fetchmany.call_count == 2  # noqa: PLR2004
+    assert patron_records.row_count == 3  # noqa: PLR2004
+    assert patron_records.round_trips == 3  # noqa: PLR2004
+    assert "3 rows fetched in 3 round trips" in caplog.text
+
+
+def test_batched_query_results_fetches_until_short_batch():
+    connection = MagicMock()
+    connection.cursor.return_value.fetchmany.side_effect = [[("1",), ("2",)], []]
+    patron_records = BatchedQueryResults(connection, "SELECT ROW1 FROM TABLE1", 2, 2)
+    assert list(patron_records) == [("1",), ("2",)]
+    assert patron_records.row_count == 2  # noqa: PLR2004
+
+
+def test_interning_output_type_handler_interns_low_cardinality_fields():
+    cursor = MagicMock(arraysize=500)
+    assert (
+        interning_output_type_handler(
+            cursor, SimpleNamespace(name="MIT_ID", type_code=oracledb.DB_TYPE_VARCHAR)
+        )
+        is None
+    )
+    cursor.var.assert_not_called()
+    assert (
+        interning_output_type_handler(
+            cursor,
+            SimpleNamespace(name="ORG_UNIT_ID", type_code=oracledb.DB_TYPE_VARCHAR),
+        )
+        is cursor.var.return_value
+    )
+    cursor.var.assert_called_once_with(
+        oracledb.DB_TYPE_VARCHAR, arraysize=500, outconverter=sys.intern
+    )
+
+
+@pytest.fixture
+def sqlite_connection_pool(tmp_path):
+    database = str(tmp_path / "warehouse.db")
+    with sqlite3.connect(database) as connection:
+        connection.execute("CREATE TABLE LIBRARY_EMPLOYEE (MIT_ID TEXT, NAME TEXT)")
+        connection.executemany(
+            "INSERT INTO LIBRARY_EMPLOYEE VALUES (?, ?)",
+            [(f"{mit_id:09d}", f"Name {mit_id}") for mit_id in range(500, 0, -1)],
+        )
+    connection.close()
+    return SQLiteConnectionPool(database)
+
+
+def test_partitioned_query_results_merges_partitions_in_order(sqlite_connection_pool):
+    patron_records = PartitionedQueryResults(
+        sqlite_connection_pool,
+        ["MIT_ID", "NAME"],
+        "LIBRARY_EMPLOYEE",
+        4,
+        arraysize=7,
+        max_batches_in_flight=2,
+    )
+    assert list(patron_records) == [
+        (f"{mit_id:09d}", f"Name {mit_id}") for mit_id in range(1, 501)
+    ]
+    assert patron_records.row_count == 500  # noqa: PLR2004
+    assert len(patron_records.partition_results) == 4  # noqa: PLR2004
+    assert all(
+        0 < results.row_count < 500  # noqa: PLR2004
+        for results in patron_records.partition_results
+    )
+
+
+def test_partitioned_query_results_same_rows_for_any_partition_count(
+    sqlite_connection_pool,
+):
+    assert list(
+        PartitionedQueryResults(
+            sqlite_connection_pool, ["MIT_ID", "NAME"], "LIBRARY_EMPLOYEE", 1
+        )
+    ) == list(
+        PartitionedQueryResults(
+            sqlite_connection_pool, ["MIT_ID", "NAME"], "LIBRARY_EMPLOYEE", 3
+        )
+    )
+
+
+def test_partitioned_query_results_stops_fetching_when_iteration_stops(
+    sqlite_connection_pool,
+):
+    patron_records = PartitionedQueryResults(
+        sqlite_connection_pool,
+        ["MIT_ID", "NAME"],
+        "LIBRARY_EMPLOYEE",
+        2,
+        arraysize=5,
+        max_batches_in_flight=1,
+    )
+    rows = iter(patron_records)
+    assert next(rows) == ("000000001", "Name 1")
+    rows.close()
+    assert patron_records.stopped.is_set()
+    assert patron_records.row_count < 100  # noqa: PLR2004
+
+
+def test_partitioned_query_results_raises_partition_error(sqlite_connection_pool):
+    patron_records = PartitionedQueryResults(
+        sqlite_connection_pool, ["MIT_ID"], "LIBRARY_STUDENT", 2
+    )
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        list(patron_records)
@@ -0,0 +1,123 @@
+from freezegun import freeze_time
+
+from patronload.fingerprint import FingerprintStore
+
+
+def test_fingerprint_store_yields_only_new_and_changed_records(
+    tmp_path,
+    staff_database_record_with_all_values,
+    staff_database_record_krb_and_null_values,
+):
+    location = str(tmp_path / "fingerprints.sqlite")
+    fingerprint_store = FingerprintStore(location)
+    fingerprint_store.load()
+    assert list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    ) == [staff_database_record_with_all_values]
+    fingerprint_store.save()
+
+    changed_record = (*staff_database_record_krb_and_null_values[:-1], "Librarian")
+    fingerprint_store = FingerprintStore(location)
+    fingerprint_store.load()
+    assert list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values, changed_record]
+        )
+    ) == [changed_record]
+    assert fingerprint_store.changed["staff"] == 1
+    assert fingerprint_store.unchanged["staff"] == 1
+
+
+def test_fingerprint_store_patron_type_change_is_a_change(
+    tmp_path, staff_database_record_with_all_values
+):
+    location = str(tmp_path / "fingerprints.sqlite")
+    fingerprint_store = FingerprintStore(location)
+    list(
+        fingerprint_store.changed_records(
+            "student", [staff_database_record_with_all_values]
+        )
+    )
+    fingerprint_store.save()
+    fingerprint_store = FingerprintStore(location)
+    fingerprint_store.load()
+    assert list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    ) == [staff_database_record_with_all_values]
+
+
+def test_fingerprint_store_full_load_yields_all_records(
+    tmp_path, staff_database_record_with_all_values
+):
+    location = str(tmp_path / "fingerprints.sqlite")
+    fingerprint_store = FingerprintStore(location)
+    list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    )
+    fingerprint_store.save()
+    fingerprint_store = FingerprintStore(location, full_load=True)
+    fingerprint_store.load()
+    assert list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    ) == [staff_database_record_with_all_values]
+
+
+def test_fingerprint_store_reloads_records_older_than_max_age(
+    tmp_path, staff_database_record_with_all_values
+):
+    location = str(tmp_path / "fingerprints.sqlite")
+    with freeze_time("2023-03-01"):
+        fingerprint_store = FingerprintStore(location)
+        list(
+            fingerprint_store.changed_records(
+                "staff", [staff_database_record_with_all_values]
+            )
+        )
+        fingerprint_store.save()
+    with freeze_time("2023-03-31"):
+        fingerprint_store = FingerprintStore(location)
+        fingerprint_store.load()
+        assert not list(
+            fingerprint_store.changed_records(
+                "staff", [staff_database_record_with_all_values]
+            )
+        )
+    with freeze_time("2023-04-01"):
+        fingerprint_store = FingerprintStore(location)
+        fingerprint_store.load()
+        assert list(
+            fingerprint_store.changed_records(
+                "staff", [staff_database_record_with_all_values]
+            )
+        ) == [staff_database_record_with_all_values]
+
+
+def test_fingerprint_store_s3_location_success(
+    caplog, mocked_s3, s3_client, staff_database_record_with_all_values
+):
+    location = "s3://test-bucket/patronload-state/fingerprints.sqlite"
+    fingerprint_store = FingerprintStore(location, s3_client)
+    fingerprint_store.load()
+    assert f"No fingerprint store found at '{location}'" in caplog.text
+    list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    )
+    fingerprint_store.save()
+    fingerprint_store = FingerprintStore(location, s3_client)
+    fingerprint_store.load()
+    assert f"1 patron fingerprints loaded from '{location}'" in caplog.text
+    assert not list(
+        fingerprint_store.changed_records(
+            "staff", [staff_database_record_with_all_values]
+        )
+    )
@@ -0,0 +1,85 @@
+from unittest.mock import patch
+
+import pytest
+
+from patronload.fragment_cache import FragmentCache, fill_date_slots
+from patronload.patron import render_patron_records
+
+SIX_MONTHS = "2023-09-01Z"
+TWO_YEARS = "2025-09-01Z"
+
+
+@pytest.mark.parametrize("render_mode", ["compiled", "soup"])
+def test_render_patron_records_with_fragment_cache_matches_rendering(
+    tmp_path,
+    render_mode,
+    student_database_record_with_all_values,
+    student_database_record_krb_and_null_values,
+):
+    patron_records = [
+        student_database_record_with_all_values,
+        student_database_record_krb_and_null_values,
+    ]
+    fragment_cache = FragmentCache(str(tmp_path / "fragments.sqlite"))
+    for six_months, two_years in [
+        (SIX_MONTHS, TWO_YEARS),
+        ("2023-09-02Z", "2025-09-02Z"),
+    ]:
+        assert list(
+            render_patron_records(
+                "student",
+                patron_records,
+                render_mode,
+                six_months,
+                two_years,
+                fragment_cache=fragment_cache,
+            )
+        ) == list(
+            render_patron_records(
+                "student", patron_records, render_mode, six_months, two_years
+            )
+        )
+    assert fragment_cache.misses == 2  # noqa: PLR2004
+    assert fragment_cache.hits == 2  # noqa: PLR2004
+    fragment_cache.close()
+
+
+def test_fragment_cache_persists_fragments_between_runs(tmp_path):
+    path = str(tmp_path / "fragments.sqlite")
+    fragment_cache = FragmentCache(path)
+    key = FragmentCache.key("staff", ("444444444",))
+    fragment_cache.put(key, b"<user>\x00expiry_date\x00</user>")
+    fragment_cache.close()
+    fragment_cache = FragmentCache(path)
+    assert fill_date_slots(fragment_cache.get(key), SIX_MONTHS, TWO_YEARS) == (
+        b"<user>2023-09-01Z</user>"
+    )
+    fragment_cache.close()
+
+
+def test_fragment_cache_cleared_when_configuration_changes(caplog, tmp_path):
+    path = str(tmp_path / "fragments.sqlite")
+    fragment_cache = FragmentCache(path)
+    fragment_cache.put(b"key", b"<user></user>")
+    fragment_cache.close()
+    with patch.object(FragmentCache, "configuration_digest", return_value="changed"):
+        fragment_cache = FragmentCache(path)
+    assert "fragment cache cleared" in caplog.text
+    assert fragment_cache.get(b"key") is None
+    fragment_cache.close()
+
+
+def test_fragment_cache_evicts_least_recently_used_fragments(caplog, tmp_path):
+    path = str(tmp_path / "fragments.sqlite")
+    for now, key in enumerate([b"old", b"used", b"new"]):
+        fragment_cache = FragmentCache(path, max_size=20)
+        fragment_cache.now = now
+        fragment_cache.put(key, b"0123456789")
+        fragment_cache.get(b"used")
+        fragment_cache.close()
+    assert "1 fragments evicted" in caplog.text
+    fragment_cache = FragmentCache(path)
+    assert fragment_cache.get(b"old") is None
+    assert fragment_cache.get(b"used") == b"0123456789"
+    assert fragment_cache.get(b"new") == b"0123456789"
+    fragment_cache.close()
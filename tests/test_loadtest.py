@@ -0,0 +1,67 @@
+import json
+import sqlite3
+
+from patronload.loadtest import loadtest, write_patron_database
+from patronload.synthetic import SyntheticPatrons
+
+
+def test_write_patron_database(tmp_path):
+    database = str(tmp_path / "patrons.sqlite")
+    write_patron_database(database, SyntheticPatrons(), 20, 30)
+    with sqlite3.connect(database) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM LIBRARY_EMPLOYEE").fetchone() == (
+            20,
+        )
+        assert connection.execute("SELECT COUNT(*) FROM LIBRARY_STUDENT").fetchone() == (
+            30,
+        )
+
+
+def test_loadtest_runs_patronload_offline(runner, tmp_path):
+    output = str(tmp_path / "loadtest_results.json")
+    result = runner.invoke(
+        loadtest,
+        [
+            "--staff",
+            "50",
+            "--students",
+            "80",
+            "--output",
+            output,
+            "--",
+            "--xml_shards",
+            "2",
+        ],
+    )
+    assert result.exit_code == 0
+    assert "Total wall time" in result.output
+    with open(output, encoding="utf-8") as results_file:
+        results = json.load(results_file)
+    assert results["main_args"] == ["--xml_shards", "2"]
+    assert results["wall_time"] > 0
+    assert results["peak_rss"]["process"] > 0
+    assert sorted(key.split("_")[0] for key in results["zip_files"]) == [
+        "patronload/staff",
+        "patronload/student",
+    ]
+    assert all(size > 0 for size in results["zip_files"].values())
+    assert {
+        (stage["stage"], stage["patron_type"]) for stage in results["run"]["stages"]
+    } >= {("query", "staff"), ("query", "student"), ("zip", "student"), ("email", "all")}
+
+
+def test_loadtest_reuses_existing_database(runner, tmp_path):
+    database = str(tmp_path / "patrons.sqlite")
+    write_patron_database(database, SyntheticPatrons(), 10, 10)
+    result = runner.invoke(
+        loadtest,
+        ["--database", database, "--output", str(tmp_path / "results.json")],
+    )
+    assert result.exit_code == 0
+    assert "records written" not in result.output
+    query_records = {
+        stage["patron_type"]: stage["records"]
+        for stage in json.loads((tmp_path / "results.json").read_text())["run"]["stages"]
+        if stage["stage"] == "query"
+    }
+    assert query_records["staff"] <= 10  # noqa: PLR2004
@@ -0,0 +1,135 @@
+import io
+import threading
+from time import sleep
+from zipfile import ZipFile
+
+from patronload.metrics import RunMetrics, TimedWriter
+
+STAGE_TIME = 0.02
+
+
+def test_run_metrics_nested_stage_excludes_inner_stage_time():
+    run_metrics = RunMetrics()
+    with run_metrics.stage("zip", "staff"):
+        sleep(STAGE_TIME)
+        with run_metrics.stage("upload", "staff"):
+            sleep(3 * STAGE_TIME)
+    zip_metrics = run_metrics.stage_metrics("zip", "staff")
+    upload_metrics = run_metrics.stage_metrics("upload", "staff")
+    assert STAGE_TIME <= zip_metrics.wall_time < 3 * STAGE_TIME
+    assert upload_metrics.wall_time >= 3 * STAGE_TIME
+
+
+def test_run_metrics_stage_adds_up_repeated_and_threaded_stages():
+    run_metrics = RunMetrics()
+
+    def run_stage():
+        with run_metrics.stage("render", "staff"):
+            sleep(STAGE_TIME)
+
+    threads = [threading.Thread(target=run_stage) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    run_stage()
+    assert run_metrics.stage_metrics("render", "staff").wall_time >= 3 * STAGE_TIME
+
+
+def test_run_metrics_timed_times_each_item_as_stage():
+    run_metrics = RunMetrics()
+
+    def slow_records():
+        for record in ["a", "b"]:
+            sleep(STAGE_TIME)
+            yield record
+
+    for _ in run_metrics.timed(slow_records(), "query", "staff"):
+        sleep(STAGE_TIME)
+    query_metrics = run_metrics.stage_metrics("query", "staff")
+    assert 2 * STAGE_TIME <= query_metrics.wall_time < 4 * STAGE_TIME
+
+
+def test_run_metrics_as_dict_includes_stages():
+    run_metrics = RunMetrics()
+    with run_metrics.stage("email") as email_metrics:
+        email_metrics.records = 1
+        email_metrics.bytes_out = 100
+    run_record = run_metrics.as_dict("test")
+    assert run_record["workspace"] == "test"
+    assert run_record["wall_time"] >= run_record["stages"][0]["wall_time"]
+    assert run_record["stages"][0] == {
+        "stage": "email",
+        "patron_type": "all",
+        "wall_time": run_record["stages"][0]["wall_time"],
+        "cpu_time": run_record["stages"][0]["cpu_time"],
+        "records": 1,
+        "records_per_second": round(1 / email_metrics.wall_time, 3),
+        "bytes_in": 0,
+        "bytes_out": 100,
+    }
+
+
+def test_run_metrics_records_per_second_without_wall_time_is_zero():
+    run_metrics = RunMetrics()
+    run_metrics.stage_metrics("query", "staff").records = 10
+    assert run_metrics.stage_metrics("query", "staff").records_per_second == 0
+
+
+def test_run_metrics_emf_records():
+    run_metrics = RunMetrics()
+    run_metrics.stage_metrics("query", "student").records = 1
+    (emf_record,) = run_metrics.emf_records("patronload", "test")
+    assert emf_record["_aws"]["CloudWatchMetrics"] == [
+        {
+            "Namespace": "patronload",
+            "Dimensions": [["Workspace", "Stage", "PatronType"]],
+            "Metrics": [
+                {"Name": "WallTime", "Unit": "Seconds"},
+                {"Name": "CPUTime", "Unit": "Seconds"},
+                {"Name": "Records", "Unit": "Count"},
+                {"Name": "RecordsPerSecond", "Unit": "Count/Second"},
+            ],
+        }
+    ]
+    assert emf_record["Workspace"] == "test"
+    assert emf_record["Stage"] == "query"
+    assert emf_record["PatronType"] == "student"
+    assert emf_record["Records"] == 1
+    assert "BytesIn" not in emf_record
+
+
+def test_run_metrics_emf_records_include_bytes_of_stages_with_bytes():
+    run_metrics = RunMetrics()
+    run_metrics.stage_metrics("upload", "student").bytes_out = 100
+    (emf_record,) = run_metrics.emf_records("patronload", "test")
+    assert {"Name": "BytesOut", "Unit": "Bytes"} in emf_record["_aws"][
+        "CloudWatchMetrics"
+    ][0]["Metrics"]
+    assert emf_record["BytesIn"] == 0
+    assert emf_record["BytesOut"] == 100  # noqa: PLR2004
+
+
+def test_run_metrics_to_json_lines_adds_emf_lines_with_namespace():
+    run_metrics = RunMetrics()
+    run_metrics.stage_metrics("query", "staff")
+    assert len(run_metrics.to_json_lines("test").splitlines()) == 1
+    run_record, emf_record = run_metrics.to_json_lines("test", "patronload").splitlines()
+    assert '"workspace":"test"' in run_record
+    assert '"Namespace":"patronload"' in emf_record
+
+
+def test_timed_writer_counts_bytes_written_to_zip_file():
+    run_metrics = RunMetrics()
+    zip_file_object = io.BytesIO()
+    with ZipFile(
+        TimedWriter(zip_file_object, run_metrics, "upload", "staff"), "w"
+    ) as zip_file:
+        zip_file.writestr("staff.xml", "<userRecords/>")
+    assert (
+        run_metrics.stage_metrics("upload", "staff").bytes_in
+        == len(zip_file_object.getvalue())
+        > 0
+    )
+    with ZipFile(zip_file_object) as zip_file:
+        assert zip_file.read("staff.xml") == b"<userRecords/>"
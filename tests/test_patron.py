@@ -1,17 +1,42 @@
+import ast
+import inspect
+import itertools
 import logging
+import textwrap
 from io import BytesIO
-from zipfile import ZipFile
+from unittest.mock import patch
+from zipfile import ZIP_DEFLATED, ZipFile
 
+import pytest
 from bs4 import BeautifulSoup
 from freezegun import freeze_time
 
+from patronload.config import (
+    STAFF_FIELD_CONSUMERS,
+    STAFF_FIELDS,
+    STUDENT_FIELD_CONSUMERS,
+)
 from patronload.patron import (
+    KrbNameRegistry,
+    PatronRecordSpool,
+    PatronSetHash,
+    common_slot_values,
+    compress_patrons_xml_shard,
     create_and_write_to_zip_file_in_memory,
+    create_render_pool,
     format_phone_number,
+    patrons_xml_from_records,
     patrons_xml_string_from_records,
     populate_common_fields,
     populate_staff_fields,
     populate_student_fields,
+    render_patron_records,
+    render_patron_records_in_parallel,
+    staff_slot_values,
+    student_slot_values,
+    write_patrons_xml,
+    write_sharded_patrons_xml_to_zip_file,
+    write_xml_fragments_to_zip_file,
 )
 
 SIX_MONTHS = "2023-09-01Z"
@@ -24,6 +49,256 @@ def test_create_and_write_to_zip_file_in_memory_success():
         assert zip_file.namelist() == ["test.xml"]
 
 
+def test_krb_name_registry_first_claim_wins():
+    krb_name_registry = KrbNameRegistry()
+    assert krb_name_registry.claim("KRB_NAME", "staff")
+    assert not krb_name_registry.claim("KRB_NAME", "student")
+    assert not krb_name_registry.claim("KRB_NAME", "staff")
+    assert krb_name_registry.claim("OTHER_KRB_NAME", "student")
+    assert krb_name_registry.claimed_by("KRB_NAME") == "staff"
+    assert krb_name_registry.claimed_by("OTHER_KRB_NAME") == "student"
+    assert krb_name_registry.claimed_by("UNKNOWN") is None
+    assert len(krb_name_registry) == 2  # noqa: PLR2004
+    assert krb_name_registry.duplicates == {"staff": 1, "student": 1}
+
+
+def test_patron_set_hash_does_not_depend_on_record_order(
+    staff_database_record_with_all_values, staff_database_record_krb_and_null_values
+):
+    patron_set_hash = PatronSetHash("staff")
+    list(
+        patron_set_hash.hash_records(
+            [
+                staff_database_record_with_all_values,
+                staff_database_record_krb_and_null_values,
+            ]
+        )
+    )
+    reordered_patron_set_hash = PatronSetHash("staff")
+    reordered_patron_set_hash.update(staff_database_record_krb_and_null_values)
+    reordered_patron_set_hash.update(staff_database_record_with_all_values)
+    assert patron_set_hash.record_count == 2  # noqa: PLR2004
+    assert patron_set_hash.hexdigest() == reordered_patron_set_hash.hexdigest()
+
+
+def test_patron_set_hash_changes_with_records(staff_database_record_with_all_values):
+    patron_set_hash = PatronSetHash("staff")
+    patron_set_hash.update(staff_database_record_with_all_values)
+    changed_patron_set_hash = PatronSetHash("staff")
+    changed_patron_set_hash.update(
+        (*staff_database_record_with_all_values[:-1], "Librarian")
+    )
+    assert patron_set_hash.hexdigest() != changed_patron_set_hash.hexdigest()
+    assert patron_set_hash.hexdigest() != PatronSetHash("staff").hexdigest()
+
+
+def check_field_declarations(
+    staff_field_consumers=STAFF_FIELD_CONSUMERS,
+    student_field_consumers=STUDENT_FIELD_CONSUMERS,
+):
+    """Check that the render steps read exactly the patron fields declared for them.
+
+    Only the fields declared in STAFF_FIELD_CONSUMERS and STUDENT_FIELD_CONSUMERS are
+    fetched, so a render step reading an undeclared field would fail with a KeyError
+    partway through a run. A RuntimeError listing every mismatch is raised.
+    """
+    render_step_functions = {
+        "common": [populate_common_fields, common_slot_values],
+        "staff": [populate_staff_fields, staff_slot_values],
+        "student": [populate_student_fields, student_slot_values],
+    }
+    errors = []
+    for patron_type, field_consumers in [
+        ("staff", staff_field_consumers),
+        ("student", student_field_consumers),
+    ]:
+        fields = [field for field, steps in field_consumers.items() if steps]
+        if fields[0] != "MIT_ID" or fields[2] != "KRB_NAME_UPPERCASE":
+            errors.append(
+                f"The {patron_type} fields must start with MIT_ID and have "
+                "KRB_NAME_UPPERCASE third, they are read by position"
+            )
+        for step in ["common", patron_type]:
+            declared_fields = {
+                field for field, steps in field_consumers.items() if step in steps
+            }
+            referenced_fields = set()
+            for function in render_step_functions[step]:
+                function_fields = referenced_patron_fields(function)
+                referenced_fields.update(function_fields)
+                errors.extend(
+                    f"{function.__name__} reads the {patron_type} field {field}, "
+                    f"which is not declared as consumed by the {step} step"
+                    for field in sorted(function_fields - declared_fields)
+                )
+            errors.extend(
+                f"The {patron_type} field {field} is declared as consumed by the "
+                f"{step} step, which does not read it"
+                for field in sorted(declared_fields - referenced_fields)
+            )
+    if errors:
+        raise RuntimeError("Patron field declarations are invalid:\n" + "\n".join(errors))
+
+
+def referenced_patron_fields(function):
+    """Return the patron fields a render step function reads from its patron_dict.
+
+    The fields are found in the source of the function, as patron_dict["FIELD"] and
+    patron_dict.get("FIELD"). Names in an f-string field are expanded over the values
+    of the literal list that binds them in a for loop or comprehension. A ValueError is
+    raised for any other field expression, as it can not be checked.
+
+    Args:
+        function: A render step function with a patron_dict argument.
+    """
+    tree = ast.parse(textwrap.dedent(inspect.getsource(function)))
+    loop_values = {
+        node.target.id: list(ast.literal_eval(node.iter))
+        for node in ast.walk(tree)
+        if isinstance(node, ast.For | ast.comprehension)
+        and isinstance(node.target, ast.Name)
+        and isinstance(node.iter, ast.List | ast.Tuple)
+        and all(isinstance(element, ast.Constant) for element in node.iter.elts)
+    }
+    fields = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and _is_patron_dict(node.value):
+            field_node = node.slice
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "get"
+            and _is_patron_dict(node.func.value)
+        ):
+            field_node = node.args[0]
+        else:
+            continue
+        if isinstance(field_node, ast.Constant) and isinstance(field_node.value, str):
+            fields.add(field_node.value)
+        elif isinstance(field_node, ast.JoinedStr) and (
+            field_names := _expand_f_string(field_node, loop_values)
+        ):
+            fields.update(field_names)
+        else:
+            message = (
+                f"The patron field read on line {node.lineno} of {function.__name__} "
+                "can not be checked"
+            )
+            raise ValueError(message)
+    return fields
+
+
+def _is_patron_dict(node):
+    return isinstance(node, ast.Name) and node.id == "patron_dict"
+
+
+def _expand_f_string(f_string, loop_values):
+    part_values = []
+    for part in f_string.values:
+        if isinstance(part, ast.Constant):
+            part_values.append([str(part.value)])
+        elif (
+            isinstance(part, ast.FormattedValue)
+            and isinstance(part.value, ast.Name)
+            and part.value.id in loop_values
+        ):
+            part_values.append([str(value) for value in loop_values[part.value.id]])
+        else:
+            return None
+    return ["".join(values) for values in itertools.product(*part_values)]
+
+
+def test_field_declarations_match_render_steps():
+    check_field_declarations()
+    assert "APPOINTMENT_END_DATE" not in STAFF_FIELDS
+
+
+def test_check_field_declarations_undeclared_field_raises_error():
+    with pytest.raises(RuntimeError) as error:
+        check_field_declarations(
+            staff_field_consumers=STAFF_FIELD_CONSUMERS
+            | {"ORG_UNIT_TITLE": (), "POSITION_TITLE": ("staff",)}
+        )
+    assert str(error.value).splitlines()[1:] == [
+        (
+            "populate_staff_fields reads the staff field ORG_UNIT_TITLE, which is not "
+            "declared as consumed by the staff step"
+        ),
+        (
+            "staff_slot_values reads the staff field ORG_UNIT_TITLE, which is not "
+            "declared as consumed by the staff step"
+        ),
+        (
+            "The staff field POSITION_TITLE is declared as consumed by the staff "
+            "step, which does not read it"
+        ),
+    ]
+
+
+def test_referenced_patron_fields_expands_f_string_fields():
+    def slot_values(patron_dict):
+        return [
+            patron_dict["MIT_ID"],
+            *(patron_dict.get(f"TERM_PHONE{number}") for number in [1, 2]),
+        ]
+
+    assert referenced_patron_fields(slot_values) == {
+        "MIT_ID",
+        "TERM_PHONE1",
+        "TERM_PHONE2",
+    }
+
+
+def test_referenced_patron_fields_unchecked_field_raises_error():
+    def slot_values(patron_dict, field):
+        return patron_dict[field]
+
+    with pytest.raises(ValueError, match="can not be checked"):
+        referenced_patron_fields(slot_values)
+
+
+def test_write_xml_fragments_to_zip_file_success():
+    zip_file_object = BytesIO()
+    xml_size = write_xml_fragments_to_zip_file(
+        zip_file_object, "test.xml", iter([b"<xml>", b"</xml>"])
+    )
+    assert xml_size == len(b"<xml></xml>")
+    with ZipFile(zip_file_object, "r") as zip_file:
+        assert zip_file.namelist() == ["test.xml"]
+        assert zip_file.getinfo("test.xml").compress_type == ZIP_DEFLATED
+        assert zip_file.read("test.xml") == b"<xml></xml>"
+
+
+def test_write_xml_fragments_to_zip_file_larger_than_zip64_limit_success():
+    zip_file_object = BytesIO()
+    with patch("zipfile.ZIP64_LIMIT", 16):
+        write_xml_fragments_to_zip_file(
+            zip_file_object, "test.xml", iter([b"<xml>", b"<patron/>" * 10, b"</xml>"])
+        )
+    with ZipFile(zip_file_object, "r") as zip_file:
+        assert zip_file.read("test.xml") == b"<xml>" + b"<patron/>" * 10 + b"</xml>"
+
+
+def test_patron_record_spool_replays_records_in_order():
+    patron_records = [(str(index), None, f"KRB_{index}") for index in range(5)]
+    patron_record_spool = PatronRecordSpool(chunk_size=2)
+    patron_record_spool.write(iter(patron_records))
+    assert list(patron_record_spool) == patron_records
+    assert list(patron_record_spool) == patron_records
+    patron_record_spool.close()
+    assert patron_record_spool.file.closed
+
+
+def test_krb_name_registry_reserved_krb_name_only_claimed_by_patron_type():
+    krb_name_registry = KrbNameRegistry()
+    krb_name_registry.reserve(["KRB_NAME"], "staff")
+    assert not krb_name_registry.claim("KRB_NAME", "student")
+    assert krb_name_registry.claim("KRB_NAME", "staff")
+    assert not krb_name_registry.claim("KRB_NAME", "staff")
+    assert krb_name_registry.claims == {"staff": 1}
+    assert krb_name_registry.duplicates == {"staff": 1, "student": 1}
+
+
 def test_format_phone_number_valid_value_success():
     assert format_phone_number("1111111111") == "111-111-1111"
 
@@ -49,7 +324,7 @@ def test_patrons_xml_string_from_records_staff_success(
             staff_database_record_krb_and_null_values,
             staff_database_record_with_all_values,
         ],
-        [],
+        KrbNameRegistry(),
     )
     assert (
         BeautifulSoup(results, features="xml").prettify() == staff_patrons_xml.prettify()
@@ -79,7 +354,7 @@ def test_patrons_xml_string_from_records_student_success(
             student_database_record_krb_and_null_values,
             student_database_record_with_all_values,
         ],
-        [],
+        KrbNameRegistry(),
     )
     assert (
         BeautifulSoup(results, features="xml").prettify()
@@ -94,6 +369,315 @@ def test_patrons_xml_string_from_records_student_success(
     ) in caplog.text
 
 
+@freeze_time("2023-03-01 12:00:00")
+def test_patrons_xml_string_from_records_compiled_matches_soup_staff(
+    staff_database_record_with_null_values,
+    staff_database_record_with_all_values,
+    staff_database_record_krb_and_null_values,
+):
+    staff_records = [
+        staff_database_record_with_null_values,
+        staff_database_record_with_all_values,
+        staff_database_record_krb_and_null_values,
+        (
+            "777777777",
+            "O'Brien & <Sons>@MIT.EDU",
+            "3STAFF_KRB_NAME",
+            "NONE",
+            " Bob ",
+            "Q",
+            "obrien",
+            "Robert",
+            "q",
+            "O'Brien",
+            "E19-<750>",
+            "617253",
+            "28",
+            'Staff - "Campus" & Co',
+            "UNKNOWN",
+            "Dept of 'Quotes' & \"Marks\"",
+        ),
+    ]
+    assert patrons_xml_string_from_records(
+        "staff", staff_records, KrbNameRegistry(), render_mode="compiled"
+    ) == patrons_xml_string_from_records(
+        "staff", staff_records, KrbNameRegistry(), render_mode="soup"
+    )
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_patrons_xml_string_from_records_compiled_matches_soup_student(
+    student_database_record_with_null_values,
+    student_database_record_with_all_values,
+    student_database_record_krb_and_null_values,
+):
+    student_records = [
+        student_database_record_with_null_values,
+        student_database_record_with_all_values,
+        student_database_record_krb_and_null_values,
+        (
+            "888888888",
+            None,
+            "3STUDENT_KRB_NAME",
+            "88888888888888",
+            None,
+            None,
+            None,
+            "Zoë",
+            None,
+            "Smith & Jones",
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            "6666666666",
+            None,
+            "U",
+            "NIV",
+        ),
+        (
+            "999999999",
+            None,
+            "4STUDENT_KRB_NAME",
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            "7777777777",
+            None,
+            "1111111111",
+            "3",
+            "UNKNOWN",
+        ),
+    ]
+    assert patrons_xml_string_from_records(
+        "student", student_records, KrbNameRegistry(), render_mode="compiled"
+    ) == patrons_xml_string_from_records(
+        "student", student_records, KrbNameRegistry(), render_mode="soup"
+    )
+
+
+def test_patrons_xml_string_from_records_invalid_render_mode_raises_error():
+    with pytest.raises(ValueError, match="'fast' is not a valid render mode"):
+        patrons_xml_string_from_records(
+            "staff", [], KrbNameRegistry(), render_mode="fast"
+        )
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_patrons_xml_from_records_yields_header_patron_fragments_and_footer(
+    staff_database_record_with_null_values,
+    staff_database_record_with_all_values,
+    staff_database_record_krb_and_null_values,
+):
+    xml_fragments = list(
+        patrons_xml_from_records(
+            "staff",
+            [
+                staff_database_record_with_null_values,
+                staff_database_record_with_all_values,
+                staff_database_record_krb_and_null_values,
+            ],
+            KrbNameRegistry(),
+        )
+    )
+    assert len(xml_fragments) == 4  # noqa: PLR2004
+    assert xml_fragments[0] == b'<?xml version="1.0" encoding="utf-8"?><userRecords>'
+    assert b"<primary_id>STAFF_KRB_NAME@MIT.EDU</primary_id>" in xml_fragments[1]
+    assert b"<primary_id>2STAFF_KRB_NAME@MIT.EDU</primary_id>" in xml_fragments[2]
+    assert xml_fragments[3] == b"</userRecords>"
+
+
+def test_patrons_xml_from_records_processes_records_as_consumed(
+    staff_database_record_with_all_values,
+):
+    krb_name_registry = KrbNameRegistry()
+    xml_fragments = patrons_xml_from_records(
+        "staff", iter([staff_database_record_with_all_values]), krb_name_registry
+    )
+    assert len(krb_name_registry) == 0
+    next(xml_fragments)
+    next(xml_fragments)
+    assert "STAFF_KRB_NAME" in krb_name_registry
+
+
+@pytest.mark.parametrize("render_mode", ["compiled", "soup"])
+def test_render_patron_records_in_parallel_matches_serial_rendering(
+    render_mode,
+    staff_database_record_with_all_values,
+    staff_database_record_krb_and_null_values,
+):
+    patron_records = [
+        (f"{index:09}", *record[1:2], f"{record[2]}{index}", *record[3:])
+        for index, record in enumerate(
+            [
+                staff_database_record_with_all_values,
+                staff_database_record_krb_and_null_values,
+            ]
+            * 5
+        )
+    ]
+    assert b"".join(
+        render_patron_records_in_parallel(
+            "staff",
+            iter(patron_records),
+            render_mode,
+            SIX_MONTHS,
+            TWO_YEARS,
+            render_workers=2,
+            chunk_size=3,
+        )
+    ) == b"".join(
+        render_patron_records("staff", patron_records, render_mode, SIX_MONTHS, TWO_YEARS)
+    )
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_patrons_xml_string_from_records_render_workers_skips_duplicates(
+    caplog,
+    staff_database_record_with_all_values,
+    staff_database_record_with_null_values,
+):
+    caplog.set_level("DEBUG")
+    patron_records = [
+        staff_database_record_with_all_values,
+        staff_database_record_with_null_values,
+        staff_database_record_with_all_values,
+    ]
+    krb_name_registry = KrbNameRegistry()
+    assert patrons_xml_string_from_records(
+        "staff", patron_records, krb_name_registry, render_workers=2
+    ) == patrons_xml_string_from_records("staff", patron_records, KrbNameRegistry())
+    assert krb_name_registry.claims["staff"] == 1
+    assert krb_name_registry.duplicates["staff"] == 1
+    assert (
+        "Patron record has already been created for MIT ID # '444444444'" in caplog.text
+    )
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_render_patron_records_in_parallel_uses_shared_render_pool(
+    staff_database_record_with_all_values,
+):
+    patron_records = [
+        (f"{index:09}", None, f"STAFF_KRB_NAME_{index}", *record[3:])
+        for index, record in enumerate([staff_database_record_with_all_values] * 6)
+    ]
+    with (
+        create_render_pool(2) as render_pool,
+        patch("patronload.patron.create_render_pool") as mocked_create_render_pool,
+    ):
+        rendered_xml = b"".join(
+            render_patron_records_in_parallel(
+                "staff",
+                iter(patron_records),
+                "compiled",
+                SIX_MONTHS,
+                TWO_YEARS,
+                render_workers=2,
+                chunk_size=3,
+                render_pool=render_pool,
+            )
+        )
+    mocked_create_render_pool.assert_not_called()
+    assert rendered_xml == b"".join(
+        render_patron_records("staff", patron_records, "compiled", SIX_MONTHS, TWO_YEARS)
+    )
+
+
+def test_write_sharded_patrons_xml_to_zip_file_success(
+    staff_database_record_with_all_values,
+    staff_database_record_with_null_values,
+):
+    patron_records = [
+        (f"{index:09}", None, f"STAFF_KRB_NAME_{index}", *record[3:])
+        for index, record in enumerate([staff_database_record_with_all_values] * 20)
+    ]
+    krb_name_registry = KrbNameRegistry()
+    zip_file_object = BytesIO()
+    xml_size = write_sharded_patrons_xml_to_zip_file(
+        zip_file_object,
+        ["staff_01.xml", "staff_02.xml", "staff_03.xml"],
+        "staff",
+        [*patron_records, staff_database_record_with_null_values, patron_records[0]],
+        krb_name_registry,
+    )
+    assert krb_name_registry.claims["staff"] == 20  # noqa: PLR2004
+    assert krb_name_registry.duplicates["staff"] == 1
+    with ZipFile(zip_file_object, "r") as zip_file:
+        assert zip_file.namelist() == ["staff_01.xml", "staff_02.xml", "staff_03.xml"]
+        shards = [zip_file.read(name) for name in zip_file.namelist()]
+    assert xml_size == sum(len(shard) for shard in shards)
+    primary_ids = []
+    for shard in shards:
+        assert shard.startswith(b'<?xml version="1.0" encoding="utf-8"?><userRecords>')
+        assert shard.endswith(b"</userRecords>")
+        primary_ids.extend(
+            primary_id.string
+            for primary_id in BeautifulSoup(shard, features="xml").find_all("primary_id")
+        )
+    assert sorted(primary_ids) == sorted(
+        f"STAFF_KRB_NAME_{index}@MIT.EDU" for index in range(20)
+    )
+
+
+def test_write_sharded_patrons_xml_to_zip_file_failed_shard_closes_other_shards(
+    staff_database_record_with_all_values,
+):
+    compressed_members = []
+
+    def compress_shard(xml_file_name, patron_records, *args, **kwargs):
+        if xml_file_name == "staff_02.xml":
+            for _ in patron_records:
+                pass
+            message = "Shard failed"
+            raise RuntimeError(message)
+        member = compress_patrons_xml_shard(
+            xml_file_name, patron_records, *args, **kwargs
+        )
+        compressed_members.append(member)
+        return member
+
+    with (
+        patch("patronload.patron.compress_patrons_xml_shard", side_effect=compress_shard),
+        pytest.raises(RuntimeError, match="Shard failed"),
+    ):
+        write_sharded_patrons_xml_to_zip_file(
+            BytesIO(),
+            ["staff_01.xml", "staff_02.xml", "staff_03.xml"],
+            "staff",
+            [staff_database_record_with_all_values],
+            KrbNameRegistry(),
+        )
+    assert len(compressed_members) == 2  # noqa: PLR2004
+    assert all(member.file.closed for member in compressed_members)
+
+
+@freeze_time("2023-03-01 12:00:00")
+def test_write_patrons_xml_success(staff_database_record_with_all_values):
+    file_object = BytesIO()
+    bytes_written = write_patrons_xml(
+        file_object,
+        patrons_xml_from_records(
+            "staff", [staff_database_record_with_all_values], KrbNameRegistry()
+        ),
+    )
+    assert bytes_written == len(file_object.getvalue())
+    assert file_object.getvalue().decode("utf-8") == patrons_xml_string_from_records(
+        "staff", [staff_database_record_with_all_values], KrbNameRegistry()
+    )
+
+
 def test_populate_common_fields_staff_all_values_success(
     staff_patron_template, staff_patron_all_values_dict
 ):
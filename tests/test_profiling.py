@@ -0,0 +1,90 @@
+import pstats
+import threading
+import tracemalloc
+
+from patronload.profiling import StageProfiler, profile_stage
+
+
+def allocate_patron_names():
+    return [f"PATRON_{number}" for number in range(1000)]
+
+
+def test_stage_profiler_writes_pstats_and_allocations(tmp_path):
+    stage_profiler = StageProfiler(str(tmp_path), top_allocations=3)
+    with stage_profiler.profile("render"):
+        patron_names = allocate_patron_names()
+    stage_profiler.close()
+    assert patron_names
+    assert not tracemalloc.is_tracing()
+    run_directory = tmp_path / stage_profiler.run_name
+    assert stage_profiler.files == [
+        run_directory / "render.pstats",
+        run_directory / "render.allocations.txt",
+    ]
+    render_stats = pstats.Stats(str(run_directory / "render.pstats"))
+    profiled_functions = {function_name for _, _, function_name in render_stats.stats}
+    assert "allocate_patron_names" in profiled_functions
+    allocations = (run_directory / "render.allocations.txt").read_text().splitlines()
+    assert allocations[0].startswith("Peak traced memory: ")
+    assert allocations[1] == "Top 3 allocations by size:"
+    assert len(allocations) == 2 + 3
+    assert "test_profiling.py" in allocations[2]
+
+
+def test_stage_profiler_nested_stage_is_part_of_outer_profile(tmp_path):
+    stage_profiler = StageProfiler(str(tmp_path))
+    with stage_profiler.profile("staff"), stage_profiler.profile("s3_cleanup"):
+        allocate_patron_names()
+    stage_profiler.close()
+    assert [path.name for path in stage_profiler.files] == [
+        "staff.pstats",
+        "staff.allocations.txt",
+    ]
+
+
+def test_stage_profiler_profiles_stages_on_threads_one_at_a_time(tmp_path):
+    stage_profiler = StageProfiler(str(tmp_path))
+    profiled_stages = []
+
+    def profile(stage):
+        with stage_profiler.profile(stage):
+            profiled_stages.append(f"{stage} started")
+            allocate_patron_names()
+            profiled_stages.append(f"{stage} finished")
+
+    threads = [
+        threading.Thread(target=profile, args=(stage,)) for stage in ["staff", "student"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stage_profiler.close()
+    assert profiled_stages in (
+        ["staff started", "staff finished", "student started", "student finished"],
+        ["student started", "student finished", "staff started", "staff finished"],
+    )
+    assert len(stage_profiler.files) == 2 + 2
+
+
+def test_stage_profiler_uploads_files(tmp_path, mocked_s3):
+    stage_profiler = StageProfiler(str(tmp_path))
+    with stage_profiler.profile("email"):
+        allocate_patron_names()
+    stage_profiler.close()
+    stage_profiler.upload(mocked_s3, "test-bucket", "diagnostics")
+    assert sorted(
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(
+            Bucket="test-bucket", Prefix="diagnostics"
+        )["Contents"]
+    ) == [
+        f"diagnostics/{stage_profiler.run_name}/email.allocations.txt",
+        f"diagnostics/{stage_profiler.run_name}/email.pstats",
+    ]
+
+
+def test_profile_stage_without_profiler_does_nothing(tmp_path):
+    with profile_stage(None, "email"):
+        allocate_patron_names()
+    assert not list(tmp_path.iterdir())
@@ -1,6 +1,17 @@
+import gc
 import logging
+from unittest.mock import MagicMock, patch
 
-from patronload.s3 import delete_zip_files_from_bucket_with_prefix
+import pytest
+
+from patronload.s3 import (
+    S3_MAXIMUM_DELETE_KEYS,
+    S3_MINIMUM_PART_SIZE,
+    S3MultipartUploadWriter,
+    delete_zip_files_from_bucket_with_prefix,
+    read_manifest,
+    write_manifest,
+)
 
 
 def test_delete_zip_files_from_bucket_with_prefix_deletes_only_expected_objects(
@@ -19,6 +30,16 @@ def test_delete_zip_files_from_bucket_with_prefix_deletes_only_expected_objects(
     assert len(mocked_s3.list_objects(Bucket="test-bucket")["Contents"]) == 1
 
 
+def test_delete_zip_files_from_bucket_with_prefix_keeps_keep_keys(mocked_s3, s3_client):
+    assert (
+        delete_zip_files_from_bucket_with_prefix(
+            s3_client, "test-bucket", "patronload", keep_keys={"patronload/1.zip"}
+        )
+        == []
+    )
+    assert s3_client.get_object(Bucket="test-bucket", Key="patronload/1.zip")
+
+
 def test_delete_zip_files_from_bucket_with_prefix_nonexistent_prefix_no_objects_deleted(
     mocked_s3, s3_client
 ):
@@ -31,3 +52,133 @@ def test_delete_zip_files_from_bucket_with_prefix_nonexistent_prefix_no_objects_
         len(mocked_s3.list_objects(Bucket="test-bucket")["Contents"])
         == 2  # noqa: PLR2004
     )
+
+
+def test_delete_zip_files_from_bucket_with_prefix_deletes_all_pages_in_batches(
+    caplog, mocked_s3, s3_client
+):
+    for index in range(S3_MAXIMUM_DELETE_KEYS + 200):
+        mocked_s3.put_object(Body="", Bucket="test-bucket", Key=f"patronload/{index}.zip")
+    mocked_s3.put_object(Body="", Bucket="test-bucket", Key="patronload/1.xml")
+    with patch.object(
+        s3_client, "delete_objects", wraps=s3_client.delete_objects
+    ) as delete_objects:
+        deleted_keys = delete_zip_files_from_bucket_with_prefix(
+            s3_client, "test-bucket", "patronload"
+        )
+    assert len(deleted_keys) == S3_MAXIMUM_DELETE_KEYS + 200
+    assert delete_objects.call_count == 2  # noqa: PLR2004
+    assert [
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(Bucket="test-bucket")["Contents"]
+    ] == ["2.zip", "patronload/1.xml"]
+    assert "1200 zip files deleted from S3 bucket 'test-bucket'" in caplog.text
+
+
+def test_delete_zip_files_from_bucket_with_prefix_delete_errors_raise_error(
+    mocked_s3, s3_client
+):
+    s3_client.delete_objects = MagicMock(
+        return_value={
+            "Errors": [
+                {"Key": "patronload/1.zip", "Code": "AccessDenied", "Message": "Denied"}
+            ]
+        }
+    )
+    with pytest.raises(
+        RuntimeError, match=r"first error for 'patronload/1\.zip': Denied"
+    ):
+        delete_zip_files_from_bucket_with_prefix(s3_client, "test-bucket", "patronload")
+
+
+def test_s3_multipart_upload_writer_uploads_parts_while_writing(mocked_s3, s3_client):
+    data = b"0123456789" * (S3_MINIMUM_PART_SIZE // 4)
+    with S3MultipartUploadWriter(
+        s3_client,
+        "test-bucket",
+        "patronload/test.zip",
+        part_size=S3_MINIMUM_PART_SIZE,
+        max_concurrency=2,
+    ) as upload:
+        for start in range(0, len(data), 1024 * 1024):
+            upload.write(data[start : start + 1024 * 1024])
+        assert upload.tell() == len(data)
+    assert len(upload.parts) == 3  # noqa: PLR2004
+    assert (
+        s3_client.get_object(Bucket="test-bucket", Key="patronload/test.zip")[
+            "Body"
+        ].read()
+        == data
+    )
+
+
+def test_s3_multipart_upload_writer_small_upload_success(mocked_s3, s3_client):
+    with S3MultipartUploadWriter(
+        s3_client, "test-bucket", "patronload/test.zip"
+    ) as upload:
+        upload.write(b"zip")
+    assert (
+        s3_client.get_object(Bucket="test-bucket", Key="patronload/test.zip")[
+            "Body"
+        ].read()
+        == b"zip"
+    )
+
+
+def test_s3_multipart_upload_writer_aborts_on_failed_part_upload(
+    caplog, mocked_s3, s3_client
+):
+    upload = S3MultipartUploadWriter(s3_client, "test-bucket", "patronload/test.zip")
+    upload.write(b"zip")
+    with (
+        patch.object(s3_client, "upload_part", side_effect=RuntimeError("Upload failed")),
+        pytest.raises(RuntimeError, match="Upload failed"),
+    ):
+        upload.close()
+    assert upload.closed
+    assert "Multipart upload of 'patronload/test.zip' aborted" in caplog.text
+    assert "Uploads" not in s3_client.list_multipart_uploads(Bucket="test-bucket")
+    assert (
+        len(mocked_s3.list_objects(Bucket="test-bucket")["Contents"])
+        == 2  # noqa: PLR2004
+    )
+
+
+def test_s3_multipart_upload_writer_aborts_on_exception_in_context(mocked_s3, s3_client):
+    upload = S3MultipartUploadWriter(s3_client, "test-bucket", "patronload/test.zip")
+    upload.write(b"zip")
+    upload.__exit__(RuntimeError, RuntimeError(), None)
+    assert upload.closed
+    assert "Uploads" not in s3_client.list_multipart_uploads(Bucket="test-bucket")
+
+
+def test_s3_multipart_upload_writer_aborts_when_abandoned(caplog, mocked_s3, s3_client):
+    upload = S3MultipartUploadWriter(s3_client, "test-bucket", "patronload/test.zip")
+    upload.write(b"zip")
+    del upload
+    gc.collect()
+    assert "Multipart upload of 'patronload/test.zip' aborted" in caplog.text
+    assert "Uploads" not in s3_client.list_multipart_uploads(Bucket="test-bucket")
+    assert [
+        s3_object["Key"]
+        for s3_object in mocked_s3.list_objects_v2(Bucket="test-bucket")["Contents"]
+    ] == ["2.zip", "patronload/1.zip"]
+
+
+def test_s3_multipart_upload_writer_part_size_too_small_raises_error(
+    mocked_s3, s3_client
+):
+    with pytest.raises(ValueError, match="Part size must be at least 5242880 bytes"):
+        S3MultipartUploadWriter(
+            s3_client, "test-bucket", "patronload/test.zip", part_size=1024
+        )
+
+
+def test_read_manifest_no_manifest_returns_empty_manifest(mocked_s3, s3_client):
+    assert read_manifest(s3_client, "test-bucket", "patronload/manifest.json") == {}
+
+
+def test_write_manifest_success(mocked_s3, s3_client):
+    manifest = {"staff": {"hash": "abc", "record_count": 1}}
+    write_manifest(s3_client, "test-bucket", "patronload/manifest.json", manifest)
+    assert read_manifest(s3_client, "test-bucket", "patronload/manifest.json") == manifest
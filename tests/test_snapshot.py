@@ -0,0 +1,113 @@
+import datetime
+
+import pytest
+from freezegun import freeze_time
+
+from patronload.snapshot import SnapshotDataSource, SnapshotStore
+
+
+class ListDataSource:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def describe(self):
+        return "list"
+
+    def query(self, fields, table, *, partitions=1, predicates=None):  # noqa: ARG002
+        return ListQueryResults(self.rows)
+
+
+class ListQueryResults:
+    def __init__(self, rows):
+        self.rows = rows
+        self.row_count = 0
+
+    def __iter__(self):  # noqa: D105
+        for row in self.rows:
+            self.row_count += 1
+            yield row
+
+
+@pytest.fixture
+def staff_rows():
+    return [
+        ("111111111", "NAME_1", datetime.datetime(2023, 6, 30, tzinfo=datetime.UTC)),
+        ("222222222", None, None),
+    ]
+
+
+def test_snapshot_data_source_records_and_replays_rows(tmp_path, staff_rows):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    fields = ["MIT_ID", "KRB_NAME_UPPERCASE", "APPOINTMENT_END_DATE"]
+    patron_records = SnapshotDataSource(snapshot_store, ListDataSource(staff_rows)).query(
+        fields, "LIBRARY_EMPLOYEE"
+    )
+    assert list(patron_records) == staff_rows
+    assert patron_records.row_count == 2  # noqa: PLR2004
+    replayed_records = SnapshotDataSource(snapshot_store).query(
+        fields, "LIBRARY_EMPLOYEE"
+    )
+    assert list(replayed_records) == staff_rows
+    assert replayed_records.row_count == 2  # noqa: PLR2004
+
+
+def test_snapshot_data_source_replays_subset_of_fields(tmp_path, staff_rows):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    snapshot_store.write(
+        "LIBRARY_EMPLOYEE",
+        ["MIT_ID", "KRB_NAME_UPPERCASE", "APPOINTMENT_END_DATE"],
+        [list(column) for column in zip(*staff_rows, strict=True)],
+    )
+    assert list(
+        SnapshotDataSource(snapshot_store).query(
+            ["KRB_NAME_UPPERCASE", "MIT_ID"], "LIBRARY_EMPLOYEE"
+        )
+    ) == [("NAME_1", "111111111"), (None, "222222222")]
+
+
+def test_snapshot_data_source_incomplete_query_not_recorded(tmp_path, staff_rows):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    patron_records = iter(
+        SnapshotDataSource(snapshot_store, ListDataSource(staff_rows)).query(
+            ["MIT_ID", "KRB_NAME_UPPERCASE", "APPOINTMENT_END_DATE"],
+            "LIBRARY_EMPLOYEE",
+        )
+    )
+    next(patron_records)
+    assert not (tmp_path / "LIBRARY_EMPLOYEE.json.gz").exists()
+
+
+def test_snapshot_store_read_missing_snapshot_raises_error(tmp_path):
+    with pytest.raises(RuntimeError, match="No snapshot of LIBRARY_STUDENT found"):
+        SnapshotStore(str(tmp_path)).read("LIBRARY_STUDENT", ["MIT_ID"])
+
+
+def test_snapshot_store_read_missing_fields_raises_error(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path))
+    snapshot_store.write("LIBRARY_EMPLOYEE", ["MIT_ID"], [["111111111"]])
+    with pytest.raises(RuntimeError, match="does not have the fields: ORG_UNIT_ID"):
+        snapshot_store.read("LIBRARY_EMPLOYEE", ["MIT_ID", "ORG_UNIT_ID"])
+
+
+def test_snapshot_store_read_expired_snapshot_raises_error(tmp_path):
+    snapshot_store = SnapshotStore(str(tmp_path), ttl=datetime.timedelta(hours=2))
+    with freeze_time("2023-03-01 12:00:00"):
+        snapshot_store.write("LIBRARY_EMPLOYEE", ["MIT_ID"], [["111111111"]])
+    with freeze_time("2023-03-01 13:59:00"):
+        assert snapshot_store.read("LIBRARY_EMPLOYEE", ["MIT_ID"]) == [["111111111"]]
+    with (
+        freeze_time("2023-03-01 14:01:00"),
+        pytest.raises(RuntimeError, match="has expired"),
+    ):
+        snapshot_store.read("LIBRARY_EMPLOYEE", ["MIT_ID"])
+
+
+def test_snapshot_store_s3_location(mocked_s3):
+    snapshot_store = SnapshotStore("s3://test-bucket/snapshots/", mocked_s3)
+    with pytest.raises(RuntimeError, match="No snapshot of LIBRARY_EMPLOYEE found"):
+        snapshot_store.read("LIBRARY_EMPLOYEE", ["MIT_ID"])
+    snapshot_store.write("LIBRARY_EMPLOYEE", ["MIT_ID"], [["111111111"]])
+    assert mocked_s3.head_object(
+        Bucket="test-bucket", Key="snapshots/LIBRARY_EMPLOYEE.json.gz"
+    )
+    assert snapshot_store.read("LIBRARY_EMPLOYEE", ["MIT_ID"]) == [["111111111"]]
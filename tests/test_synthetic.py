@@ -0,0 +1,92 @@
+from patronload.config import STAFF_FIELDS, STUDENT_FIELDS
+from patronload.patron import KrbNameRegistry, patrons_xml_string_from_records
+from patronload.synthetic import (
+    UNKNOWN_STAFF_DEPARTMENT,
+    UNKNOWN_STUDENT_DEPARTMENT,
+    SyntheticPatrons,
+    krb_name,
+)
+
+
+def test_synthetic_patrons_are_reproducible_from_seed():
+    assert list(SyntheticPatrons(1).staff_records(100)) == list(
+        SyntheticPatrons(1).staff_records(100)
+    )
+    assert list(SyntheticPatrons(1).student_records(100)) != list(
+        SyntheticPatrons(2).student_records(100)
+    )
+
+
+def test_synthetic_patrons_rows_match_fields():
+    staff_records = list(SyntheticPatrons().staff_records(10))
+    student_records = list(SyntheticPatrons().student_records(10))
+    assert len(staff_records) == len(student_records) == 10  # noqa: PLR2004
+    assert {len(staff_record) for staff_record in staff_records} == {len(STAFF_FIELDS)}
+    assert {len(student_record) for student_record in student_records} == {
+        len(STUDENT_FIELDS)
+    }
+
+
+def test_synthetic_patrons_without_irregular_rows():
+    synthetic_patrons = SyntheticPatrons(
+        null_share=0,
+        missing_krb_name_share=0,
+        duplicate_share=0,
+        unknown_department_share=0,
+        student_employee_share=0,
+    )
+    staff_records = list(synthetic_patrons.staff_records(100))
+    assert all(value is not None for value in staff_records[0][:4])
+    assert [staff_record[2] for staff_record in staff_records] == [
+        krb_name("staff", index) for index in range(100)
+    ]
+    assert UNKNOWN_STAFF_DEPARTMENT not in {
+        staff_record[STAFF_FIELDS.index("ORG_UNIT_ID")] for staff_record in staff_records
+    }
+
+
+def test_synthetic_patrons_with_only_irregular_rows():
+    synthetic_patrons = SyntheticPatrons(
+        null_share=1, missing_krb_name_share=0, unknown_department_share=1
+    )
+    staff_records = list(synthetic_patrons.staff_records(10))
+    assert {staff_record[3:] for staff_record in staff_records} == {
+        (None,) * (len(STAFF_FIELDS) - 3)
+    }
+    student_records = list(
+        SyntheticPatrons(unknown_department_share=1, null_share=0).student_records(10)
+    )
+    assert {
+        student_record[STUDENT_FIELDS.index("HOME_DEPARTMENT")]
+        for student_record in student_records
+    } == {UNKNOWN_STUDENT_DEPARTMENT}
+    assert {
+        staff_record[2]
+        for staff_record in SyntheticPatrons(missing_krb_name_share=1).staff_records(10)
+    } == {None}
+
+
+def test_synthetic_student_employees_are_only_loaded_as_staff():
+    synthetic_patrons = SyntheticPatrons(
+        missing_krb_name_share=0, duplicate_share=0, student_employee_share=1
+    )
+    staff_records = list(synthetic_patrons.staff_records(10))
+    student_records = list(synthetic_patrons.student_records(10, staff_count=10))
+    staff_krb_names = {staff_record[2] for staff_record in staff_records}
+    assert {student_record[2] for student_record in student_records} <= staff_krb_names
+    krb_name_registry = KrbNameRegistry()
+    patrons_xml_string_from_records("staff", staff_records, krb_name_registry)
+    patrons_xml_string_from_records("student", student_records, krb_name_registry)
+    assert krb_name_registry.claims["student"] == 0
+    assert krb_name_registry.duplicates["student"] == 10  # noqa: PLR2004
+
+
+def test_synthetic_duplicate_krb_names_are_skipped():
+    synthetic_patrons = SyntheticPatrons(missing_krb_name_share=0, duplicate_share=0.5)
+    staff_records = list(synthetic_patrons.staff_records(100))
+    krb_name_registry = KrbNameRegistry()
+    patrons_xml_string_from_records("staff", staff_records, krb_name_registry)
+    assert krb_name_registry.duplicates["staff"] == len(staff_records) - len(
+        {staff_record[2] for staff_record in staff_records}
+    )
+    assert krb_name_registry.duplicates["staff"] > 0
@@ -0,0 +1,58 @@
+import pytest
+
+from patronload.template import (
+    Block,
+    Slot,
+    compile_markup,
+    compile_patron_template,
+    escape_attribute,
+    escape_text,
+)
+
+
+def test_escape_text_escapes_ampersands_and_brackets():
+    assert escape_text("A & <B>") == "A &amp; &lt;B&gt;"
+
+
+def test_escape_attribute_quotes_value():
+    assert escape_attribute("Staff") == '"Staff"'
+    assert escape_attribute('"Staff"') == "'\"Staff\"'"
+    assert escape_attribute('"Staff\'s"') == '"&quot;Staff\'s&quot;"'
+
+
+def test_compile_markup_success():
+    compiled_template = compile_markup(
+        '<a desc="\x00@desc\x00">\x00text\x00</a>\x00#block\x00<b>\x00value\x00</b>'
+        "\x00/block\x00"
+    )
+    assert compiled_template.parts == (
+        "<a desc=",
+        Slot("desc", attribute=True),
+        ">",
+        Slot("text"),
+        "</a>",
+        Block("block", ("<b>", Slot("value"), "</b>"), ("value",)),
+    )
+    assert (
+        compiled_template.render({"desc": "A & B", "text": "1", "value": "2"})
+        == b'<a desc="A &amp; B">1</a><b>2</b>'
+    )
+    assert (
+        compiled_template.render({"desc": "", "text": "1", "value": None})
+        == b'<a desc="">1</a>'
+    )
+
+
+def test_compile_markup_unbalanced_block_raises_error():
+    with pytest.raises(ValueError, match="Unbalanced template block 'other'"):
+        compile_markup("\x00#block\x00\x00/other\x00")
+
+
+def test_compile_markup_unclosed_block_raises_error():
+    with pytest.raises(ValueError, match="Unclosed template block 'block'"):
+        compile_markup("\x00#block\x00")
+
+
+def test_compile_patron_template_is_cached():
+    assert compile_patron_template("staff") is compile_patron_template("staff")
+    assert compile_patron_template("staff") is not compile_patron_template("student")